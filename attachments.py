@@ -0,0 +1,129 @@
+import hashlib
+import os
+import re
+import threading
+
+from avatars import pillow
+
+
+# ================= ATTACHMENTS =================
+# Картинки лежат один раз под именем-хешем содержимого: сколько бы раз
+# фото ни пересылали, на диске и у релея оно одно. В тексте сообщения —
+# только ссылка "img:<sha256>:<ширина>x<высота>", размер нужен, чтобы
+# заглушка в чате сразу заняла своё место и ничего не прыгало.
+
+ATTACHMENTS_DIR = "attachments"
+
+PREVIEW = 320       # длинная сторона превью в чате
+
+REF = re.compile(r"img:([0-9a-f]{64})(?::(\d+)x(\d+))?$")
+
+lock = threading.Lock()  # куски вложений пишет поток чтения клиента
+downloads = {}           # hash -> [sha256 уже полученного, следующий offset]
+
+
+def parse_ref(text):
+    # "img:<hash>:WxH" -> (hash, w, h); старые "img:<путь>" -> None
+    match = REF.match(text)
+    if not match:
+        return None
+    digest, width, height = match.groups()
+    return digest, int(width or 0), int(height or 0)
+
+
+def make_ref(digest, width, height):
+    return f"img:{digest}:{width}x{height}"
+
+
+def blob_path(digest):
+    return os.path.join(ATTACHMENTS_DIR, digest)
+
+
+def preview_path(digest):
+    return os.path.join(ATTACHMENTS_DIR, f"{digest}_{PREVIEW}.jpg")
+
+
+def has_blob(digest):
+    return os.path.exists(blob_path(digest))
+
+
+def preview_src(digest):
+    # None — картинки ещё нет, её надо скачать
+    if os.path.exists(preview_path(digest)):
+        return preview_path(digest)
+    if has_blob(digest):
+        return blob_path(digest)
+    return None
+
+
+def make_preview(digest):
+    # -> (ширина, высота) оригинала; 0, 0 — без Pillow или не картинка.
+    # Без Pillow превью нет — в пузыре показывается сам файл
+    if pillow() is None:
+        return 0, 0
+
+    Image, ImageOps = pillow()
+    try:
+        with Image.open(blob_path(digest)) as image:
+            image = ImageOps.exif_transpose(image)
+            size = image.size
+            # пересланное фото: превью уже есть, нужен только размер
+            if not os.path.exists(preview_path(digest)):
+                image = image.convert("RGB")
+                image.thumbnail((PREVIEW, PREVIEW), Image.LANCZOS)
+                image.save(preview_path(digest), quality=80)
+    except OSError:
+        return 0, 0
+    return size
+
+
+def save_attachment(path):
+    # файл пользователя -> (hash, размер, ширина, высота);
+    # повторное фото с тем же содержимым ничего не пишет
+    with open(path, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+
+    os.makedirs(ATTACHMENTS_DIR, exist_ok=True)
+    if not has_blob(digest):
+        tmp = blob_path(digest) + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, blob_path(digest))
+
+    width, height = make_preview(digest)
+    return digest, len(data), width, height
+
+
+def receive_chunk(digest, offset, total, data):
+    # кусок от релея -> (ширина, высота), когда файл собран и хеш сошёлся,
+    # иначе None. Релей шлёт куски по порядку (после обрыва — снова
+    # с нуля), поэтому хеш считаем по ходу, не перечитывая файл
+    if has_blob(digest):
+        return make_preview(digest)
+
+    part = blob_path(digest) + ".part"
+    with lock:
+        download = downloads.get(digest)
+        if offset == 0:
+            download = downloads[digest] = [hashlib.sha256(), 0]
+        if download is None or offset != download[1]:
+            return None
+
+        os.makedirs(ATTACHMENTS_DIR, exist_ok=True)
+        with open(part, "ab" if offset else "wb") as f:
+            f.write(data)
+        download[0].update(data)
+        download[1] += len(data)
+
+        if download[1] < total:
+            return None
+
+        del downloads[digest]
+        if download[0].hexdigest() != digest:
+            # битый или чужой файл — скачаем заново при следующем показе
+            os.remove(part)
+            return None
+        os.replace(part, blob_path(digest))
+
+    return make_preview(digest)
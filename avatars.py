@@ -0,0 +1,114 @@
+import functools
+import hashlib
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+
+# ================= AVATARS =================
+
+AVATARS_DIR = "avatars"
+
+SMALL = 128  # список чатов и шапка чата (радиус 18–20)
+LARGE = 384  # профиль (радиус 60)
+SIZES = (SMALL, LARGE)
+
+MAX_USERS = 512  # сколько username держим в LRU
+
+user_avatars = OrderedDict()  # username -> значение users.avatar
+lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def pillow():
+    # Pillow импортируем при первой картинке, а не на старте приложения
+    # (десятки миллисекунд до первого кадра на телефоне).
+    # None — Pillow не установлен
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return None
+    return Image, ImageOps
+
+
+def save_avatar(path):
+    # Возвращает значение для users.avatar. Имя — хеш содержимого,
+    # поэтому новая картинка никогда не совпадает со старой в кешах.
+    os.makedirs(AVATARS_DIR, exist_ok=True)
+    with open(path, "rb") as f:
+        digest = hashlib.sha1(f.read()).hexdigest()[:16]
+
+    if pillow() is None:
+        # без Pillow аватар копируется как есть, только под именем-хешем
+        return copy_avatar(path, digest)
+
+    Image, ImageOps = pillow()
+    try:
+        with Image.open(path) as image:
+            image = ImageOps.exif_transpose(image).convert("RGB")
+
+            # квадрат из центра, потом фиксированные размеры
+            side = min(image.size)
+            left = (image.width - side) // 2
+            top = (image.height - side) // 2
+            square = image.crop((left, top, left + side, top + side))
+
+            for size in SIZES:
+                thumb = square.resize((size, size), Image.LANCZOS) if side > size else square
+                thumb.save(os.path.join(AVATARS_DIR, f"{digest}_{size}.jpg"), quality=85)
+    except OSError:
+        # Pillow не разобрал файл (UnidentifiedImageError — тоже OSError):
+        # как без Pillow, кладём его как есть
+        return copy_avatar(path, digest)
+
+    return digest
+
+
+def copy_avatar(path, digest):
+    filename = digest + os.path.splitext(path)[1].lower()
+    shutil.copy(path, os.path.join(AVATARS_DIR, filename))
+    return filename
+
+
+@functools.lru_cache(maxsize=2048)
+def thumbnail_src(avatar, size):
+    # avatar неизменяем (хеш), так что путь можно кешировать навсегда
+    if not avatar:
+        return None
+
+    thumb = f"{AVATARS_DIR}/{avatar}_{size}.jpg"
+    if os.path.exists(thumb):
+        return thumb
+
+    # старые аватары и установки без Pillow — полноразмерный файл
+    return f"{AVATARS_DIR}/{avatar}"
+
+
+def remember(username, avatar):
+    with lock:
+        user_avatars[username] = avatar
+        user_avatars.move_to_end(username)
+        if len(user_avatars) > MAX_USERS:
+            user_avatars.popitem(last=False)
+
+
+def forget(username):
+    with lock:
+        user_avatars.pop(username, None)
+
+
+def avatar_src(cur, username, size):
+    with lock:
+        known = username in user_avatars
+        if known:
+            user_avatars.move_to_end(username)
+            avatar = user_avatars[username]
+
+    if not known:
+        cur.execute("SELECT avatar FROM users WHERE username=?", (username,))
+        row = cur.fetchone()
+        avatar = row[0] if row else ""
+        remember(username, avatar)
+
+    return thumbnail_src(avatar, size)
@@ -0,0 +1,146 @@
+# Вложения против текста: задержка текстовых сообщений @a -> @b без
+# вложений, во время загрузки большого файла на релей и во время его
+# скачивания получателем. Плюс повторная отправка того же файла: релей
+# узнаёт его по хешу и подтверждает сразу, второй копии нет.
+#
+#   python bench/attachments_bench.py --size 20 --texts 200 --codec binary
+
+import argparse
+import hashlib
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import attachments
+from client import RelayClient
+from outbound_bench import start_relay
+
+CHAT = "private_@a_@b"
+
+
+class Peer:
+
+    def __init__(self, name, port, codec):
+        self.latencies = []
+        self.blob_done = threading.Event()
+        self.client = RelayClient(name, self.on_frame, port=port, codec=codec, on_blob=self.on_blob)
+        self.client.start()
+        while not self.client.connected:
+            time.sleep(0.01)
+
+    def on_frame(self, msg):
+        if msg.get("text", "").startswith("t:"):
+            self.latencies.append(time.perf_counter() - float(msg["text"][2:]))
+
+    def on_blob(self, msg):
+        size = attachments.receive_chunk(msg["hash"], msg["offset"], msg["total"], msg["data"])
+        if size is not None:
+            self.blob_done.set()
+        return size
+
+
+def send_texts(sender, count, interval):
+    for _ in range(count):
+        sender.client.send({
+            "chat_id": CHAT,
+            "sender": "@a",
+            "text": f"t:{time.perf_counter()!r}",
+            "time": "12:00"
+        })
+        time.sleep(interval)
+
+
+def wait_texts(receiver, count, timeout=60):
+    deadline = time.monotonic() + timeout
+    while len(receiver.latencies) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    latencies = receiver.latencies[:]
+    receiver.latencies.clear()
+    return latencies
+
+
+def report(name, latencies, expected):
+    if not latencies:
+        print(f"{name:24}: ничего не дошло")
+        return
+    ordered = sorted(latencies)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    print(
+        f"{name:24}: {len(latencies)}/{expected}, медиана {statistics.median(ordered) * 1000:.1f} мс, "
+        f"p99 {p99 * 1000:.1f} мс, макс {ordered[-1] * 1000:.1f} мс"
+    )
+
+
+def wait_acked(client, digest, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with client.lock:
+            if all(item[0] != digest for item in client.uploads):
+                return True
+        time.sleep(0.005)
+    return False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=20, help="МБ")
+    parser.add_argument("--texts", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=0.005)
+    parser.add_argument("--codec", default="binary")
+    parser.add_argument("--port", type=int, default=5080)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        attachments.ATTACHMENTS_DIR = os.path.join(tmp, "received")
+        source = os.path.join(tmp, "photo.bin")
+        with open(source, "wb") as f:
+            f.write(os.urandom(args.size * 1024 * 1024))
+        with open(source, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        total = os.path.getsize(source)
+
+        relay = start_relay(args.port, os.path.join(tmp, "relay.db"))
+        try:
+            a = Peer("@a", args.port, args.codec)
+            b = Peer("@b", args.port, args.codec)
+
+            send_texts(a, args.texts, args.interval)
+            report("только текст", wait_texts(b, args.texts), args.texts)
+
+            started = time.perf_counter()
+            a.client.upload(digest, source, total)
+            send_texts(a, args.texts, args.interval)
+            report("во время загрузки", wait_texts(b, args.texts), args.texts)
+            acked = wait_acked(a.client, digest)
+            upload_time = time.perf_counter() - started
+
+            started = time.perf_counter()
+            b.client.fetch(digest)
+            send_texts(a, args.texts, args.interval)
+            report("во время скачивания", wait_texts(b, args.texts), args.texts)
+            b.blob_done.wait(120)
+            fetch_time = time.perf_counter() - started
+
+            # тот же файл ещё раз — как пересылка
+            started = time.perf_counter()
+            a.client.upload(digest, source, total)
+            wait_acked(a.client, digest)
+            again_time = time.perf_counter() - started
+
+            print(
+                f"загрузка {args.size} МБ: {upload_time:.2f} с ({'подтверждена' if acked else 'нет ответа'}), "
+                f"скачивание: {fetch_time:.2f} с ({'хеш совпал' if b.blob_done.is_set() else 'не дошло'})"
+            )
+            stored = [name for name in os.listdir(os.path.join(tmp, "relay_blobs")) if not name.endswith(".part")]
+            print(f"повторная отправка: {again_time * 1000:.1f} мс, файлов у релея: {len(stored)}")
+
+            a.client.close()
+            b.client.close()
+        finally:
+            relay.kill()
@@ -0,0 +1,91 @@
+# Список чатов на 1k чатов: прежний N+1 (участники и аватар на каждый чат)
+# против одного запроса db.chat_list.
+#
+#   python bench/chat_list_bench.py --chats 1000 --messages 100000
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from db import connect, chat_list
+
+ME = "@me"
+SAMPLES = 10
+
+
+def build(path, chats, messages, seed=1):
+    rnd = random.Random(seed)
+    conn = connect(path)
+
+    others = [f"@user{i}" for i in range(chats)]
+    conn.executemany(
+        "INSERT INTO users (username, name, avatar) VALUES (?, ?, ?)",
+        [(ME, "me", "")] + [(u, u[1:], f"{u[1:]}.png") for u in others]
+    )
+
+    chat_ids = []
+    for other in others:
+        u1, u2 = sorted([ME, other])
+        cid = f"private_{u1}_{u2}"
+        chat_ids.append((cid, other))
+        conn.execute("INSERT INTO chats (id, name) VALUES (?, ?)", (cid, other))
+        conn.execute("INSERT INTO members (chat_id, username) VALUES (?, ?)", (cid, u1))
+        conn.execute("INSERT INTO members (chat_id, username) VALUES (?, ?)", (cid, u2))
+
+    rows = []
+    for i in range(messages):
+        cid, other = rnd.choice(chat_ids)
+        rows.append((cid, rnd.choice((ME, other)), f"сообщение {i}", "12:00"))
+    conn.executemany("INSERT INTO messages (chat_id, sender, text, time) VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+    return conn
+
+
+def n_plus_one(cur):
+    # как show_chats считал раньше
+    queries = 1
+    cur.execute("""
+                SELECT c.id
+                FROM chats c
+                         JOIN members m ON c.id = m.chat_id
+                WHERE m.username = ?
+                """, (ME,))
+    result = []
+    for (cid,) in cur.fetchall():
+        cur.execute("SELECT username FROM members WHERE chat_id=?", (cid,))
+        other = next((m for (m,) in cur.fetchall() if m != ME), ME)
+        cur.execute("SELECT avatar FROM users WHERE username=?", (other,))
+        result.append((cid, other, cur.fetchone()[0]))
+        queries += 2
+    return result, queries
+
+
+def timed(fn):
+    started = time.perf_counter()
+    for _ in range(SAMPLES):
+        result = fn()
+    return (time.perf_counter() - started) / SAMPLES, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=100_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = build(os.path.join(tmp, "chats.db"), args.chats, args.messages)
+        cur = conn.cursor()
+
+        old, (rows, queries) = timed(lambda: n_plus_one(cur))
+        new, summary = timed(lambda: chat_list(cur, ME))
+        assert len(summary) == len(rows) == args.chats
+
+        print(f"N+1 (только собеседник и аватар): {old * 1000:7.2f} мс, {queries} запросов")
+        print(f"chat_list (+ последнее и непрочитанные): {new * 1000:7.2f} мс, 1 запрос")
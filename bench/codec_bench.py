@@ -0,0 +1,117 @@
+# Двоичный кодек против JSON на потоке, похожем на настоящий: несколько
+# собеседников, время HH:MM, короткие тексты. Меряем кодирование и
+# разбор в одном соединении и байты на сообщение вместе с кадрированием
+# (LINE — "\n", LENGTH — 4 байта длины). В конце — живой обмен через
+# релей: @a на двоичном кодеке, @b на JSON.
+#
+#   python bench/codec_bench.py --messages 100000
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from client import RelayClient
+from codec import Encoder, Decoder, BINARY
+from outbound_bench import start_relay
+
+WORDS = "привет как дела ок завтра встреча в офисе да нет hello see you later 👍".split()
+
+
+def stream(count, peers=8):
+    rng = random.Random(1)
+    me = "@me"
+    chats = [(f"private_{me}_@u{i:02}", f"@u{i:02}") for i in range(peers)]
+    out = []
+    for i in range(count):
+        chat_id, peer = rng.choice(chats)
+        out.append({
+            "id": 1000000 + i,
+            "chat_id": chat_id,
+            "sender": rng.choice((me, peer)),
+            "text": " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 12))),
+            "time": f"{9 + i * 12 // count:02}:{i * 7 % 60:02}"
+        })
+    return out
+
+
+def measure(name, encode, decode, messages, overhead):
+    started = time.perf_counter()
+    frames = [encode(msg) for msg in messages]
+    encoded = time.perf_counter() - started
+
+    started = time.perf_counter()
+    decoded = [decode(frame) for frame in frames]
+    parsed = time.perf_counter() - started
+
+    assert decoded == messages
+    size = sum(map(len, frames)) + overhead * len(frames)
+    print(
+        f"{name:16}: {size / len(frames):6.1f} байт/сообщ., "
+        f"кодирование {encoded / len(frames) * 1e6:.2f} мкс, разбор {parsed / len(frames) * 1e6:.2f} мкс"
+    )
+    return size
+
+
+def live(port, count):
+    # @a пишет двоичным кодеком, @b читает JSON — релей переводит
+    received = []
+    done = threading.Event()
+
+    def on_frame(msg):
+        received.append(msg)
+        if len(received) >= count:
+            done.set()
+
+    a = RelayClient("@a", lambda msg: None, port=port, codec=BINARY)
+    b = RelayClient("@b", on_frame, port=port)
+    a.start()
+    b.start()
+    while not (a.connected and b.connected and a.encoder):
+        time.sleep(0.01)
+
+    sent = stream(count)
+    for msg in sent:
+        a.send({"chat_id": "private_@a_@b", "sender": "@a", "text": msg["text"], "time": msg["time"]})
+    done.wait(60)
+    a.close()
+    b.close()
+
+    texts = [msg["text"] for msg in received]
+    return texts == [msg["text"] for msg in sent]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--live", type=int, default=2000)
+    parser.add_argument("--port", type=int, default=5079)
+    args = parser.parse_args()
+
+    messages = stream(args.messages)
+
+    line = measure(
+        "JSON + LINE", lambda msg: json.dumps(msg).encode(), json.loads, messages, 1
+    )
+    measure(
+        "JSON + LENGTH", lambda msg: json.dumps(msg).encode(), json.loads, messages, 4
+    )
+    binary = measure(
+        "binary + LENGTH", Encoder().encode, Decoder().decode, messages, 4
+    )
+    print(f"экономия трафика: {100 - binary * 100 / line:.0f}% против JSON + LINE")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        relay = start_relay(args.port, os.path.join(tmp, "relay.db"))
+        try:
+            ok = live(args.port, args.live)
+            print(f"через релей     : {args.live} сообщений binary -> JSON, совпали: {'да' if ok else 'нет'}")
+        finally:
+            relay.kill()
@@ -0,0 +1,144 @@
+# Синтетическая база приложения: N пользователей, чаты между ними и
+# история сообщений. Схема — актуальная (db.connect с миграциями), сводка
+# списка чатов и FTS заполняются теми же триггерами, что и в приложении.
+# Популярность чатов неравномерная: первые чаты получают большую часть
+# сообщений, как у живого пользователя. Чаты @me — первые my_chats.
+# Та же база годится релею (--db): участников он читает из members.
+#
+#   python bench/datagen.py --db /tmp/fletgram.db --users 10000 --chats 20000 --messages 1000000
+
+import argparse
+import itertools
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from db import connect
+
+ME = "@me"
+WORDS = "привет как дела ок завтра встреча в офисе да нет hello see you later 👍".split()
+INSERT_BATCH = 50000
+
+
+def username(i):
+    return f"@u{i:06}"
+
+
+def private_id(a, b):
+    u1, u2 = sorted([a, b])
+    return f"private_{u1}_{u2}"
+
+
+def text(rnd):
+    return " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 12)))
+
+
+def generate(path, users, chats, messages, my_chats=None, group_size=2, unread=0.05, seed=1):
+    # -> список чатов @me (chat_id, собеседник) по убыванию популярности
+    rnd = random.Random(seed)
+    my_chats = min(users, chats if my_chats is None else my_chats)
+    # личных чатов между остальными не больше, чем пар
+    chats = min(chats, my_chats + users * (users - 1) // 2)
+    others = [username(i) for i in range(users)]
+
+    conn = connect(path)
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.executemany(
+        "INSERT INTO users (username, name, avatar) VALUES (?, ?, ?)",
+        [(ME, "Я", "")] + [(u, f"Пользователь {u[2:]}", "") for u in others]
+    )
+
+    # сначала чаты @me, затем чаты остальных между собой
+    chat_rows = []
+    member_rows = []
+    mine = []
+    for peer in others[:my_chats]:
+        chat_id = private_id(ME, peer)
+        mine.append((chat_id, peer))
+        chat_rows.append((chat_id, peer))
+        member_rows += [(chat_id, ME), (chat_id, peer)]
+
+    seen = {chat_id for chat_id, _ in chat_rows}
+    while len(chat_rows) < chats and users > 1:
+        if group_size > 2:
+            chat_id = f"group_{len(chat_rows)}"
+            members = rnd.sample(others, min(group_size, users))
+            name = f"Группа {len(chat_rows)}"
+        else:
+            a, b = rnd.sample(others, 2)
+            chat_id = private_id(a, b)
+            members = [a, b]
+            name = b
+            if chat_id in seen:
+                continue
+        seen.add(chat_id)
+        chat_rows.append((chat_id, name))
+        member_rows += [(chat_id, member) for member in members]
+
+    conn.executemany("INSERT INTO chats (id, name) VALUES (?, ?)", chat_rows)
+    conn.executemany("INSERT OR IGNORE INTO members (chat_id, username) VALUES (?, ?)", member_rows)
+
+    members = {}
+    for chat_id, member in member_rows:
+        members.setdefault(chat_id, []).append(member)
+
+    # вес чата ~ 1/ранг: верхние чаты живые, хвост почти молчит
+    ids = [chat_id for chat_id, _ in chat_rows]
+    weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(ids))))
+
+    def rows():
+        for i in range(messages):
+            chat_id = rnd.choices(ids, cum_weights=weights)[0]
+            minute = i * 24 * 60 // max(messages, 1)
+            yield (
+                chat_id,
+                rnd.choice(members[chat_id]),
+                text(rnd),
+                f"{minute // 60:02}:{minute % 60:02}",
+                0 if rnd.random() < unread else 1,
+                i + 1
+            )
+
+    source = rows()
+    while True:
+        batch = list(itertools.islice(source, INSERT_BATCH))
+        if not batch:
+            break
+        conn.executemany(
+            "INSERT INTO messages (chat_id, sender, text, time, is_read, relay_id) VALUES (?, ?, ?, ?, ?, ?)",
+            batch
+        )
+
+    conn.executemany("INSERT OR REPLACE INTO settings VALUES (?, ?)", [
+        ("last_user", ME), ("last_user_name", "Я"), ("theme", "dark")
+    ])
+    conn.commit()
+    conn.close()
+    return mine
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default="fletgram.db")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--chats", type=int, default=2000)
+    parser.add_argument("--my-chats", type=int, default=None)
+    parser.add_argument("--group-size", type=int, default=2)
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        sys.exit(f"{args.db} уже есть — генератор пишет только в новую базу")
+
+    started = time.perf_counter()
+    mine = generate(args.db, args.users, args.chats, args.messages,
+                    args.my_chats, args.group_size, seed=args.seed)
+    print(
+        f"{args.db}: {args.users} пользователей, {args.chats} чатов ({len(mine)} у {ME}), "
+        f"{args.messages} сообщений за {time.perf_counter() - started:.1f} с"
+    )
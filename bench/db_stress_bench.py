@@ -0,0 +1,187 @@
+# Нагрузочная проверка доступа к БД из нескольких потоков: отправка
+# (UI), приём (поток listen_server) и открытие чатов идут одновременно.
+# Сначала прежняя схема — один курсор на всех и cur.lastrowid после
+# INSERT, потом Database с потоком-писателем и читателями на поток.
+# Каждый режим идёт в отдельном процессе: общий курсор может уронить
+# интерпретатор целиком.
+#
+#   python bench/db_stress_bench.py --threads 4 --messages 5000
+
+import argparse
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from db import connect, Database
+
+ME = "@me"
+CHATS = 50
+PAGE_SIZE = 50
+
+
+def build(path):
+    conn = connect(path)
+    conn.execute("INSERT INTO users (username, name) VALUES (?, ?)", (ME, "me"))
+    for i in range(CHATS):
+        other = f"@user{i}"
+        u1, u2 = sorted([ME, other])
+        cid = f"private_{u1}_{u2}"
+        conn.execute("INSERT INTO users (username, name) VALUES (?, ?)", (other, other[1:]))
+        conn.execute("INSERT INTO chats (id, name) VALUES (?, ?)", (cid, other))
+        conn.execute("INSERT INTO members (chat_id, username) VALUES (?, ?)", (cid, u1))
+        conn.execute("INSERT INTO members (chat_id, username) VALUES (?, ?)", (cid, u2))
+    conn.commit()
+    chat_ids = [row[0] for row in conn.execute("SELECT id FROM chats")]
+    conn.close()
+    return chat_ids
+
+
+def run_threads(workers):
+    errors = []
+
+    def guarded(fn, *args):
+        try:
+            fn(*args)
+        except Exception as e:
+            errors.append(repr(e))
+
+    threads = [threading.Thread(target=guarded, args=worker) for worker in workers]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - started, errors
+
+
+def check_ids(path, sent):
+    # id, выданный при отправке, должен указывать на тот самый текст
+    conn = sqlite3.connect(path)
+    stored = dict(conn.execute("SELECT id, text FROM messages"))
+    conn.close()
+    wrong = sum(1 for msg_id, text in sent if stored.get(msg_id) != text)
+    return len(stored), wrong
+
+
+def shared_cursor(path, chat_ids, threads, messages):
+    # как было: одно соединение и один курсор на все потоки
+    conn = sqlite3.connect(path, check_same_thread=False)
+    cur = conn.cursor()
+    sent = []
+    opens = []
+
+    def send(name, rnd):
+        for i in range(messages):
+            text = f"{name} {i}"
+            cur.execute(
+                "INSERT INTO messages (chat_id, sender, text, time, is_read) VALUES (?, ?, ?, '12:00', 0)",
+                (rnd.choice(chat_ids), ME, text)
+            )
+            conn.commit()
+            sent.append((cur.lastrowid, text))
+
+    def open_chats(rnd):
+        for _ in range(messages // 10):
+            started = time.perf_counter()
+            cid = rnd.choice(chat_ids)
+            cur.execute(
+                "SELECT id, sender, text, time, is_read FROM messages WHERE chat_id=? ORDER BY id DESC LIMIT ?",
+                (cid, PAGE_SIZE)
+            )
+            cur.fetchall()
+            cur.execute("UPDATE messages SET is_read=1 WHERE chat_id=? AND sender!=? AND is_read=0", (cid, ME))
+            conn.commit()
+            opens.append(time.perf_counter() - started)
+
+    workers = [(send, f"send{n}", random.Random(n)) for n in range(threads)]
+    workers.append((send, "recv", random.Random(-1)))
+    workers.append((open_chats, random.Random(-2)))
+    elapsed, errors = run_threads(workers)
+    conn.close()
+    return elapsed, errors, sent, opens
+
+
+def database(path, chat_ids, threads, messages):
+    db = Database(path)
+    lock = threading.Lock()
+    sent = []
+    opens = []
+
+    def send(name, rnd):
+        for i in range(messages):
+            text = f"{name} {i}"
+            msg_id = db.add_message(rnd.choice(chat_ids), ME, text, "12:00")
+            with lock:
+                sent.append((msg_id, text))
+
+    def open_chats(rnd):
+        for _ in range(messages // 10):
+            started = time.perf_counter()
+            cid = rnd.choice(chat_ids)
+            db.flush()
+            rows = db.history(cid, PAGE_SIZE)
+            db.chat_members(cid)
+            if rows:
+                db.mark_read(cid, ME, rows[-1][0])
+            opens.append(time.perf_counter() - started)
+
+    workers = [(send, f"send{n}", random.Random(n)) for n in range(threads)]
+    workers.append((send, "recv", random.Random(-1)))
+    workers.append((open_chats, random.Random(-2)))
+    elapsed, errors = run_threads(workers)
+    db.close()
+    return elapsed, errors, sent, opens
+
+
+MODES = {"общий курсор": shared_cursor, "Database": database}
+
+
+def run_mode(name, path, threads, messages):
+    chat_ids = build(path)
+
+    elapsed, errors, sent, opens = MODES[name](path, chat_ids, threads, messages)
+    stored, wrong = check_ids(path, sent)
+    opens.sort()
+    p99 = opens[int(len(opens) * 0.99)] * 1000 if opens else 0
+
+    print(
+        f"{name:14}: {len(sent) / elapsed:>9,.0f} сообщений/с, "
+        f"записано {stored}/{(threads + 1) * messages}, "
+        f"чужих id {wrong}, ошибок {len(errors)}, "
+        f"открытие чата p99 {p99:.1f} мс"
+    )
+    for error in sorted(set(errors))[:3]:
+        print("   ", error)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=4, help="потоков-отправителей")
+    parser.add_argument("--messages", type=int, default=5000, help="сообщений на поток")
+    parser.add_argument("--dir", default=None, help="каталог для БД (по умолчанию временный)")
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.db, args.threads, args.messages)
+        sys.exit()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        for name in MODES:
+            path = os.path.join(tmp, name.replace(" ", "_") + ".db")
+            code = subprocess.call([
+                sys.executable, os.path.abspath(__file__),
+                "--mode", name, "--db", path,
+                "--threads", str(args.threads), "--messages", str(args.messages)
+            ])
+            if code:
+                print(f"{name:14}: процесс упал, код {code}")
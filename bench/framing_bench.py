@@ -0,0 +1,174 @@
+# Стресс-тест кадрирования: прогоняем конвейерную пачку из тысяч сообщений,
+# порезанную на случайные куски, через FrameReader в обоих режимах,
+# сравниваем со старым склеиванием строк и проверяем живой релей.
+#
+#   python bench/framing_bench.py --messages 20000
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from framing import FrameReader, encode_frame, LINE, LENGTH
+import relay
+
+
+def make_messages(count, seed=1):
+    rnd = random.Random(seed)
+    messages = []
+    for i in range(count):
+        # в основном короткие, иногда очень длинные сообщения
+        size = rnd.choice([8, 40, 200, 2000]) if i % 100 else 100_000
+        messages.append({
+            "chat_id": "stress",
+            "sender": "@a",
+            "text": f"{i} " + "ж" * size,
+            "time": "12:00"
+        })
+    return messages
+
+
+def chunked(data, seed=2):
+    rnd = random.Random(seed)
+    pos = 0
+    while pos < len(data):
+        size = rnd.randint(1, 8192)
+        yield data[pos:pos + size]
+        pos += size
+
+
+def replay_reader(stream, mode):
+    frames = FrameReader(mode)
+    result = []
+    for chunk in chunked(stream):
+        frames.feed(chunk)
+        for frame in frames.frames():
+            result.append(json.loads(frame))
+    return result
+
+
+def replay_strings(stream):
+    # прежний клиентский цикл: buffer += data; split("\n", 1)
+    buffer = ""
+    result = []
+    pending = b""
+    for chunk in chunked(stream):
+        data = pending + chunk
+        try:
+            text = data.decode()
+            pending = b""
+        except UnicodeDecodeError:
+            # без этого старый код просто падал на разрезанном UTF-8
+            text = data[:-3].decode(errors="ignore")
+            pending = data[len(text.encode()):]
+        buffer += text
+        while "\n" in buffer:
+            line, buffer = buffer.split("\n", 1)
+            result.append(json.loads(line))
+    return result
+
+
+def check_replay(messages):
+    for mode in (LINE, LENGTH):
+        stream = b"".join(encode_frame(json.dumps(m).encode(), mode) for m in messages)
+
+        started = time.perf_counter()
+        result = replay_reader(stream, mode)
+        elapsed = time.perf_counter() - started
+
+        assert result == messages, f"{mode}: кадры потеряны или испорчены"
+        print(f"FrameReader {mode:6}: {len(result)} кадров, "
+              f"{len(stream) / 1e6:.1f} МБ за {elapsed:.2f} с")
+
+    stream = b"".join(encode_frame(json.dumps(m).encode()) for m in messages)
+    started = time.perf_counter()
+    result = replay_strings(stream)
+    elapsed = time.perf_counter() - started
+    assert len(result) == len(messages)
+    print(f"старый str-буфер  : {len(result)} кадров за {elapsed:.2f} с")
+
+
+def check_relay(messages, port):
+    tmp = tempfile.TemporaryDirectory()
+    threading.Thread(
+        target=lambda: asyncio.run(relay.serve("127.0.0.1", port, os.path.join(tmp.name, "relay.db"))),
+        daemon=True
+    ).start()
+
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+    receiver = socket.create_connection(("127.0.0.1", port))
+    receiver.sendall(b"@b")
+    sender = socket.create_connection(("127.0.0.1", port))
+    sender.sendall(b"@a")
+    sender.sendall(encode_frame(json.dumps({
+        "type": "chat", "chat_id": "stress", "members": ["@a", "@b"]
+    }).encode()))
+    time.sleep(0.2)
+
+    # отправитель тоже участник чата: вычитываем эхо, иначе релей его притормозит
+    def drain(sock):
+        try:
+            while sock.recv(65536):
+                pass
+        except OSError:
+            pass
+
+    threading.Thread(target=drain, args=(sender,), daemon=True).start()
+
+    # вся пачка уходит одним sendall — релей получает её склеенной
+    started = time.perf_counter()
+    stream = b"".join(encode_frame(json.dumps(m).encode()) for m in messages)
+    threading.Thread(target=sender.sendall, args=(stream,), daemon=True).start()
+
+    frames = FrameReader()
+    received = 0
+    receiver.settimeout(30)
+    while received < len(messages):
+        data = receiver.recv(65536)
+        if not data:
+            break
+        frames.feed(data)
+        for frame in frames.frames():
+            # релей дописывает id журнала — сверяем остальное и порядок id
+            msg = json.loads(frame)
+            msg_id = msg.pop("id")
+            assert msg == messages[received]
+            assert received == 0 or msg_id == last_id + 1
+            last_id = msg_id
+            received += 1
+    elapsed = time.perf_counter() - started
+
+    assert received == len(messages), f"релей доставил {received} из {len(messages)}"
+    print(f"через релей        : {received} кадров за {elapsed:.2f} с")
+
+    sender.close()
+    receiver.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--port", type=int, default=5901)
+    args = parser.parse_args()
+
+    messages = make_messages(args.messages)
+    check_replay(messages)
+    check_relay(messages, args.port)
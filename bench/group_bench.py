@@ -0,0 +1,130 @@
+# Большая группа: --members участников, из них --online в сети. Один
+# отправитель шлёт --messages сообщений; меряем, за сколько они дошли до
+# всех подключённых, и что ушедшие в офлайн получают пропущенное одной
+# синхронизацией из журнала, а не из очередей на каждого участника.
+#
+#   python bench/group_bench.py --members 5000 --online 1000 --messages 200
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from relay import raise_nofile_limit
+from relay_bench import wait_port, connect
+from presence_bench import expect
+
+
+def name(i):
+    return f"@g{i:05}"
+
+
+async def sync_count(host, port, username):
+    # подключиться заново с last_id=0 и посчитать сообщения в пачках
+    reader, writer = await connect(host, port, username)
+    writer.write(b'{"type":"sync","last_id":0}\n')
+    total = 0
+    while True:
+        msg = json.loads(await reader.readline())
+        if msg.get("type") != "batch":
+            continue
+        total += len(msg["messages"])
+        if not msg["more"]:
+            break
+        writer.write(b'{"type":"sync","last_id":%d}\n' % msg["last_id"])
+    writer.close()
+    return total
+
+
+async def run(args):
+    raise_nofile_limit()
+
+    tmp = tempfile.TemporaryDirectory()
+    relay = subprocess.Popen(
+        [
+            sys.executable, os.path.join(ROOT, "relay.py"),
+            "--port", str(args.port),
+            "--db", os.path.join(tmp.name, "relay.db")
+        ],
+        stdout=subprocess.DEVNULL
+    )
+    try:
+        await wait_port("127.0.0.1", args.port)
+
+        members = [name(i) for i in range(args.members)]
+        conns = [await connect("127.0.0.1", args.port, name(i)) for i in range(args.online)]
+        # pong — релей уже зарегистрировал соединение и не пропустит рассылку
+        for _, w in conns:
+            w.write(b'{"type":"ping"}\n')
+        await asyncio.gather(*(expect(r, 1, "pong") for r, _ in conns))
+        reader, writer = conns[0]
+
+        # группа создаётся кадром chat с названием: он же первое сообщение журнала
+        started = time.perf_counter()
+        writer.write((json.dumps({
+            "type": "chat",
+            "chat_id": "group_bench",
+            "name": "bench",
+            "members": members
+        }) + "\n").encode())
+        await writer.drain()
+        await asyncio.gather(*(expect(r, 1, "chat") for r, _ in conns))
+        create_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for i in range(args.messages):
+            writer.write((json.dumps({
+                "chat_id": "group_bench",
+                "sender": name(0),
+                "text": f"сообщение {i}",
+                "time": "12:00"
+            }) + "\n").encode())
+        await writer.drain()
+
+        async def count(r):
+            seen = 0
+            while seen < args.messages:
+                line = await r.readline()
+                if not line:
+                    break
+                seen += 1
+            return seen
+
+        got = await asyncio.wait_for(asyncio.gather(*(count(r) for r, _ in conns)), timeout=120)
+        fanout_time = time.perf_counter() - started
+
+        for _, w in conns:
+            w.close()
+
+        # участник не в сети: всё пропущенное — из relay_log
+        started = time.perf_counter()
+        missed = await sync_count("127.0.0.1", args.port, name(args.members - 1))
+        sync_time = time.perf_counter() - started
+
+        deliveries = sum(got)
+        print(f"участников:        {args.members}, в сети: {args.online}")
+        print(f"создание группы:   {create_time * 1000:.1f} мс")
+        print(f"рассылка:          {args.messages} сообщений за {fanout_time * 1000:.1f} мс, "
+              f"{deliveries / fanout_time:.0f} доставок/с ({deliveries} из {args.messages * args.online})")
+        print(f"sync офлайн-участника: {missed} сообщений за {sync_time * 1000:.1f} мс")
+
+    finally:
+        relay.terminate()
+        relay.wait()
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--members", type=int, default=5000)
+    parser.add_argument("--online", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--port", type=int, default=5905)
+    asyncio.run(run(parser.parse_args()))
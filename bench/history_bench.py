@@ -0,0 +1,67 @@
+# Первая отрисовка чата: сколько строк и времени уходит на выборку
+# всей истории (как раньше) и на первую страницу keyset-пагинации.
+#
+#   python bench/history_bench.py --lengths 1000 10000 100000 1000000
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from db import connect
+
+PAGE_SIZE = 50
+SAMPLES = 20
+
+
+def timed(cur, sql, args):
+    started = time.perf_counter()
+    for _ in range(SAMPLES):
+        cur.execute(sql, args)
+        rows = cur.fetchall()
+    return (time.perf_counter() - started) / SAMPLES, len(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lengths", type=int, nargs="+", default=[1000, 10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    print(f"{'сообщений':>10} | {'вся история':>12} | {'строк':>8} | {'первая страница':>15} | {'старее':>8}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for length in args.lengths:
+            conn = connect(os.path.join(tmp, f"{length}.db"))
+            conn.executemany(
+                "INSERT INTO messages (chat_id, sender, text, time) VALUES (?, ?, ?, ?)",
+                (("chat", "@a", f"сообщение {i}", "12:00") for i in range(length))
+            )
+            conn.commit()
+            cur = conn.cursor()
+
+            full, full_rows = timed(
+                cur,
+                "SELECT id, sender, text, time, is_read FROM messages WHERE chat_id=? ORDER BY id",
+                ("chat",)
+            )
+            first, _ = timed(
+                cur,
+                "SELECT id, sender, text, time, is_read FROM messages "
+                "WHERE chat_id=? ORDER BY id DESC LIMIT ?",
+                ("chat", PAGE_SIZE)
+            )
+            # страница из середины истории
+            older, _ = timed(
+                cur,
+                "SELECT id, sender, text, time, is_read FROM messages "
+                "WHERE chat_id=? AND id<? ORDER BY id DESC LIMIT ?",
+                ("chat", length // 2, PAGE_SIZE)
+            )
+            conn.close()
+
+            print(f"{length:>10} | {full * 1000:>9.2f} мс | {full_rows:>8} | "
+                  f"{first * 1000:>12.3f} мс | {older * 1000:>5.3f} мс")
@@ -0,0 +1,163 @@
+# Безголовый клиент релея для нагрузочных тестов: тот же протокол, что
+# у приложения (голый username, затем кадры; hello с кадрированием и
+# кодеком, sync, ping), но на asyncio — тысячи соединений в одном
+# процессе без потока на каждое. RelayClient из client.py для этого
+# тяжёл: два потока на соединение и переподключения.
+#
+#   from loadgen import LoadClient
+#   c = await LoadClient.connect("@u1", port, on_message=...)
+#   c.send({"chat_id": ..., "sender": "@u1", "text": ..., "time": ...})
+
+import asyncio
+import os
+import socket
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from framing import FrameReader, encode_frame, LINE, LENGTH
+from codec import Encoder, Decoder, JSON, BINARY, dumps, loads
+
+HOST = "127.0.0.1"
+READ_SIZE = 64 * 1024
+READ_LIMIT = 1024 * 1024
+
+
+class LoadClient:
+
+    def __init__(self, username, reader, writer, framing, codec, on_message):
+        self.username = username
+        self.reader = reader
+        self.writer = writer
+        self.framing = framing
+        self.codec = codec
+        self.on_message = on_message  # (dict) — сообщения чатов, живые и из пачек sync
+        self.encoder = self.decoder = None
+        self.last_id = 0
+        self.received = 0
+        self.synced = asyncio.Event()  # пришла последняя пачка sync
+        self.task = None
+
+    @classmethod
+    async def connect(cls, username, port, host=HOST, framing=LINE, codec=JSON,
+                      on_message=None, last_id=None):
+        # last_id — попросить пропущенное после этого id; None — не просить
+        if codec == BINARY:
+            framing = LENGTH
+
+        reader, writer = await asyncio.open_connection(host, port, limit=READ_LIMIT)
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        client = cls(username, reader, writer, framing, codec, on_message)
+        handshake = username.encode()
+        if framing != LINE:
+            handshake += encode_frame(dumps({"type": "hello", "framing": framing, "codec": codec}))
+        if last_id is not None:
+            client.last_id = last_id
+            handshake += client.encode({"type": "sync", "last_id": last_id})
+        else:
+            client.synced.set()
+        writer.write(handshake)
+        await writer.drain()
+
+        client.task = asyncio.create_task(client.read())
+        return client
+
+    def encode(self, obj):
+        if self.encoder:
+            return encode_frame(self.encoder.encode(obj), self.framing)
+        return encode_frame(dumps(obj), self.framing)
+
+    def send(self, obj):
+        # без drain: отправитель сам решает, когда ждать (см. drain)
+        self.writer.write(self.encode(obj))
+
+    def send_many(self, objs):
+        self.writer.write(b"".join(self.encode(obj) for obj in objs))
+
+    async def drain(self):
+        await self.writer.drain()
+
+    async def join_chat(self, chat_id, members):
+        self.send({"type": "chat", "chat_id": chat_id, "members": members})
+        await self.drain()
+
+    async def ready(self, timeout=10):
+        # двоичный кодек — после ответного hello; до него кадры идут JSON
+        deadline = time.monotonic() + timeout
+        while self.codec == BINARY and not self.encoder:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{self.username}: релей не подтвердил кодек")
+            await asyncio.sleep(0.005)
+        await asyncio.wait_for(self.synced.wait(), timeout)
+
+    async def read(self):
+        frames = FrameReader(self.framing)
+        try:
+            while True:
+                data = await self.reader.read(READ_SIZE)
+                if not data:
+                    break
+                frames.feed(data)
+                for frame in frames.frames():
+                    if frame.strip():
+                        self.dispatch(self.decoder.decode(frame) if self.decoder else loads(frame))
+        except (OSError, ValueError) as e:
+            print(f"{self.username}: ошибка чтения:", e)
+        except asyncio.CancelledError:
+            pass
+
+    def dispatch(self, msg):
+        kind = msg.get("type")
+
+        if kind == "hello":
+            if msg.get("codec") == BINARY and self.codec == BINARY:
+                self.decoder = Decoder()
+                self.encoder = Encoder()
+            return
+
+        if kind == "batch":
+            for item in msg["messages"]:
+                self.deliver(item)
+            self.last_id = max(self.last_id, msg["last_id"])
+            if msg["more"]:
+                self.send({"type": "sync", "last_id": self.last_id})
+            else:
+                self.synced.set()
+            return
+
+        if kind in ("pong", "presence", "blob", "blob_ack"):
+            return
+
+        self.deliver(msg)
+
+    def deliver(self, msg):
+        self.last_id = max(self.last_id, msg.get("id", 0))
+        self.received += 1
+        if self.on_message:
+            self.on_message(self, msg)
+
+    async def close(self):
+        self.writer.close()
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+
+async def wait_port(port, host=HOST, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.05)
+    raise RuntimeError("релей не поднялся")
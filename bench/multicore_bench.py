@@ -0,0 +1,128 @@
+# Масштабирование релея по ядрам: тот же поток сообщений при 1, 2, 4...
+# воркерах (relay.py --workers). Нагрузку дают несколько процессов
+# loadgen — один процесс-генератор сам упрётся в ядро раньше релея.
+# Каждый генератор держит свои пары клиентов; ядро ОС раскидывает
+# соединения по воркерам, так что большая часть сообщений идёт через хаб
+# между разными воркерами. Пропускная — сообщений/с от общего старта до
+# доставки последнего сообщения собеседнику.
+#
+#   python bench/multicore_bench.py --workers 1 2 4 --loaders 4 --clients 200 --messages 20000
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from relay import raise_nofile_limit
+from loadgen import LoadClient, wait_port
+
+
+async def load(index, port, clients, messages, codec, barrier, results):
+    raise_nofile_limit()
+    received = [0]
+    done = asyncio.Event()
+
+    def on_message(client, msg):
+        if msg["sender"] != client.username:
+            received[0] += 1
+            if received[0] >= messages:
+                done.set()
+
+    users = [f"@l{index}_{i:04}" for i in range(clients - clients % 2)]
+    conns = [await LoadClient.connect(user, port, codec=codec, on_message=on_message) for user in users]
+    for conn in conns:
+        await conn.ready()
+    pairs = [(conns[i], conns[i + 1]) for i in range(0, len(conns), 2)]
+
+    # все генераторы стартуют вместе
+    await asyncio.to_thread(barrier.wait)
+    started = time.monotonic()
+
+    outgoing = {}
+    for n in range(messages):
+        a, b = pairs[n % len(pairs)]
+        sender = a if n // len(pairs) % 2 else b
+        u1, u2 = sorted([a.username, b.username])
+        outgoing.setdefault(sender, []).append({
+            "chat_id": f"private_{u1}_{u2}",
+            "sender": sender.username,
+            "text": f"bench {n}",
+            "time": "12:00"
+        })
+    for sender, batch in outgoing.items():
+        sender.send_many(batch)
+    await asyncio.gather(*(sender.drain() for sender in outgoing))
+
+    await asyncio.wait_for(done.wait(), 300)
+    results.put((started, time.monotonic()))
+    for conn in conns:
+        await conn.close()
+
+
+def run_loader(*args):
+    asyncio.run(load(*args))
+
+
+def measure(workers, args, tmp, port):
+    relay = subprocess.Popen(
+        [
+            sys.executable, os.path.join(ROOT, "relay.py"),
+            "--port", str(port),
+            "--db", os.path.join(tmp, f"relay_{workers}.db"),
+            "--workers", str(workers)
+        ],
+        stdout=subprocess.DEVNULL
+    )
+    try:
+        asyncio.run(wait_port(port, timeout=30))
+        time.sleep(0.5)  # SO_REUSEPORT: ждём, пока слушают все воркеры
+
+        context = multiprocessing.get_context("spawn")
+        barrier = context.Barrier(args.loaders)
+        results = context.Queue()
+        per_loader = args.messages // args.loaders
+        loaders = [
+            context.Process(
+                target=run_loader,
+                args=(index, port, args.clients, per_loader, args.codec, barrier, results)
+            )
+            for index in range(args.loaders)
+        ]
+        for loader in loaders:
+            loader.start()
+        spans = [results.get(timeout=600) for _ in loaders]
+        for loader in loaders:
+            loader.join()
+    finally:
+        relay.kill()
+        relay.wait()
+
+    elapsed = max(end for _, end in spans) - min(start for start, _ in spans)
+    return per_loader * args.loaders / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--loaders", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=200, help="клиентов в каждом генераторе")
+    parser.add_argument("--messages", type=int, default=20000, help="всего сообщений")
+    parser.add_argument("--codec", default="json")
+    parser.add_argument("--port", type=int, default=5500)
+    args = parser.parse_args()
+
+    print(f"ядер: {os.cpu_count()}, генераторов: {args.loaders} по {args.clients} клиентов, "
+          f"{args.messages} сообщений")
+    base = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for number, workers in enumerate(args.workers):
+            throughput = measure(workers, args, tmp, args.port + number)
+            base = base or throughput
+            print(f"воркеров {workers:2}: {throughput:8.0f} сообщ./с, x{throughput / base:.2f}")
@@ -0,0 +1,161 @@
+# Исходящая очередь клиента: сколько стоит вызов send для UI, сколько
+# кадров в секунду уходит с объединением в один sendall, и доходят ли
+# сообщения, отправленные, пока релей лежал.
+#
+#   python bench/outbound_bench.py --messages 20000 --outage 500
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import client
+from client import RelayClient
+from framing import encode_frame
+
+HOST = "127.0.0.1"
+CHAT = "private_@a_@b"
+
+
+def start_relay(port, db_path):
+    relay = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "relay.py"), "--port", str(port), "--db", db_path],
+        stdout=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((HOST, port), timeout=1).close()
+            return relay
+        except OSError:
+            time.sleep(0.05)
+    relay.kill()
+    raise RuntimeError("релей не поднялся")
+
+
+class Receiver:
+    # @b считает, сколько сообщений до него дошло
+
+    def __init__(self, port, last_id=0):
+        self.count = 0
+        self.lock = threading.Condition()
+        self.client = RelayClient("@b", self.on_frame, port=port, last_id=last_id)
+        self.client.start()
+        while not self.client.connected:
+            time.sleep(0.01)
+
+    def on_frame(self, msg):
+        with self.lock:
+            self.count += 1
+            self.lock.notify_all()
+
+    def wait(self, expected, timeout=60):
+        with self.lock:
+            return self.lock.wait_for(lambda: self.count >= expected, timeout)
+
+
+def message(i):
+    return {"chat_id": CHAT, "sender": "@a", "text": f"сообщение {i}", "time": "12:00"}
+
+
+def direct(port, receiver, messages):
+    # как было: sendall на каждое сообщение прямо из UI
+    sock = socket.create_connection((HOST, port))
+    sock.sendall(b"@a")
+    time.sleep(0.1)
+
+    worst = 0
+    started = time.perf_counter()
+    for i in range(messages):
+        t = time.perf_counter()
+        sock.sendall(encode_frame(json.dumps(message(i)).encode()))
+        worst = max(worst, time.perf_counter() - t)
+    receiver.wait(messages)
+    elapsed = time.perf_counter() - started
+    sock.close()
+    return elapsed, worst
+
+
+def queued(port, receiver, messages):
+    sender = RelayClient("@a", lambda msg: None, port=port, max_pending=messages)
+    sender.start()
+    while not sender.connected:
+        time.sleep(0.01)
+
+    worst = 0
+    started = time.perf_counter()
+    for i in range(messages):
+        t = time.perf_counter()
+        sender.send(message(i))
+        worst = max(worst, time.perf_counter() - t)
+    receiver.wait(messages)
+    elapsed = time.perf_counter() - started
+    sender.close()
+    return elapsed, worst
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--outage", type=int, default=500, help="сообщений, отправленных без связи")
+    parser.add_argument("--port", type=int, default=5077)
+    args = parser.parse_args()
+
+    # в бенче ждать переподключения долго не нужно
+    client.MIN_BACKOFF = client.MAX_BACKOFF = 0.1
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "relay.db")
+        relay = start_relay(args.port, db_path)
+        try:
+            receiver = Receiver(args.port)
+
+            for name, fn in (("sendall из UI", direct), ("очередь", queued)):
+                receiver.count = 0
+                elapsed, worst = fn(args.port, receiver, args.messages)
+                print(
+                    f"{name:14}: {args.messages / elapsed:>9,.0f} сообщений/с, "
+                    f"худший вызов {worst * 1000:.2f} мс"
+                )
+
+            # обрыв: релей падает, отправитель продолжает писать
+            sender = RelayClient("@a", lambda msg: None, port=args.port)
+            sender.start()
+            while not sender.connected:
+                time.sleep(0.01)
+
+            relay.kill()
+            relay.wait()
+            receiver.client.close()
+            while sender.connected:
+                time.sleep(0.01)
+
+            worst = 0
+            accepted = 0
+            for i in range(args.outage):
+                t = time.perf_counter()
+                accepted += sender.send(message(i))
+                worst = max(worst, time.perf_counter() - t)
+
+            started = time.perf_counter()
+            relay = start_relay(args.port, db_path)
+            # получатель догоняет пропущенное через sync, с того же места
+            receiver = Receiver(args.port, receiver.client.last_id)
+            delivered = receiver.wait(accepted)
+            print(
+                f"{'без связи':14}: принято {accepted}/{args.outage}, худший вызов {worst * 1000:.2f} мс, "
+                f"после подъёма релея доставлено {receiver.count} за {time.perf_counter() - started:.2f} с"
+                + ("" if delivered else " (не всё)")
+            )
+            sender.close()
+            receiver.client.close()
+        finally:
+            relay.kill()
@@ -0,0 +1,141 @@
+# Присутствие на тысячах соединений: каждый клиент в чатах с соседями
+# по кругу. Меряем раунд ping/pong по всем клиентам, рассылку дельт при
+# массовом выходе и, для сравнения, прежнюю запись users.online с
+# commit на каждое изменение.
+#
+#   python bench/presence_bench.py --clients 2000 --contacts 4
+
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from relay import raise_nofile_limit
+from relay_bench import wait_port, connect
+
+
+def name(i):
+    return f"@p{i:05}"
+
+
+async def expect(reader, count, kind):
+    # читаем, пока не придёт count кадров нужного типа
+    seen = 0
+    while seen < count:
+        line = await reader.readline()
+        if not line:
+            break
+        if json.loads(line).get("type") == kind:
+            seen += 1
+    return seen
+
+
+def db_writes(path, changes):
+    # как было: UPDATE users SET online + commit на каждый вход и выход
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE users (username TEXT PRIMARY KEY, online INTEGER DEFAULT 0)")
+    conn.executemany("INSERT INTO users (username) VALUES (?)", [(name(i),) for i in range(changes)])
+    conn.commit()
+
+    started = time.perf_counter()
+    for i in range(changes):
+        conn.execute("UPDATE users SET online=? WHERE username=?", (i % 2, name(i)))
+        conn.commit()
+    elapsed = time.perf_counter() - started
+    conn.close()
+    return elapsed
+
+
+async def run(args):
+    raise_nofile_limit()
+
+    tmp = tempfile.TemporaryDirectory()
+    relay = subprocess.Popen(
+        [
+            sys.executable, os.path.join(ROOT, "relay.py"),
+            "--port", str(args.port),
+            "--db", os.path.join(tmp.name, "relay.db")
+        ],
+        stdout=subprocess.DEVNULL
+    )
+    try:
+        await wait_port("127.0.0.1", args.port)
+
+        conns = [await connect("127.0.0.1", args.port, name(i)) for i in range(args.clients)]
+
+        # чаты с --contacts соседями по кругу; presence — запрос снимка
+        for i, (_, writer) in enumerate(conns):
+            for step in range(1, args.contacts // 2 + 1):
+                other = name((i + step) % args.clients)
+                writer.write((json.dumps({
+                    "type": "chat",
+                    "chat_id": f"p{i}_{step}",
+                    "members": [name(i), other]
+                }) + "\n").encode())
+            writer.write(b'{"type":"presence"}\n')
+        for _, writer in conns:
+            await writer.drain()
+        await asyncio.gather(*(expect(reader, 1, "presence") for reader, _ in conns))
+
+        # раунд heartbeat: каждый шлёт ping и ждёт pong
+        started = time.perf_counter()
+        for _, writer in conns:
+            writer.write(b'{"type":"ping"}\n')
+        pongs = await asyncio.gather(*(expect(reader, 1, "pong") for reader, _ in conns))
+        ping_time = time.perf_counter() - started
+
+        # массовый выход: чётные отключаются, нечётные ждут дельты
+        leaving = conns[0::2]
+        staying = conns[1::2]
+        expected = []
+        for i in range(1, args.clients, 2):
+            # соседи i в пределах contacts/2 по обе стороны
+            gone = {
+                (i + d) % args.clients
+                for step in range(1, args.contacts // 2 + 1)
+                for d in (step, -step)
+            }
+            expected.append(sum(1 for j in gone if j % 2 == 0))
+
+        started = time.perf_counter()
+        for _, writer in leaving:
+            writer.close()
+        got = await asyncio.wait_for(
+            asyncio.gather(*(
+                expect(reader, n, "presence") for (reader, _), n in zip(staying, expected)
+            )),
+            timeout=60
+        )
+        churn_time = time.perf_counter() - started
+
+        old_time = db_writes(os.path.join(tmp.name, "users.db"), len(leaving))
+
+        print(f"соединений:         {args.clients}, собеседников у каждого: {args.contacts}")
+        print(f"ping/pong по всем:  {ping_time * 1000:.1f} мс, "
+              f"{ping_time / args.clients * 1e6:.1f} мкс на клиента ({sum(pongs)} pong)")
+        print(f"выход {len(leaving):>5}:         {churn_time * 1000:.1f} мс, дельт {sum(got)} из {sum(expected)}")
+        print(f"users.online+commit: {old_time * 1000:.1f} мс на {len(leaving)} изменений")
+
+        for _, writer in staying:
+            writer.close()
+
+    finally:
+        relay.terminate()
+        relay.wait()
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--contacts", type=int, default=4)
+    parser.add_argument("--port", type=int, default=5901)
+    asyncio.run(run(parser.parse_args()))
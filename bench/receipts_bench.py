@@ -0,0 +1,80 @@
+# Отметки о прочтении в длинном чате: прежний UPDATE по всему чату
+# (is_read=0 без индекса) против диапазона (read_id, up_to] по индексу
+# (chat_id, id). Новые сообщения приходят по --burst штук, после каждой
+# пачки чат отмечается прочитанным.
+#
+#   python bench/receipts_bench.py --history 200000 --rounds 200 --burst 5
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from db import connect, Database
+
+CHAT = "private_@a_@b"
+ME = "@a"
+
+
+def build(path, history):
+    conn = connect(path)
+    conn.execute("INSERT INTO chats (id, name) VALUES (?, ?)", (CHAT, "@b"))
+    conn.executemany("INSERT INTO members (chat_id, username) VALUES (?, ?)", [(CHAT, ME), (CHAT, "@b")])
+    conn.executemany(
+        "INSERT INTO messages (chat_id, sender, text, time, relay_id, is_read) VALUES (?, ?, ?, '12:00', ?, 1)",
+        [(CHAT, "@b" if i % 2 else ME, f"сообщение {i}", i + 1) for i in range(history)]
+    )
+    conn.execute("UPDATE members SET read_id = (SELECT MAX(id) FROM messages), unread = 0")
+    conn.commit()
+    conn.close()
+
+
+def whole_chat(db, rounds, burst):
+    # как было: на каждое открытие — проход по всем сообщениям чата
+    for _ in range(rounds):
+        for _ in range(burst):
+            db.add_message(CHAT, "@b", "новое", "12:00")
+        db.write(
+            "UPDATE messages SET is_read=1 WHERE chat_id=? AND sender!=? AND is_read=0",
+            (CHAT, ME)
+        )
+
+
+def watermark(db, rounds, burst):
+    for _ in range(rounds):
+        for _ in range(burst):
+            last = db.add_message(CHAT, "@b", "новое", "12:00")
+        db.mark_read(CHAT, ME, last)
+        db.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--history", type=int, default=200000)
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--burst", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, fn in (("весь чат", whole_chat), ("водяной знак", watermark)):
+            path = os.path.join(tmp, name.replace(" ", "_") + ".db")
+            build(path, args.history)
+
+            db = Database(path)
+            started = time.perf_counter()
+            fn(db, args.rounds, args.burst)
+            elapsed = time.perf_counter() - started
+            unread = db.query_one("SELECT unread FROM members WHERE username=?", (ME,))[0]
+            db.close()
+
+            print(
+                f"{name:14}: {elapsed / args.rounds * 1000:.2f} мс на отметку, "
+                f"непрочитанных в конце {unread}"
+            )
+
+        # по сети: по кадру на сообщение против одного водяного знака на пачку
+        print(f"кадров о прочтении: {args.rounds * args.burst} по одному против {args.rounds} водяных знаков")
@@ -0,0 +1,149 @@
+# Нагрузочный тест релея: держим тысячи простаивающих соединений
+# и меряем пропускную способность рассылки по небольшим чатам.
+#
+#   python bench/relay_bench.py --clients 2000 --senders 10 --messages 100 --chat-size 2
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from relay import raise_nofile_limit
+
+
+async def wait_port(host, port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.05)
+    raise RuntimeError("релей не поднялся")
+
+
+async def connect(host, port, username):
+    reader, writer = await asyncio.open_connection(host, port, limit=1024 * 1024)
+    writer.write(username.encode())
+    await writer.drain()
+    return reader, writer
+
+
+async def count_lines(reader, counter, expected, done):
+    while counter[0] < expected:
+        line = await reader.readline()
+        if not line:
+            break
+        counter[0] += 1
+    done.set()
+
+
+async def run(args):
+    raise_nofile_limit()
+
+    tmp = tempfile.TemporaryDirectory()
+    relay = subprocess.Popen(
+        [
+            sys.executable, os.path.join(ROOT, "relay.py"),
+            "--port", str(args.port),
+            "--db", os.path.join(tmp.name, "relay.db")
+        ],
+        stdout=subprocess.DEVNULL
+    )
+    try:
+        await wait_port("127.0.0.1", args.port)
+
+        started = time.perf_counter()
+        conns = []
+        for i in range(args.clients):
+            conns.append(await connect("127.0.0.1", args.port, f"@bench{i}"))
+        connect_time = time.perf_counter() - started
+
+        # отправитель s пишет в чат из chat_size клиентов, начиная с себя
+        chats = []
+        for s in range(args.senders):
+            first = s * args.chat_size
+            members = [f"@bench{i}" for i in range(first, first + args.chat_size)]
+            chats.append(members)
+            writer = conns[first][1]
+            writer.write((json.dumps({
+                "type": "chat",
+                "chat_id": f"bench{s}",
+                "members": members
+            }) + "\n").encode())
+            await writer.drain()
+
+        # даём релею зарегистрировать всех
+        await asyncio.sleep(0.5)
+
+        expected = {}
+        for members in chats:
+            for username in members:
+                expected[username] = args.messages
+
+        counters = []
+        waiters = []
+        for i, (reader, _) in enumerate(conns):
+            total = expected.get(f"@bench{i}", 0)
+            if not total:
+                continue
+            counter = [0]
+            done = asyncio.Event()
+            counters.append(counter)
+            waiters.append(done)
+            asyncio.create_task(count_lines(reader, counter, total, done))
+
+        payload = {"chat_id": "", "sender": "", "text": "x" * 32, "time": "00:00"}
+
+        started = time.perf_counter()
+        for s in range(args.senders):
+            writer = conns[s * args.chat_size][1]
+            payload["chat_id"] = f"bench{s}"
+            payload["sender"] = f"@bench{s * args.chat_size}"
+            for _ in range(args.messages):
+                writer.write((json.dumps(payload) + "\n").encode())
+            await writer.drain()
+
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(w.wait() for w in waiters)),
+                timeout=args.timeout
+            )
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - started
+
+        delivered = sum(c[0] for c in counters)
+
+        print(f"соединений:        {args.clients}")
+        print(f"время подключения: {connect_time:.2f} с")
+        print(f"отправлено:        {args.senders * args.messages}")
+        print(f"доставлено кадров: {delivered} из {sum(expected.values())}")
+        print(f"рассылка:          {elapsed:.2f} с, {delivered / elapsed:,.0f} кадров/с")
+
+        for _, writer in conns:
+            writer.close()
+
+    finally:
+        relay.terminate()
+        relay.wait()
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--senders", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--chat-size", type=int, default=2)
+    parser.add_argument("--port", type=int, default=5900)
+    parser.add_argument("--timeout", type=float, default=60)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,128 @@
+# Возврат в приложение: через сколько после старта процесса готовы
+# данные первого кадра (список чатов) и первой страницы верхнего чата.
+# Холодный старт из базы, холодный старт из снимка и, для сравнения,
+# тёплый — те же запросы в уже работающем процессе. Время — от конца
+# импортов (их приложение платит в любом случае); --drop-caches сбрасывает
+# страничный кеш ОС перед каждым запуском (нужен root), как после
+# перезагрузки телефона или когда ОС вытеснила файлы приложения.
+#
+#   python bench/resume_bench.py --chats 300 --messages 100000 --runs 5 --drop-caches
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from startup_bench import build, ME
+
+PAGE_SIZE = 50
+RECENT_CHATS = 5
+
+
+def drop_caches():
+    subprocess.run(["sync"])
+    with open("/proc/sys/vm/drop_caches", "w") as f:
+        f.write("3\n")
+
+
+def child(mode, path, snapshot_path):
+    from db import Database
+    from avatars import thumbnail_src, SMALL
+    from snapshot import load_snapshot
+
+    started = time.perf_counter()
+    result = {}
+    db = Database(path)
+
+    if mode == "snapshot":
+        data = load_snapshot(ME, snapshot_path)
+        rows = data["chats"]
+        result["список"] = (time.perf_counter() - started) * 1000
+        data["history"][rows[0][0]]
+        result["чат"] = (time.perf_counter() - started) * 1000
+
+        # сверка в фоне: то же, что show_chats после готовности базы
+        db.wait_ready()
+        db.chat_list(ME)
+        result["сверка"] = (time.perf_counter() - started) * 1000
+    else:
+        db.wait_ready()
+        rows = db.chat_list(ME)
+        for row in rows:
+            thumbnail_src(row[2], SMALL)
+        result["список"] = (time.perf_counter() - started) * 1000
+        db.history(rows[0][0], PAGE_SIZE)
+        result["чат"] = (time.perf_counter() - started) * 1000
+
+        if mode == "warm":
+            # тот же путь ещё раз: база открыта, страницы в кеше
+            started = time.perf_counter()
+            rows = db.chat_list(ME)
+            for row in rows:
+                thumbnail_src(row[2], SMALL)
+            result["список"] = (time.perf_counter() - started) * 1000
+            db.history(rows[0][0], PAGE_SIZE)
+            result["чат"] = (time.perf_counter() - started) * 1000
+
+    db.close()
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        child(sys.argv[2], sys.argv[3], sys.argv[4])
+        sys.exit()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=300)
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--drop-caches", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "app.db")
+        build(path, args.chats, args.messages)
+
+        from db import Database
+        from snapshot import save_snapshot
+        db = Database(path)
+        rows = db.chat_list(ME)
+        snapshot_path = os.path.join(tmp, "snapshot.json")
+        save_snapshot(
+            ME, rows,
+            {row[0]: db.history(row[0], PAGE_SIZE) for row in rows[:RECENT_CHATS]},
+            {},
+            snapshot_path
+        )
+        db.close()
+        print(f"{args.chats} чатов, {args.messages} сообщений, снимок {os.path.getsize(snapshot_path) // 1024} КБ; "
+              f"мс после импортов, медиана {args.runs} запусков"
+              f"{', страничный кеш сброшен' if args.drop_caches else ''}")
+
+        for mode, label in (("cold", "холодный из базы"), ("snapshot", "холодный из снимка"), ("warm", "тёплый")):
+            results = []
+            for _ in range(args.runs):
+                if args.drop_caches:
+                    drop_caches()
+                out = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--child", mode, path, snapshot_path],
+                    capture_output=True, text=True, cwd=tmp
+                )
+                lines = [line for line in out.stdout.splitlines() if line.startswith("{")]
+                if not lines:
+                    raise RuntimeError(out.stderr)
+                results.append(json.loads(lines[-1]))
+
+            line = ", ".join(
+                f"{key} {statistics.median(r[key] for r in results):.1f}"
+                for key in results[0]
+            )
+            print(f"{label:20}: {line}")
@@ -0,0 +1,121 @@
+# Время открытия чата (запросы show_chat и show_chats) на 10k/100k/1M
+# сообщений: исходная схема без индексов против схемы после migrate().
+#
+#   python bench/schema_bench.py --scales 10000 100000 1000000
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from db import migrate, migration_1
+
+USERS = 1000
+CHATS = 1000
+SAMPLES = 20
+
+
+def build(path, messages, seed=1):
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(path)
+
+    # только исходная схема, как у старых установок
+    migration_1(conn)
+    conn.execute("PRAGMA user_version=1")
+
+    users = [f"@user{i}" for i in range(USERS)]
+    conn.executemany(
+        "INSERT INTO users (username, name) VALUES (?, ?)",
+        ((u, u[1:]) for u in users)
+    )
+
+    chats = []
+    for i in range(CHATS):
+        u1, u2 = sorted(rnd.sample(users, 2))
+        chats.append((f"private_{u1}_{u2}", u1, u2))
+    conn.executemany("INSERT OR IGNORE INTO chats VALUES (?, ?)", ((c, u2) for c, _, u2 in chats))
+    conn.executemany("INSERT INTO members VALUES (?, ?)", ((c, u1) for c, u1, _ in chats))
+    conn.executemany("INSERT INTO members VALUES (?, ?)", ((c, u2) for c, _, u2 in chats))
+
+    conn.executemany(
+        "INSERT INTO messages (chat_id, sender, text, time) VALUES (?, ?, ?, ?)",
+        (
+            (c, rnd.choice((u1, u2)), f"сообщение {i}", "12:00")
+            for i, (c, u1, u2) in ((i, rnd.choice(chats)) for i in range(messages))
+        )
+    )
+    conn.commit()
+    return conn, chats
+
+
+def open_chat(cur, chat_id, me):
+    cur.execute("SELECT username FROM members WHERE chat_id=?", (chat_id,))
+    members = [row[0] for row in cur.fetchall()]
+    other = next((m for m in members if m != me), me)
+
+    cur.execute("SELECT avatar FROM users WHERE username=?", (other,))
+    cur.fetchone()
+
+    cur.execute(
+        "SELECT id, sender, text, time, is_read FROM messages WHERE chat_id=? ORDER BY id",
+        (chat_id,)
+    )
+    return len(cur.fetchall())
+
+
+def list_chats(cur, me):
+    cur.execute("""
+                SELECT c.id
+                FROM chats c
+                         JOIN members m ON c.id = m.chat_id
+                WHERE m.username = ?
+                """, (me,))
+    return len(cur.fetchall())
+
+
+def measure(conn, chats):
+    rnd = random.Random(2)
+    cur = conn.cursor()
+
+    started = time.perf_counter()
+    for chat_id, me, _ in rnd.sample(chats, SAMPLES):
+        open_chat(cur, chat_id, me)
+    chat = (time.perf_counter() - started) / SAMPLES
+
+    started = time.perf_counter()
+    for _, me, _ in rnd.sample(chats, SAMPLES):
+        list_chats(cur, me)
+    listing = (time.perf_counter() - started) / SAMPLES
+
+    return chat, listing
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scales", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    print(f"{'сообщений':>10} | {'открыть чат до':>15} | {'после':>8} | "
+          f"{'список чатов до':>16} | {'после':>8} | {'миграция':>8}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in args.scales:
+            conn, chats = build(os.path.join(tmp, f"{scale}.db"), scale)
+            chat_before, list_before = measure(conn, chats)
+
+            started = time.perf_counter()
+            migrate(conn)
+            migration = time.perf_counter() - started
+
+            chat_after, list_after = measure(conn, chats)
+            conn.close()
+
+            print(f"{scale:>10} | {chat_before * 1000:>12.2f} мс | {chat_after * 1000:>5.2f} мс | "
+                  f"{list_before * 1000:>13.2f} мс | {list_after * 1000:>5.2f} мс | "
+                  f"{migration:>6.2f} с")
@@ -0,0 +1,107 @@
+# Задержка поиска на большой базе: прежний LIKE '%q%' по users
+# против FTS5 по users и messages (одна страница результатов).
+#
+#   python bench/search_bench.py --users 10000 --messages 1000000
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from db import connect, has_fts, search_users, search_messages
+
+ME = "@user0"
+SAMPLES = 20
+
+
+def make_words(count, rnd):
+    letters = "абвгдеёжзийклмнопрстуфхцчшщыэюя"
+    return ["".join(rnd.choice(letters) for _ in range(rnd.randint(3, 9))) for _ in range(count)]
+
+
+def build(path, users, messages, seed=1):
+    rnd = random.Random(seed)
+    words = make_words(5000, rnd)
+    conn = connect(path)
+
+    names = [f"@user{i}" for i in range(users)]
+    conn.executemany(
+        "INSERT INTO users (username, name, bio) VALUES (?, ?, ?)",
+        ((u, " ".join(rnd.sample(words, 2)), " ".join(rnd.sample(words, 5))) for u in names)
+    )
+
+    # ME состоит в половине чатов
+    chats = []
+    for i in range(200):
+        other = rnd.choice(names[1:])
+        cid = f"chat{i}"
+        chats.append(cid)
+        conn.execute("INSERT INTO chats (id, name) VALUES (?, ?)", (cid, other))
+        if i % 2 == 0:
+            conn.execute("INSERT INTO members (chat_id, username) VALUES (?, ?)", (cid, ME))
+        conn.execute("INSERT INTO members (chat_id, username) VALUES (?, ?)", (cid, other))
+
+    # частота слов по Ципфу: есть и очень частые, и редкие
+    weights = [1 / (i + 1) for i in range(len(words))]
+    batch = []
+    for i in range(messages):
+        text = " ".join(rnd.choices(words, weights, k=rnd.randint(3, 12)))
+        batch.append((rnd.choice(chats), ME, text, "12:00"))
+        if len(batch) == 50_000:
+            conn.executemany("INSERT INTO messages (chat_id, sender, text, time) VALUES (?, ?, ?, ?)", batch)
+            batch = []
+    conn.executemany("INSERT INTO messages (chat_id, sender, text, time) VALUES (?, ?, ?, ?)", batch)
+    conn.commit()
+    return conn, words
+
+
+def timed(fn):
+    started = time.perf_counter()
+    for _ in range(SAMPLES):
+        rows = fn()
+    return (time.perf_counter() - started) / SAMPLES * 1000, len(rows)
+
+
+def like_users(cur, q):
+    cur.execute("""
+                SELECT username, name
+                FROM users
+                WHERE LOWER(username) LIKE LOWER(?)
+                   OR LOWER(name) LIKE LOWER(?)
+                """, (f"%{q}%", f"%{q}%"))
+    return cur.fetchall()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        started = time.perf_counter()
+        conn, words = build(os.path.join(tmp, "search.db"), args.users, args.messages)
+        print(f"база: {args.users} пользователей, {args.messages} сообщений, "
+              f"{time.perf_counter() - started:.1f} с на заполнение")
+
+        cur = conn.cursor()
+        assert has_fts(cur), "SQLite собран без FTS5"
+
+        cases = [
+            ("LIKE users, частое слово", lambda: like_users(cur, words[0][:3])),
+            ("FTS users, частое слово", lambda: search_users(cur, words[0][:3])),
+            ("FTS users, username", lambda: search_users(cur, "@user123")),
+            ("FTS messages, частое слово", lambda: search_messages(cur, ME, words[0])),
+            ("FTS messages, редкое слово", lambda: search_messages(cur, ME, words[-1])),
+            ("FTS messages, два слова", lambda: search_messages(cur, ME, f"{words[1]} {words[2]}")),
+            ("FTS messages, префикс", lambda: search_messages(cur, ME, words[3][:3])),
+        ]
+
+        for name, fn in cases:
+            ms, rows = timed(fn)
+            print(f"{name:28}: {ms:8.2f} мс, {rows} строк")
@@ -0,0 +1,95 @@
+# Настройки: как было (SELECT на каждое чтение, INSERT OR REPLACE +
+# commit на каждую запись) против кеша Database с отложенной записью.
+# Меряем время в потоке UI на переключение темы и на автовход, и сколько
+# раз настройки в итоге записались на диск.
+#
+#   python bench/settings_bench.py --toggles 1000
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from db import connect, Database
+from settings import Settings
+
+
+def old_way(path, toggles):
+    conn = sqlite3.connect(path)
+    cur = conn.cursor()
+    writes = [0]
+    conn.set_trace_callback(lambda sql: writes.__setitem__(0, writes[0] + sql.startswith("INSERT")))
+
+    def get_setting(key, default=None):
+        cur.execute("SELECT value FROM settings WHERE key=?", (key,))
+        row = cur.fetchone()
+        return row[0] if row else default
+
+    def set_setting(key, value):
+        cur.execute("INSERT OR REPLACE INTO settings VALUES (?,?)", (key, value))
+        conn.commit()
+
+    started = time.perf_counter()
+    for i in range(toggles):
+        set_setting("theme", "light" if get_setting("theme", "dark") == "dark" else "dark")
+    toggle = (time.perf_counter() - started) / toggles
+
+    started = time.perf_counter()
+    user = get_setting("last_user")
+    cur.execute("SELECT name FROM users WHERE username=?", (user,))
+    cur.fetchone()
+    get_setting("theme", "dark")
+    login = time.perf_counter() - started
+
+    conn.close()
+    return toggle, login, writes[0]
+
+
+def new_way(path, toggles):
+    db = Database(path)
+    db.wait_ready()
+    settings = Settings(db)
+    writes = [0]
+    db.conn.set_trace_callback(lambda sql: writes.__setitem__(0, writes[0] + sql.startswith("INSERT OR REPLACE INTO settings")))
+
+    started = time.perf_counter()
+    for i in range(toggles):
+        settings.theme = "light" if settings.theme == "dark" else "dark"
+    toggle = (time.perf_counter() - started) / toggles
+
+    started = time.perf_counter()
+    settings.last_user
+    settings.last_user_name
+    settings.theme
+    login = time.perf_counter() - started
+
+    db.close()
+    return toggle, login, writes[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--toggles", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, fn in (("как было", old_way), ("кеш", new_way)):
+            path = os.path.join(tmp, name.replace(" ", "_") + ".db")
+            conn = connect(path)
+            conn.execute("INSERT INTO users (username, name) VALUES ('@me', 'Я')")
+            conn.executemany("INSERT INTO settings VALUES (?, ?)", [
+                ("theme", "dark"), ("last_user", "@me"), ("last_user_name", "Я")
+            ])
+            conn.commit()
+            conn.close()
+
+            toggle, login, writes = fn(path, args.toggles)
+            print(
+                f"{name:9}: тема {toggle * 1e6:8.1f} мкс, автовход {login * 1e6:7.1f} мкс, "
+                f"записей на диск {writes} на {args.toggles} переключений"
+            )
@@ -0,0 +1,151 @@
+# Холодный старт по фазам, каждый запуск — новый процесс. Повторяет путь
+# main.py до первого кадра без самого Flet: импорт, настройки (тема,
+# автовход), данные первого кадра (список чатов last_user), релей слушает,
+# первая синхронизация клиента. "как было" — прежний порядок: Pillow при
+# импорте, открытие и миграции базы до всего остального, релей до UI.
+# База — актуальная или после обновления приложения (схема v1, нужны все
+# миграции).
+#
+#   python bench/startup_bench.py --chats 300 --messages 100000 --runs 5
+
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ME = "@me"
+PHASES = ("импорт", "настройки", "первый кадр", "релей слушает", "первая синхронизация")
+
+
+def child(mode, path, port):
+    started = time.perf_counter()
+    phases = {}
+
+    def mark(phase):
+        phases[phase] = (time.perf_counter() - started) * 1000
+
+    import threading
+
+    if mode == "old":
+        import PIL.Image  # прежний avatars.py импортировал Pillow сразу
+    from db import Database
+    from settings import Settings
+    from client import RelayClient
+    import attachments
+    mark("импорт")
+
+    if mode == "old":
+        from relay import start_server
+        db = Database(path)
+        db.wait_ready()                    # прежний конструктор открывал и мигрировал сразу
+        os.makedirs(os.path.join(os.path.dirname(path), "avatars"), exist_ok=True)
+        relay_ready = start_server(port=port, db_path=path + ".relay")
+    else:
+        db = Database(path)
+
+    settings = Settings(db)
+    theme, last_user = settings.theme, settings.last_user
+    mark("настройки")
+
+    db.wait_ready()
+    db.chat_list(last_user)
+    mark("первый кадр")
+
+    if mode != "old":
+        from relay import start_server
+        relay_ready = start_server(port=port, db_path=path + ".relay")
+    relay_ready.wait(10)
+    mark("релей слушает")
+
+    synced = threading.Event()
+    client = RelayClient(last_user, lambda msg: None, port=port, on_sync=lambda last_id: synced.set())
+    client.start(after=relay_ready)
+    synced.wait(10)
+    mark("первая синхронизация")
+
+    client.close()
+    db.close()
+    print(json.dumps(phases))
+
+
+def build(path, chats, messages):
+    # схема v1 + данные; миграции 2.. применит первый запуск
+    from db import migration_1
+    conn = sqlite3.connect(path)
+    migration_1(conn)
+    conn.execute("PRAGMA user_version=1")
+    conn.execute("INSERT INTO users (username, name) VALUES (?, ?)", (ME, "Я"))
+    peers = [f"@u{i:04}" for i in range(chats)]
+    conn.executemany("INSERT INTO users (username, name) VALUES (?, ?)", [(p, p) for p in peers])
+    for peer in peers:
+        chat_id = f"private_{ME}_{peer}"
+        conn.execute("INSERT INTO chats (id, name) VALUES (?, ?)", (chat_id, peer))
+        conn.executemany("INSERT INTO members (chat_id, username) VALUES (?, ?)", [(chat_id, ME), (chat_id, peer)])
+    conn.executemany(
+        "INSERT INTO messages (chat_id, sender, text, time, is_read) VALUES (?, ?, ?, '12:00', 1)",
+        (
+            (f"private_{ME}_{peers[i % chats]}", ME if i % 2 else peers[i % chats], f"сообщение номер {i}")
+            for i in range(messages)
+        )
+    )
+    conn.executemany("INSERT INTO settings VALUES (?, ?)", [("theme", "dark"), ("last_user", ME)])
+    conn.commit()
+    conn.close()
+
+
+def run(mode, source, tmp, port):
+    # своя копия базы на каждый запуск: миграции не должны достаться следующему
+    path = os.path.join(tmp, f"run_{mode}_{port}.db")
+    shutil.copy(source, path)
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", mode, path, str(port)],
+        capture_output=True, text=True, cwd=tmp
+    )
+    lines = [line for line in out.stdout.splitlines() if line.startswith("{")]
+    if not lines:
+        raise RuntimeError(out.stderr or out.stdout)
+    return json.loads(lines[-1])
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        child(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+        sys.exit()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=300)
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=5200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        outdated = os.path.join(tmp, "outdated.db")
+        build(outdated, args.chats, args.messages)
+
+        current = os.path.join(tmp, "current.db")
+        shutil.copy(outdated, current)
+        from db import connect
+        connect(current).close()
+
+        port = args.port
+        for db_name, source in (("актуальная база", current), ("после обновления", outdated)):
+            print(f"{db_name} ({args.chats} чатов, {args.messages} сообщений), медиана {args.runs} запусков, мс:")
+            print(f"  {'':10}" + "".join(f"{phase:>22}" for phase in PHASES))
+            for mode, label in (("old", "как было"), ("new", "сейчас")):
+                results = []
+                for _ in range(args.runs):
+                    port += 1
+                    results.append(run(mode, source, tmp, port))
+                print(f"  {label:10}" + "".join(
+                    f"{statistics.median(r[phase] for r in results):22.1f}" for phase in PHASES
+                ))
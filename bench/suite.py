@@ -0,0 +1,271 @@
+# Сквозной прогон на нескольких масштабах: база из datagen, настоящий
+# релей отдельным процессом и безголовые клиенты из loadgen. На каждом
+# масштабе:
+#   список чатов — chat_list @me и поиск превью аватаров (данные первого кадра);
+#   открытие чата — первая страница истории верхних чатов;
+#   пропускная способность — сообщений/с от отправки до доставки собеседнику,
+#     все отправители пишут без пауз;
+#   задержка доставки — p50/p99 при постоянном темпе --rate.
+# --out сохраняет результаты в JSON, --compare печатает разницу с прошлым
+# прогоном — так релиз сравнивается с предыдущим.
+#
+#   python bench/suite.py --scales small medium large --out bench.json --compare prev.json
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from db import Database
+from avatars import thumbnail_src, SMALL
+from codec import JSON, BINARY
+from relay import raise_nofile_limit
+from datagen import generate, username, ME
+from loadgen import LoadClient, wait_port
+
+PAGE_SIZE = 50
+SAMPLES = 20
+OPEN_CHATS = 20
+
+# пользователи, чаты, из них у @me, сообщения в истории, клиентов на релее
+SCALES = {
+    "small": dict(users=100, chats=200, my_chats=50, messages=10_000, clients=100),
+    "medium": dict(users=1000, chats=2000, my_chats=300, messages=100_000, clients=1000),
+    "large": dict(users=10_000, chats=20_000, my_chats=1000, messages=1_000_000, clients=2000),
+}
+
+# метрика -> (подпись, больше — лучше)
+METRICS = {
+    "chat_list_ms": ("список чатов, мс", False),
+    "chat_open_ms": ("открытие чата, мс", False),
+    "throughput": ("пропускная, сообщ./с", True),
+    "latency_p50_ms": ("доставка p50, мс", False),
+    "latency_p99_ms": ("доставка p99, мс", False),
+}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def measure_db(path, mine):
+    db = Database(path)
+    db.wait_ready()
+
+    def chat_list():
+        rows = db.chat_list(ME)
+        for row in rows:
+            thumbnail_src(row[2], SMALL)
+        return rows
+
+    times = []
+    for _ in range(SAMPLES):
+        started = time.perf_counter()
+        chat_list()
+        times.append(time.perf_counter() - started)
+    list_ms = statistics.median(times) * 1000
+
+    times = []
+    for chat_id, _ in mine[:OPEN_CHATS]:
+        started = time.perf_counter()
+        db.history(chat_id, PAGE_SIZE)
+        times.append(time.perf_counter() - started)
+    open_ms = statistics.median(times) * 1000
+
+    db.close()
+    return list_ms, open_ms
+
+
+class Traffic:
+    # время отправки по номеру сообщения и задержки доставки собеседнику
+
+    def __init__(self):
+        self.sent = {}
+        self.latencies = []
+        self.expected = 0
+        self.done = asyncio.Event()
+
+    def on_message(self, client, msg):
+        if msg["sender"] == client.username:
+            return  # эхо отправителю
+        seq = int(msg["text"].rsplit(" ", 1)[1])
+        self.latencies.append(time.perf_counter() - self.sent.pop(seq))
+        if len(self.latencies) >= self.expected:
+            self.done.set()
+
+    def reset(self, expected):
+        self.latencies = []
+        self.expected = expected
+        self.done.clear()
+
+
+def online_pairs(path, clients):
+    # личные чаты, где в сети оба собеседника: (chat_id, a, b)
+    conn = sqlite3.connect(path)
+    rows = conn.execute("""
+                        SELECT chat_id, group_concat(username, ' ')
+                        FROM members
+                        GROUP BY chat_id
+                        HAVING COUNT(*) = 2
+                        """).fetchall()
+    conn.close()
+    pairs = []
+    for chat_id, usernames in rows:
+        a, b = usernames.split(" ")
+        if a in clients and b in clients:
+            pairs.append((chat_id, a, b))
+    return pairs
+
+
+async def measure_relay(clients, pairs, traffic, messages, rate, duration):
+    seq = iter(range(10 ** 9))
+    rnd = random.Random(1)
+
+    def message():
+        chat_id, a, b = rnd.choice(pairs)
+        sender = clients[a if rnd.random() < 0.5 else b]
+        n = next(seq)
+        traffic.sent[n] = time.perf_counter()
+        return sender, {"chat_id": chat_id, "sender": sender.username, "text": f"bench {n}", "time": "12:00"}
+
+    # пропускная: всё сразу, каждый отправитель — одной записью
+    traffic.reset(messages)
+    started = time.perf_counter()
+    outgoing = {}
+    for _ in range(messages):
+        sender, msg = message()
+        outgoing.setdefault(sender, []).append(msg)
+    for sender, batch in outgoing.items():
+        sender.send_many(batch)
+    await asyncio.gather(*(sender.drain() for sender in outgoing))
+    await asyncio.wait_for(traffic.done.wait(), 120)
+    throughput = messages / (time.perf_counter() - started)
+
+    # задержка: ровный темп, пачка каждые 10 мс
+    total = int(rate * duration)
+    traffic.reset(total)
+    started = time.perf_counter()
+    sent = 0
+    while sent < total:
+        due = min(total, int((time.perf_counter() - started) * rate) + 1)
+        while sent < due:
+            sender, msg = message()
+            sender.send(msg)
+            sent += 1
+        await asyncio.sleep(0.01)
+    await asyncio.wait_for(traffic.done.wait(), 60)
+
+    latencies = traffic.latencies
+    return throughput, percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000
+
+
+async def run_scale(name, scale, args, port, tmp):
+    path = os.path.join(tmp, f"{name}.db")
+    started = time.perf_counter()
+    mine = generate(path, scale["users"], scale["chats"], scale["messages"], scale["my_chats"])
+    print(f"{name}: база за {time.perf_counter() - started:.1f} с", file=sys.stderr)
+
+    result = {}
+    result["chat_list_ms"], result["chat_open_ms"] = measure_db(path, mine)
+
+    # релей на той же базе: участников чатов он читает из members
+    relay = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "relay.py"), "--port", str(port), "--db", path],
+        stdout=subprocess.DEVNULL
+    )
+    traffic = Traffic()
+    clients = {}
+    try:
+        await wait_port(port)
+
+        # @me и остальные по порядку: первые из них — собеседники @me
+        users = [ME] + [username(i) for i in range(scale["users"])]
+        for user in users[:scale["clients"]]:
+            clients[user] = await LoadClient.connect(
+                user, port, codec=args.codec, on_message=traffic.on_message
+            )
+        for client in clients.values():
+            await client.ready()
+
+        result["throughput"], result["latency_p50_ms"], result["latency_p99_ms"] = await measure_relay(
+            clients, online_pairs(path, clients), traffic, args.messages, args.rate, args.duration
+        )
+    finally:
+        for client in clients.values():
+            await client.close()
+        relay.kill()
+        relay.wait()
+
+    return result
+
+
+def report(results, previous):
+    names = list(results)
+    print(f"{'':24}" + "".join(f"{name:>20}" for name in names))
+    for key, (label, higher) in METRICS.items():
+        line = f"{label:24}"
+        for name in names:
+            value = results[name][key]
+            cell = f"{value:.2f}" if value < 100 else f"{value:.0f}"
+            old = previous.get(name, {}).get(key)
+            if old:
+                change = (value - old) * 100 / old
+                better = change > 0 if higher else change < 0
+                cell += f" ({change:+.0f}%{'' if abs(change) < 5 else ' ↑' if better else ' ↓'})"
+            line += f"{cell:>20}"
+        print(line)
+
+
+async def main(args):
+    raise_nofile_limit()
+
+    previous = {}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)["scales"]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for number, name in enumerate(args.scales):
+            results[name] = await run_scale(name, SCALES[name], args, args.port + number, tmp)
+
+    print(f"кодек {args.codec}, {args.messages} сообщений на пропускную, темп {args.rate}/с на задержку")
+    report(results, previous)
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"commit": git_commit(), "codec": args.codec, "scales": results}, f, indent=2)
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=ROOT)
+    except OSError:
+        return None
+    return out.stdout.strip() or None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scales", nargs="+", choices=list(SCALES), default=["small", "medium"])
+    parser.add_argument("--codec", choices=[JSON, BINARY], default=JSON)
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--rate", type=int, default=2000)
+    parser.add_argument("--duration", type=float, default=3)
+    parser.add_argument("--port", type=int, default=5300)
+    parser.add_argument("--out")
+    parser.add_argument("--compare")
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
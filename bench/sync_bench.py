@@ -0,0 +1,92 @@
+# Догонялка после долгого офлайна: пока @b не в сети, @a пишет ему
+# --messages сообщений, потом @b подключается с last_id=0 и получает
+# пропущенное пачками через sync. Меряем время и число пачек.
+#
+#   python bench/sync_bench.py --messages 100000
+
+import argparse
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from client import RelayClient
+from framing import encode_frame
+from outbound_bench import start_relay, message
+
+HOST = "127.0.0.1"
+
+
+def fill(port, messages):
+    # пишем сырыми кадрами одним потоком, читая эхо, чтобы релей не ждал нас
+    sock = socket.create_connection((HOST, port))
+    sock.sendall(b"@a")
+    time.sleep(0.1)
+
+    echoed = [0]
+
+    def drain():
+        while echoed[0] < messages:
+            data = sock.recv(1 << 16)
+            if not data:
+                break
+            echoed[0] += data.count(b"\n")
+
+    reader = threading.Thread(target=drain, daemon=True)
+    reader.start()
+
+    chunk = 1000
+    for first in range(0, messages, chunk):
+        sock.sendall(b"".join(
+            encode_frame(json.dumps(message(i)).encode())
+            for i in range(first, min(first + chunk, messages))
+        ))
+    reader.join()
+    sock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--port", type=int, default=5078)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        relay = start_relay(args.port, os.path.join(tmp, "relay.db"))
+        try:
+            started = time.perf_counter()
+            fill(args.port, args.messages)
+            print(f"заполнение : {args.messages} сообщений за {time.perf_counter() - started:.2f} с")
+
+            done = threading.Event()
+            state = {"count": 0, "batches": 0, "ordered": True, "last": 0}
+
+            def on_frame(msg):
+                state["ordered"] &= msg["id"] > state["last"]
+                state["last"] = msg["id"]
+                state["count"] += 1
+
+            def on_sync(last_id):
+                state["batches"] += 1
+                if state["count"] >= args.messages:
+                    done.set()
+
+            started = time.perf_counter()
+            receiver = RelayClient("@b", on_frame, port=args.port, last_id=0, on_sync=on_sync)
+            receiver.start()
+            done.wait(120)
+            elapsed = time.perf_counter() - started
+            receiver.close()
+
+            print(
+                f"догонялка  : {state['count']}/{args.messages} сообщений за {elapsed:.2f} с, "
+                f"пачек {state['batches']}, по порядку: {'да' if state['ordered'] else 'нет'}"
+            )
+        finally:
+            relay.kill()
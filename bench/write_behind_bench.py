@@ -0,0 +1,68 @@
+# Сравнение записи входящих сообщений: INSERT + commit на каждое сообщение
+# против Database.add_message (executemany одной транзакцией).
+#
+#   python bench/write_behind_bench.py --messages 20000
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from db import connect, Database
+
+
+def fresh_db(directory, name):
+    path = os.path.join(directory, name)
+    connect(path).close()
+    return path
+
+
+def per_message(path, messages):
+    conn = sqlite3.connect(path)
+    cur = conn.cursor()
+    for msg in messages:
+        cur.execute("""
+                    INSERT INTO messages (chat_id, sender, text, time, is_read)
+                    VALUES (?, ?, ?, ?, 0)
+                    """, msg)
+        conn.commit()
+    conn.close()
+
+
+def write_behind(path, messages):
+    db = Database(path)
+    for msg in messages:
+        db.add_message(*msg)
+    db.close()
+
+
+def count(path):
+    conn = sqlite3.connect(path)
+    n = conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    conn.close()
+    return n
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--dir", default=None, help="каталог для БД (по умолчанию временный)")
+    args = parser.parse_args()
+
+    messages = [("chat", "@a", f"сообщение {i}", "12:00") for i in range(args.messages)]
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        for name, fn in (("commit на сообщение", per_message), ("write-behind", write_behind)):
+            path = fresh_db(tmp, name.replace(" ", "_") + ".db")
+
+            started = time.perf_counter()
+            fn(path, messages)
+            elapsed = time.perf_counter() - started
+
+            assert count(path) == len(messages)
+            print(f"{name:20}: {len(messages) / elapsed:>10,.0f} сообщений/с")
@@ -0,0 +1,417 @@
+import random
+import socket
+import threading
+from collections import deque, OrderedDict
+
+from framing import FrameReader, encode_frame, LINE, LENGTH
+from codec import Encoder, Decoder, JSON, BINARY, dumps, loads
+import metrics
+
+
+# ================= CLIENT =================
+# Соединение с релеем для приложения. UI только кладёт кадр в очередь,
+# пишет фоновый поток: несколько ожидающих кадров уходят одним sendall,
+# при обрыве соединение восстанавливается с экспоненциальной задержкой,
+# а неотправленное уходит заново — как и записанное, но не вернувшееся
+# эхом релея: повтор по uid релей отбросит. После подключения клиент называет
+# последний известный id релея и получает пропущенное пачками.
+# Вложения грузятся кусками с самым низким приоритетом: в каждую запись
+# идёт не больше одного куска, и только после текста.
+
+HOST = "127.0.0.1"
+PORT = 5000
+
+MAX_PENDING = 1000   # выше этого send ждёт, пока очередь разгрузится
+SEND_TIMEOUT = 2     # сколько send ждёт места в очереди
+MAX_BATCH = 64       # кадров в одном sendall
+CONNECT_TIMEOUT = 5
+PING_INTERVAL = 25     # ping, если столько нечего было отправить
+PRESENCE_TIMEOUT = 60  # столько тишины от релея — соединение считаем мёртвым
+MIN_BACKOFF = 0.5
+MAX_BACKOFF = 30
+READ_SIZE = 64 * 1024
+BLOB_CHUNK = 48 * 1024  # байт вложения в одном кадре
+
+# без FLETGRAM_METRICS это пустые объекты, см. metrics.py
+FRAMES_IN = metrics.counter("fletgram_client_frames_in_total", "Кадры от релея")
+FRAMES_OUT = metrics.counter("fletgram_client_frames_out_total", "Кадры релею")
+CONNECTS = metrics.counter("fletgram_client_connects_total", "Попытки подключения к релею", "result")
+PENDING = metrics.gauge("fletgram_client_pending", "Неотправленные сообщения в очереди")
+
+
+class RelayClient:
+
+    def __init__(self, username, on_frame, host=HOST, port=PORT, framing=LINE,
+                 max_pending=MAX_PENDING, last_id=0, on_sync=None, on_presence=None,
+                 codec=JSON, on_blob=None):
+        self.username = username
+        self.on_frame = on_frame        # вызывается из потока чтения с dict кадра
+        self.on_sync = on_sync          # (last_id) — после пачки или живого сообщения
+        self.on_presence = on_presence  # (online, offline, snapshot) — кто вошёл и вышел
+        self.on_blob = on_blob          # (кадр blob) -> не None, когда вложение собрано
+        self.last_id = last_id    # последний id релея, который уже разобран
+        # пока не пришла последняя пачка sync, живые сообщения пропускаем:
+        # релей шлёт их и до разбора нашего sync, а они всё равно есть в журнале
+        # и придут в пачке по порядку. Иначе живой id поднял бы last_id,
+        # и пачка с более ранними id была бы выброшена как повтор
+        self.syncing = False
+        self.host = host
+        self.port = port
+        # двоичный кодек требует кадров с длиной; старый релей его
+        # не подтвердит, и соединение останется на JSON
+        self.codec = codec
+        self.framing = LENGTH if codec == BINARY else framing
+        self.max_pending = max_pending
+        self.encoder = self.decoder = None
+
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.pending = deque()  # кадры (dict), ещё не записанные в сокет
+        self.unacked = OrderedDict()  # uid -> кадр: записан, эха релея ещё не было
+        self.control = deque()  # служебные кадры, идут раньше очереди сообщений
+        self.uploads = deque()  # [hash, путь, размер, offset] до подтверждения релея
+        self.fetching = set()   # hash вложений, которые ждём от релея
+        self.sock = None
+        self.closed = False
+
+    def start(self, after=None):
+        # after — Event, которого стоит дождаться перед первым подключением
+        # (встроенный релей ещё поднимается); не дождались — пробуем всё равно
+        threading.Thread(target=self.run, args=(after,), daemon=True).start()
+
+    @property
+    def connected(self):
+        return self.sock is not None
+
+    def send(self, obj, timeout=SEND_TIMEOUT):
+        # False — очередь так и не разгрузилась, кадр не принят.
+        # Кодируем уже в потоке записи: таблица строк двоичного кодека
+        # живёт, пока живёт соединение, и после обрыва начинается заново
+        with self.changed:
+            if not self.changed.wait_for(
+                lambda: len(self.pending) < self.max_pending or self.closed,
+                timeout
+            ) or self.closed:
+                return False
+
+            self.pending.append(obj)
+            PENDING.set(len(self.pending))
+            self.changed.notify_all()
+
+        return True
+
+    def upload(self, digest, path, total):
+        # вложение уходит кусками в фоне; держим его, пока релей не
+        # подтвердит (blob_ack), и после обрыва начинаем заново
+        if not total:
+            return
+        with self.changed:
+            if any(item[0] == digest for item in self.uploads):
+                return
+            self.uploads.append([digest, path, total, 0])
+            self.changed.notify_all()
+
+    def fetch(self, digest):
+        # попросить вложение у релея; повторный запрос, пока ждём, не нужен
+        with self.changed:
+            if digest in self.fetching:
+                return
+            self.fetching.add(digest)
+        self.request({"type": "fetch", "hash": digest})
+
+    def close(self):
+        with self.changed:
+            self.closed = True
+            sock = self.sock
+            self.changed.notify_all()
+
+        if sock:
+            # будит поток чтения, заблокированный в recv
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    # ---------- соединение ----------
+
+    def encode(self, obj):
+        if self.encoder:
+            return encode_frame(self.encoder.encode(obj), self.framing)
+        return encode_frame(dumps(obj), self.framing)
+
+    def decode(self, frame):
+        if self.decoder:
+            return self.decoder.decode(frame)
+        return loads(frame)
+
+    def open(self):
+        self.encoder = self.decoder = None
+
+        sock = socket.create_connection((self.host, self.port), timeout=CONNECT_TIMEOUT)
+        # релей отвечает pong на каждый ping, так что тишина дольше
+        # PRESENCE_TIMEOUT — это оборванная связь, а не пустой чат
+        sock.settimeout(PRESENCE_TIMEOUT)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        handshake = self.username.encode()
+        if self.framing != LINE:
+            # hello ещё идёт строкой, всё после него — в новом режиме
+            # кодек только предлагаем: до ответного hello пишем обычный JSON
+            handshake += encode_frame(dumps({
+                "type": "hello",
+                "framing": self.framing,
+                "codec": self.codec
+            }))
+        # сразу просим всё, что пропустили, пока не было связи
+        handshake += self.encode({"type": "sync", "last_id": self.last_id})
+        self.syncing = True
+        if self.on_presence:
+            handshake += self.encode({"type": "presence"})
+        # недокачанные вложения релей отдаст заново, с начала
+        with self.lock:
+            fetching = list(self.fetching)
+        for digest in fetching:
+            handshake += self.encode({"type": "fetch", "hash": digest})
+        sock.sendall(handshake)
+        return sock
+
+    def run(self, after=None):
+        if after is not None:
+            after.wait(CONNECT_TIMEOUT)
+
+        backoff = MIN_BACKOFF
+
+        while not self.closed:
+            try:
+                sock = self.open()
+            except OSError as e:
+                print("Ошибка подключения:", e)
+                CONNECTS.inc(1, "error")
+
+                # случайная добавка, чтобы клиенты после сбоя релея не шли толпой
+                with self.changed:
+                    self.changed.wait_for(
+                        lambda: self.closed,
+                        backoff * random.uniform(1, 1.5)
+                    )
+                backoff = min(backoff * 2, MAX_BACKOFF)
+                continue
+
+            backoff = MIN_BACKOFF
+            print("Подключено к серверу")
+            CONNECTS.inc(1, "ok")
+
+            with self.changed:
+                self.sock = sock
+                # запросы sync прошлого соединения уже не нужны
+                self.control.clear()
+                # релей мог не дописать загрузку — шлём вложения с начала
+                for item in self.uploads:
+                    item[3] = 0
+                self.changed.notify_all()
+
+            reader = threading.Thread(target=self.read, args=(sock,), daemon=True)
+            reader.start()
+
+            # неотправленное с прошлого соединения уходит первым
+            self.write(sock)
+
+            self.drop(sock)
+            sock.close()
+            reader.join()
+
+    def drop(self, sock):
+        with self.changed:
+            if self.sock is sock:
+                self.sock = None
+                self.changed.notify_all()
+
+    def write(self, sock):
+        # записанное в прошлое соединение могло не дойти до журнала релея:
+        # без эха шлём его заново первым, повтор релей узнает по uid
+        with self.changed:
+            resend = list(self.unacked.values())
+        if resend:
+            try:
+                sock.sendall(b"".join(self.encode(obj) for obj in resend))
+                FRAMES_OUT.inc(len(resend))
+            except OSError as e:
+                print("Ошибка отправки:", e)
+                return
+
+        while True:
+            with self.changed:
+                ready = self.changed.wait_for(
+                    lambda: (self.pending or self.control or self.next_upload()
+                             or self.closed or self.sock is not sock),
+                    PING_INTERVAL
+                )
+                if self.closed or self.sock is not sock:
+                    return
+
+                if not ready:
+                    # долго нечего отправить — ping, чтобы релей не счёл нас пропавшими
+                    self.control.append({"type": "ping"})
+
+                control = list(self.control)
+                self.control.clear()
+                batch = [self.pending[i] for i in range(min(len(self.pending), MAX_BATCH))]
+                # ждём эха ещё до записи: релей может ответить раньше,
+                # чем пачка уйдёт из очереди
+                for obj in batch:
+                    if "uid" in obj:
+                        self.unacked[obj["uid"]] = obj
+
+                # один кусок вложения после текста: сообщение, отправленное
+                # во время большой загрузки, ждёт не больше одного куска
+                upload = self.next_upload()
+                if upload:
+                    digest, path, total, offset = upload
+                    upload[3] = min(offset + BLOB_CHUNK, total)
+
+            try:
+                frames = control + batch
+                if upload:
+                    with open(path, "rb") as f:
+                        f.seek(offset)
+                        data = f.read(BLOB_CHUNK)
+                    frames.append({
+                        "type": "blob",
+                        "hash": digest,
+                        "offset": offset,
+                        "total": total,
+                        "data": data
+                    })
+
+                # кодирует только этот поток — таблице строк не нужен замок;
+                # кодировщик заводит поток чтения, получив ответный hello
+                sock.sendall(b"".join(self.encode(obj) for obj in frames))
+                FRAMES_OUT.inc(len(frames))
+            except OSError as e:
+                print("Ошибка отправки:", e)
+                # пачка остаётся в очереди и уйдёт оттуда
+                with self.changed:
+                    for obj in batch:
+                        self.unacked.pop(obj.get("uid"), None)
+                return
+
+            # из очереди убираем только записанное: при обрыве до этого места
+            # пачка уйдёт повторно после переподключения
+            with self.changed:
+                for _ in batch:
+                    self.pending.popleft()
+                PENDING.set(len(self.pending))
+                self.changed.notify_all()
+
+    def next_upload(self):
+        # под замком: первое вложение, у которого остались неотправленные куски
+        for item in self.uploads:
+            if item[3] < item[2]:
+                return item
+        return None
+
+    def request(self, obj):
+        # служебный кадр от потока чтения; пишет всё равно только поток записи
+        with self.changed:
+            self.control.append(obj)
+            self.changed.notify_all()
+
+    def read(self, sock):
+        frames = FrameReader(self.framing)
+
+        try:
+            while True:
+                data = sock.recv(READ_SIZE)
+                if not data:
+                    break
+
+                frames.feed(data)
+
+                for frame in frames.frames():
+                    if frame.strip():
+                        FRAMES_IN.inc()
+                        self.dispatch(self.decode(frame))
+
+        except (OSError, ValueError) as e:
+            if not self.closed:
+                print("Ошибка listen:", e)
+
+        finally:
+            # пишущий поток увидит, что соединение пропало, и переподключится
+            self.drop(sock)
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def dispatch(self, msg):
+        kind = msg.get("type")
+
+        if kind == "pong":
+            return
+
+        if kind == "hello":
+            # релей согласился на двоичный кодек: дальше его кадры двоичные,
+            # а поток записи подхватит кодировщик со следующей пачки
+            if msg.get("codec") == BINARY and self.codec == BINARY:
+                self.decoder = Decoder()
+                self.encoder = Encoder()
+            return
+
+        if kind == "blob_ack":
+            # релей собрал вложение (или оно у него уже было)
+            with self.changed:
+                for item in self.uploads:
+                    if item[0] == msg["hash"]:
+                        self.uploads.remove(item)
+                        break
+            return
+
+        if kind == "blob":
+            if self.on_blob and self.on_blob(msg) is not None:
+                with self.changed:
+                    self.fetching.discard(msg["hash"])
+            return
+
+        if kind == "presence":
+            if self.on_presence:
+                self.on_presence(msg["online"], msg["offline"], msg.get("snapshot", False))
+            return
+
+        if kind != "batch":
+            if self.syncing and "id" in msg:
+                self.acked(msg)
+                return
+            self.deliver(msg)
+            if self.on_sync and "id" in msg:
+                self.on_sync(self.last_id)
+            return
+
+        # пропущенное за время без связи, по порядку id
+        for item in msg["messages"]:
+            self.deliver(item)
+        self.last_id = max(self.last_id, msg["last_id"])
+        if self.on_sync:
+            self.on_sync(self.last_id)
+
+        if msg["more"]:
+            self.request({"type": "sync", "last_id": self.last_id})
+        else:
+            self.syncing = False
+
+    def acked(self, msg):
+        # эхо релея: кадр с этим uid уже в журнале, повторять его не нужно
+        uid = msg.get("uid")
+        if uid is not None and self.unacked:
+            with self.changed:
+                self.unacked.pop(uid, None)
+
+    def deliver(self, msg):
+        self.acked(msg)
+        msg_id = msg.get("id")
+        if msg_id is not None:
+            # повтор уже разобранного (например, после переподключения)
+            if msg_id <= self.last_id:
+                return
+            self.last_id = msg_id
+        self.on_frame(msg)
@@ -0,0 +1,206 @@
+import base64
+import json
+
+
+# ================= CODEC =================
+# Кодирование кадров поверх кадрирования. JSON — по умолчанию и как
+# запасной вариант. BINARY работает только с кадрированием LENGTH
+# (в двоичном теле может встретиться "\n"). Клиент предлагает его в
+# hello, релей подтверждает ответным hello; до подтверждения стороны
+# шлют обычный JSON. Кадр, начинающийся с "{", — обычный JSON и после
+# перехода, поэтому на стыке ничего не теряется.
+#
+# Двоичный кадр начинается с байта вида:
+#   0 — дальше обычный JSON (служебные кадры, пачки sync и всё,
+#       что не похоже на сообщение);
+#   1 — сообщение: varint id релея (0 — нет), ссылки на chat_id,
+#       sender и time, остаток кадра — text в UTF-8;
+#   2 — кусок вложения: ссылка на hash, varint offset и total,
+#       остаток кадра — сами байты (в JSON они идут base64);
+#   3 — сообщение с uid отправителя: как 1, но сразу после id — 16 байт
+#       uid (в JSON это 32 hex-символа).
+#
+# Ссылка — varint: 0 — новая строка (varint длины + UTF-8), которая
+# получает следующий номер в таблице соединения; 1 — строка без номера
+# (таблица заполнена); n >= 2 — строка номер n - 2. Таблица своя у каждого
+# соединения и направления и живёт, пока живёт соединение.
+
+JSON = "json"
+BINARY = "binary"
+
+KIND_JSON = 0
+KIND_MESSAGE = 1
+KIND_BLOB = 2
+KIND_MESSAGE_UID = 3
+PLAIN_JSON = ord("{")
+
+MAX_INTERNED = 4096  # больше строк в таблице соединения не держим
+
+MESSAGE_FIELDS = ("chat_id", "sender", "text", "time")
+# в чатах больше этого релей не рассылает присутствие и отметки о
+# прочтении, а приложение их и не шлёт
+LARGE_CHAT = 50
+UID_SIZE = 16  # байт uid сообщения, uuid4
+
+
+def write_varint(out, n):
+    while n >= 0x80:
+        out.append(n & 0x7F | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def read_varint(data, pos):
+    n = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
+
+
+def dumps(msg):
+    # dict -> JSON-байты; у кусков вложений data — bytes, в JSON — base64
+    if msg.get("type") == "blob":
+        msg = dict(msg, data=base64.b64encode(msg["data"]).decode())
+    return json.dumps(msg).encode()
+
+
+def loads(frame):
+    msg = json.loads(frame)
+    if msg.get("type") == "blob":
+        msg["data"] = base64.b64decode(msg["data"])
+    return msg
+
+
+def is_uid(value):
+    if not isinstance(value, str) or len(value) != UID_SIZE * 2:
+        return False
+    try:
+        # только в том виде, в каком его вернёт bytes.hex()
+        return bytes.fromhex(value).hex() == value
+    except ValueError:
+        return False
+
+
+def is_message(msg):
+    # двоичный вид — только у обычного сообщения, без лишних полей
+    if len(msg) != len(MESSAGE_FIELDS) + ("id" in msg) + ("uid" in msg):
+        return False
+    if not all(isinstance(msg.get(field), str) for field in MESSAGE_FIELDS):
+        return False
+    if "uid" in msg and not is_uid(msg["uid"]):
+        return False
+    return isinstance(msg.get("id", 0), int)
+
+
+class Encoder:
+
+    def __init__(self):
+        self.table = {}  # строка -> номер
+
+    def ref(self, out, value):
+        index = self.table.get(value)
+        if index is not None:
+            write_varint(out, index + 2)
+            return
+
+        data = value.encode()
+        if len(self.table) < MAX_INTERNED:
+            self.table[value] = len(self.table)
+            out.append(0)
+        else:
+            out.append(1)
+        write_varint(out, len(data))
+        out += data
+
+    def encode(self, msg):
+        # dict -> тело кадра
+        if msg.get("type") == "blob":
+            out = bytearray((KIND_BLOB,))
+            self.ref(out, msg["hash"])
+            write_varint(out, msg["offset"])
+            write_varint(out, msg["total"])
+            out += msg["data"]
+            return bytes(out)
+
+        if not is_message(msg):
+            return b"\x00" + dumps(msg)
+
+        uid = msg.get("uid")
+        out = bytearray((KIND_MESSAGE if uid is None else KIND_MESSAGE_UID,))
+        write_varint(out, msg.get("id", 0))
+        if uid is not None:
+            out += bytes.fromhex(uid)
+        self.ref(out, msg["chat_id"])
+        self.ref(out, msg["sender"])
+        self.ref(out, msg["time"])
+        out += msg["text"].encode()
+        return bytes(out)
+
+    def encode_json(self, payload):
+        # уже готовый JSON (пачка sync, presence) — без повторного dumps
+        return b"\x00" + payload
+
+
+class Decoder:
+
+    def __init__(self):
+        self.table = []  # номер -> строка
+
+    def ref(self, data, pos):
+        code, pos = read_varint(data, pos)
+        if code >= 2:
+            return self.table[code - 2], pos
+
+        size, pos = read_varint(data, pos)
+        value = bytes(data[pos:pos + size]).decode()
+        if code == 0:
+            self.table.append(value)
+        return value, pos + size
+
+    def decode(self, frame):
+        # тело кадра -> dict
+        if frame[0] == PLAIN_JSON:
+            return loads(frame)
+
+        if frame[0] == KIND_JSON:
+            return loads(frame[1:])
+
+        if frame[0] == KIND_BLOB:
+            digest, pos = self.ref(frame, 1)
+            offset, pos = read_varint(frame, pos)
+            total, pos = read_varint(frame, pos)
+            return {
+                "type": "blob",
+                "hash": digest,
+                "offset": offset,
+                "total": total,
+                "data": bytes(frame[pos:])
+            }
+
+        if frame[0] not in (KIND_MESSAGE, KIND_MESSAGE_UID):
+            raise ValueError("Неизвестный вид кадра")
+
+        msg_id, pos = read_varint(frame, 1)
+        uid = None
+        if frame[0] == KIND_MESSAGE_UID:
+            uid = bytes(frame[pos:pos + UID_SIZE]).hex()
+            pos += UID_SIZE
+        chat_id, pos = self.ref(frame, pos)
+        sender, pos = self.ref(frame, pos)
+        time, pos = self.ref(frame, pos)
+
+        msg = {
+            "chat_id": chat_id,
+            "sender": sender,
+            "text": bytes(frame[pos:]).decode(),
+            "time": time
+        }
+        if msg_id:
+            msg["id"] = msg_id
+        if uid is not None:
+            msg["uid"] = uid
+        return msg
@@ -0,0 +1,946 @@
+import queue
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+import metrics
+
+
+# ================= SCHEMA =================
+# Миграции применяются по порядку; номер последней применённой
+# хранится в PRAGMA user_version. Новые изменения схемы — только
+# новой функцией в конце MIGRATIONS, старые не трогаем.
+
+def migration_1(conn):
+    # исходная схема
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        username TEXT PRIMARY KEY,
+        name TEXT,
+        avatar TEXT DEFAULT '',
+        bio TEXT DEFAULT '',
+        online INTEGER DEFAULT 0
+    )
+    """)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS chats (
+        id TEXT PRIMARY KEY,
+        name TEXT
+    )
+    """)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS members (
+        chat_id TEXT,
+        username TEXT
+    )
+    """)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id TEXT,
+        sender TEXT,
+        text TEXT,
+        time TEXT,
+        is_read INTEGER DEFAULT 0,
+        type TEXT DEFAULT 'text'
+    )
+    """)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS settings (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+    """)
+
+
+def migration_2(conn):
+    # история чата: WHERE chat_id=? ORDER BY id без сортировки
+    conn.execute("CREATE INDEX IF NOT EXISTS messages_chat_id ON messages (chat_id, id)")
+
+    # убираем дубли участников перед уникальным индексом
+    conn.execute("""
+    DELETE FROM members
+    WHERE rowid NOT IN (
+        SELECT MIN(rowid) FROM members GROUP BY chat_id, username
+    )
+    """)
+
+    # участники чата (покрывает и поиск по одному chat_id)
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS members_chat_user ON members (chat_id, username)")
+
+    # чаты пользователя
+    conn.execute("CREATE INDEX IF NOT EXISTS members_user_chat ON members (username, chat_id)")
+
+
+def migration_3(conn):
+    # сводка для списка чатов, которую поддерживают триггеры:
+    # последнее сообщение — в chats, непрочитанные — у каждого участника в members
+    conn.execute("ALTER TABLE chats ADD COLUMN last_id INTEGER")
+    conn.execute("ALTER TABLE chats ADD COLUMN last_text TEXT")
+    conn.execute("ALTER TABLE chats ADD COLUMN last_time TEXT")
+    conn.execute("ALTER TABLE members ADD COLUMN unread INTEGER DEFAULT 0")
+
+    conn.execute("""
+    CREATE TRIGGER messages_summary_insert AFTER INSERT ON messages
+    BEGIN
+        UPDATE chats SET last_id = new.id, last_text = new.text, last_time = new.time
+        WHERE id = new.chat_id AND (last_id IS NULL OR last_id < new.id);
+
+        UPDATE members SET unread = unread + 1
+        WHERE chat_id = new.chat_id AND username != new.sender AND new.is_read = 0;
+    END
+    """)
+
+    conn.execute("""
+    CREATE TRIGGER messages_summary_delete AFTER DELETE ON messages
+    BEGIN
+        UPDATE chats SET
+            last_id = (SELECT MAX(id) FROM messages WHERE chat_id = old.chat_id),
+            last_text = (SELECT text FROM messages WHERE chat_id = old.chat_id ORDER BY id DESC LIMIT 1),
+            last_time = (SELECT time FROM messages WHERE chat_id = old.chat_id ORDER BY id DESC LIMIT 1)
+        WHERE id = old.chat_id AND last_id = old.id;
+
+        UPDATE members SET unread = unread - 1
+        WHERE chat_id = old.chat_id AND username != old.sender AND old.is_read = 0 AND unread > 0;
+    END
+    """)
+
+    conn.execute("""
+    CREATE TRIGGER messages_summary_read AFTER UPDATE OF is_read ON messages
+    WHEN old.is_read = 0 AND new.is_read != 0
+    BEGIN
+        UPDATE members SET unread = unread - 1
+        WHERE chat_id = new.chat_id AND username != new.sender AND unread > 0;
+    END
+    """)
+
+    # заполняем сводку по уже существующей истории
+    conn.execute("""
+    UPDATE chats SET
+        last_id = (SELECT MAX(id) FROM messages WHERE chat_id = chats.id),
+        last_text = (SELECT text FROM messages WHERE chat_id = chats.id ORDER BY id DESC LIMIT 1),
+        last_time = (SELECT time FROM messages WHERE chat_id = chats.id ORDER BY id DESC LIMIT 1)
+    """)
+    conn.execute("""
+    UPDATE members SET unread = (
+        SELECT COUNT(*) FROM messages
+        WHERE chat_id = members.chat_id AND sender != members.username AND is_read = 0
+    )
+    """)
+
+
+def migration_4(conn):
+    # полнотекстовый поиск; если SQLite собран без FTS5 — остаётся поиск через LIKE
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x)")
+        conn.execute("DROP TABLE temp.fts5_probe")
+    except sqlite3.OperationalError:
+        return
+
+    conn.execute("""
+    CREATE VIRTUAL TABLE users_fts USING fts5(
+        username, name, bio,
+        content='users', content_rowid='rowid',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """)
+
+    conn.execute("""
+    CREATE VIRTUAL TABLE messages_fts USING fts5(
+        text,
+        content='messages', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """)
+
+    conn.execute("""
+    CREATE TRIGGER users_fts_insert AFTER INSERT ON users
+    BEGIN
+        INSERT INTO users_fts (rowid, username, name, bio)
+        VALUES (new.rowid, new.username, new.name, new.bio);
+    END
+    """)
+
+    conn.execute("""
+    CREATE TRIGGER users_fts_delete AFTER DELETE ON users
+    BEGIN
+        INSERT INTO users_fts (users_fts, rowid, username, name, bio)
+        VALUES ('delete', old.rowid, old.username, old.name, old.bio);
+    END
+    """)
+
+    conn.execute("""
+    CREATE TRIGGER users_fts_update AFTER UPDATE OF username, name, bio ON users
+    BEGIN
+        INSERT INTO users_fts (users_fts, rowid, username, name, bio)
+        VALUES ('delete', old.rowid, old.username, old.name, old.bio);
+        INSERT INTO users_fts (rowid, username, name, bio)
+        VALUES (new.rowid, new.username, new.name, new.bio);
+    END
+    """)
+
+    conn.execute("""
+    CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages
+    BEGIN
+        INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text);
+    END
+    """)
+
+    conn.execute("""
+    CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages
+    BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END
+    """)
+
+    conn.execute("""
+    CREATE TRIGGER messages_fts_update AFTER UPDATE OF text ON messages
+    BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text);
+    END
+    """)
+
+    # индексируем то, что уже есть
+    conn.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+    conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+
+def migration_5(conn):
+    # отметки о прочтении водяным знаком: "прочитал до id X в чате Y".
+    # relay_id — общий id релея (у собеседника свои локальные id),
+    # read_id — до какого локального id участник прочитал чат
+    conn.execute("ALTER TABLE messages ADD COLUMN relay_id INTEGER")
+    conn.execute("CREATE INDEX messages_chat_relay ON messages (chat_id, relay_id)")
+    conn.execute("ALTER TABLE members ADD COLUMN read_id INTEGER DEFAULT 0")
+
+    conn.execute("""
+    UPDATE members SET read_id = COALESCE((
+        SELECT MAX(id) FROM messages
+        WHERE chat_id = members.chat_id AND sender != members.username AND is_read = 1
+    ), 0)
+    """)
+
+
+def migration_6(conn):
+    # вложения по хешу содержимого: одна строка и один файл на картинку,
+    # сколько бы сообщений на неё ни ссылалось ("img:<hash>:WxH")
+    conn.execute("""
+    CREATE TABLE attachments (
+        hash TEXT PRIMARY KEY,
+        size INTEGER,
+        width INTEGER,
+        height INTEGER
+    ) WITHOUT ROWID
+    """)
+
+
+def migration_7(conn):
+    # id сообщения от клиента-отправителя: одно сообщение — одна строка,
+    # сколько бы раз оно ни пришло (эхо релея, повтор после обрыва).
+    # У старых строк uid нет, NULL уникальному индексу не мешает
+    conn.execute("ALTER TABLE messages ADD COLUMN uid TEXT")
+    conn.execute("CREATE UNIQUE INDEX messages_uid ON messages (uid)")
+
+
+def migration_8(conn):
+    # группы: is_read и счётчики у каждого участника годятся только для
+    # личных чатов. В группе отметка одного участника помечала бы чужие
+    # сообщения, а каждое входящее меняло бы тысячи строк members.
+    # Непрочитанное группы считает chat_list по read_id своего аккаунта,
+    # триггеры счётчиков группы пропускают (префикс — db.GROUP_PREFIX)
+    for name in ("messages_summary_insert", "messages_summary_delete", "messages_summary_read"):
+        conn.execute(f"DROP TRIGGER {name}")
+
+    conn.execute("""
+    CREATE TRIGGER messages_summary_insert AFTER INSERT ON messages
+    BEGIN
+        UPDATE chats SET last_id = new.id, last_text = new.text, last_time = new.time
+        WHERE id = new.chat_id AND (last_id IS NULL OR last_id < new.id);
+    END
+    """)
+
+    conn.execute("""
+    CREATE TRIGGER messages_unread_insert AFTER INSERT ON messages
+    WHEN new.is_read = 0 AND substr(new.chat_id, 1, 6) != 'group_'
+    BEGIN
+        UPDATE members SET unread = unread + 1
+        WHERE chat_id = new.chat_id AND username != new.sender;
+    END
+    """)
+
+    conn.execute("""
+    CREATE TRIGGER messages_summary_delete AFTER DELETE ON messages
+    BEGIN
+        UPDATE chats SET
+            last_id = (SELECT MAX(id) FROM messages WHERE chat_id = old.chat_id),
+            last_text = (SELECT text FROM messages WHERE chat_id = old.chat_id ORDER BY id DESC LIMIT 1),
+            last_time = (SELECT time FROM messages WHERE chat_id = old.chat_id ORDER BY id DESC LIMIT 1)
+        WHERE id = old.chat_id AND last_id = old.id;
+    END
+    """)
+
+    conn.execute("""
+    CREATE TRIGGER messages_unread_delete AFTER DELETE ON messages
+    WHEN old.is_read = 0 AND substr(old.chat_id, 1, 6) != 'group_'
+    BEGIN
+        UPDATE members SET unread = unread - 1
+        WHERE chat_id = old.chat_id AND username != old.sender AND unread > 0;
+    END
+    """)
+
+    conn.execute("""
+    CREATE TRIGGER messages_summary_read AFTER UPDATE OF is_read ON messages
+    WHEN old.is_read = 0 AND new.is_read != 0 AND substr(new.chat_id, 1, 6) != 'group_'
+    BEGIN
+        UPDATE members SET unread = unread - 1
+        WHERE chat_id = new.chat_id AND username != new.sender AND unread > 0;
+    END
+    """)
+
+    conn.execute("UPDATE members SET unread = 0 WHERE substr(chat_id, 1, 6) = 'group_'")
+
+
+def migration_9(conn):
+    # непрочитанное группы — снова счётчик в members, но только у строки
+    # своего аккаунта (settings.last_user): одно UPDATE на входящее, а не
+    # тысячи, и chat_list не считает диапазон на каждый показ списка.
+    # Свой аккаунт — только тот, кто вошёл: при входе счётчики его групп
+    # пересчитываются один раз, дальше их ведут триггеры
+    account = "(SELECT value FROM settings WHERE key = 'last_user')"
+
+    conn.execute(f"""
+    CREATE TRIGGER messages_group_unread_insert AFTER INSERT ON messages
+    WHEN substr(new.chat_id, 1, 6) = 'group_'
+    BEGIN
+        UPDATE members SET unread = unread + 1
+        WHERE chat_id = new.chat_id AND username = {account}
+          AND username != new.sender AND read_id < new.id;
+    END
+    """)
+
+    conn.execute(f"""
+    CREATE TRIGGER messages_group_unread_delete AFTER DELETE ON messages
+    WHEN substr(old.chat_id, 1, 6) = 'group_'
+    BEGIN
+        UPDATE members SET unread = unread - 1
+        WHERE chat_id = old.chat_id AND username = {account}
+          AND username != old.sender AND read_id < old.id AND unread > 0;
+    END
+    """)
+
+    # прочитанное — диапазон (старый read_id, новый], а не вся история
+    conn.execute(f"""
+    CREATE TRIGGER members_group_read AFTER UPDATE OF read_id ON members
+    WHEN substr(new.chat_id, 1, 6) = 'group_' AND new.read_id > old.read_id
+         AND new.username = {account}
+    BEGIN
+        UPDATE members SET unread = MAX(unread - (
+            SELECT COUNT(*) FROM messages
+            WHERE chat_id = new.chat_id AND id > old.read_id AND id <= new.read_id
+              AND sender != new.username
+        ), 0)
+        WHERE chat_id = new.chat_id AND username = new.username;
+    END
+    """)
+
+    recount = """
+        UPDATE members SET unread = (
+            SELECT COUNT(*) FROM messages
+            WHERE chat_id = members.chat_id AND id > members.read_id AND sender != members.username
+        )
+        WHERE substr(chat_id, 1, 6) = 'group_' AND username = {}
+    """
+
+    # вход под другим аккаунтом: его группы до сих пор никто не считал
+    conn.execute(f"""
+    CREATE TRIGGER settings_account AFTER INSERT ON settings
+    WHEN new.key = 'last_user'
+    BEGIN
+        {recount.format("new.value")};
+    END
+    """)
+
+    conn.execute(recount.format(account))
+
+
+MIGRATIONS = [
+    migration_1,
+    migration_2,
+    migration_3,
+    migration_4,
+    migration_5,
+    migration_6,
+    migration_7,
+    migration_8,
+    migration_9,
+]
+
+
+def migrate(conn):
+    # WAL: чтение из UI не ждёт запись из фонового потока
+    conn.execute("PRAGMA journal_mode=WAL")
+
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+    for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+        conn.execute("BEGIN")
+        try:
+            migration(conn)
+            conn.execute(f"PRAGMA user_version={number}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def connect(path):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    migrate(conn)
+    return conn
+
+
+# ================= QUERIES =================
+
+GROUP_PREFIX = "group_"  # id групповых чатов; личные — private_{u1}_{u2}
+
+
+def is_group(chat_id):
+    return chat_id.startswith(GROUP_PREFIX)
+
+
+def private_members(chat_id):
+    # private_{u1}_{u2}, оба username начинаются с @ (как в relay.private_members)
+    if not chat_id.startswith("private_@"):
+        return []
+    u1, sep, u2 = chat_id[len("private_"):].partition("_@")
+    return [u1, "@" + u2] if sep else []
+
+
+def chat_list(cur, username):
+    # весь список чатов одним запросом: собеседник (у группы — название),
+    # его аватар, последнее сообщение и число непрочитанных, свежие чаты сверху.
+    # Последнее сообщение и счётчики ведут триггеры (у группы — только
+    # для своего аккаунта, см. migration_9).
+    # Собеседника ищет подзапрос, и только для личных чатов: участников
+    # группы не перебираем, группа — одна строка
+    cur.execute("""
+                SELECT id,
+                       peer,
+                       CASE WHEN NOT grp THEN (SELECT avatar FROM users WHERE username = peer) END,
+                       last_text,
+                       last_time,
+                       unread
+                FROM (SELECT c.id,
+                             c.last_id,
+                             c.last_text,
+                             c.last_time,
+                             m.unread,
+                             substr(c.id, 1, :len) = :prefix AS grp,
+                             CASE WHEN substr(c.id, 1, :len) = :prefix THEN c.name
+                                  ELSE COALESCE((SELECT o.username FROM members o
+                                                 WHERE o.chat_id = m.chat_id AND o.username != m.username
+                                                 LIMIT 1), m.username) END AS peer
+                      FROM members m
+                               JOIN chats c ON c.id = m.chat_id
+                      WHERE m.username = :user)
+                ORDER BY last_id IS NULL, last_id DESC
+                """, {"user": username, "prefix": GROUP_PREFIX, "len": len(GROUP_PREFIX)})
+    return cur.fetchall()
+
+
+# ================= SEARCH =================
+
+SEARCH_PAGE = 20
+
+# границы совпадения в highlight()/snippet(), UI делает из них жирный текст
+MATCH_START = "\x02"
+MATCH_END = "\x03"
+
+
+def has_fts(cur):
+    cur.execute("SELECT 1 FROM sqlite_master WHERE name='messages_fts'")
+    return cur.fetchone() is not None
+
+
+def fts_query(text):
+    # каждое слово — префиксный поиск, все слова обязательны;
+    # кавычки не дают пользователю сломать синтаксис FTS5
+    words = re.findall(r"\w+", text)
+    return " ".join(f'"{w}"*' for w in words)
+
+
+def search_users(cur, text, offset=0):
+    # username, name с подсвеченными совпадениями
+    query = fts_query(text)
+    if not query:
+        return []
+
+    if not has_fts(cur):
+        like = f"%{text.strip()}%"
+        cur.execute("""
+                    SELECT username, name
+                    FROM users
+                    WHERE LOWER(username) LIKE LOWER(?)
+                       OR LOWER(name) LIKE LOWER(?)
+                    LIMIT ? OFFSET ?
+                    """, (like, like, SEARCH_PAGE, offset))
+        return cur.fetchall()
+
+    cur.execute(f"""
+                SELECT highlight(users_fts, 0, '{MATCH_START}', '{MATCH_END}'),
+                       highlight(users_fts, 1, '{MATCH_START}', '{MATCH_END}')
+                FROM users_fts
+                WHERE users_fts MATCH ?
+                ORDER BY rank
+                LIMIT ? OFFSET ?
+                """, (query, SEARCH_PAGE, offset))
+    return cur.fetchall()
+
+
+def search_messages(cur, username, text, before=None):
+    # сообщения из чатов пользователя, новые сверху;
+    # страницы по id (keyset), чтобы не пересчитывать OFFSET на миллионе строк
+    query = fts_query(text)
+    if not query or not has_fts(cur):
+        return []
+
+    cur.execute(f"""
+                SELECT m.id,
+                       m.chat_id,
+                       m.sender,
+                       snippet(messages_fts, 0, '{MATCH_START}', '{MATCH_END}', '…', 12),
+                       m.time
+                FROM messages_fts
+                         JOIN messages m ON m.id = messages_fts.rowid
+                         JOIN members mb ON mb.chat_id = m.chat_id AND mb.username = ?
+                WHERE messages_fts MATCH ?
+                  AND messages_fts.rowid < ?
+                ORDER BY messages_fts.rowid DESC
+                LIMIT ?
+                """, (username, query, before if before is not None else 2 ** 63 - 1, SEARCH_PAGE))
+    return cur.fetchall()
+
+
+# ================= ACCESS =================
+# Один поток-писатель со своим соединением и по соединению-читателю
+# на каждый поток. В WAL чтение не ждёт запись, а все изменения идут
+# через одну очередь — курсор больше не делится между потоками.
+
+MESSAGE = "message"  # входящее/исходящее сообщение, пишется пачкой
+SETTING = "setting"  # настройка: в пачке пишется только последнее значение ключа
+WRITE = "write"      # любой другой запрос, вызывающий ждёт результат
+CLOSE = "close"
+
+# без FLETGRAM_METRICS это пустые объекты, см. metrics.py
+QUERY = metrics.histogram("fletgram_db_query_seconds", "Запросы чтения из UI и потоков клиента", "query")
+BATCH = metrics.histogram("fletgram_db_batch_seconds", "Транзакция пачки писателя вместе с commit")
+BATCH_TASKS = metrics.histogram(
+    "fletgram_db_batch_tasks", "Задач в одной пачке писателя",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200)
+)
+
+
+class Database:
+
+    def __init__(self, path, batch_size=200, delay=0.05):
+        self.path = path
+        self.batch_size = batch_size
+        self.delay = delay
+
+        self.conn = None
+        self.local = threading.local()
+        self.queue = queue.Queue()
+        self.id_lock = threading.Lock()
+        self.next_id = None
+        # uid сообщений, которые ещё в очереди писателя -> локальный id:
+        # message_id видит их раньше, чем они окажутся в базе
+        self.queued_uids = {}
+
+        # настройки читаем один раз; дальше get_setting — из словаря,
+        # а set_setting меняет словарь сразу и пишет на диск в фоне
+        self.settings = {}
+
+        # база открывается и мигрирует в потоке писателя, конструктор не ждёт:
+        # loaded — настройки прочитаны (тема, автовход), ready — схема свежая
+        self.loaded = threading.Event()
+        self.ready = threading.Event()
+        self.error = None
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+
+        # таблица settings есть с первой версии схемы, так что первый кадр
+        # (логин или список чатов) не ждёт миграций после обновления
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name='settings'").fetchone():
+            self.settings.update(conn.execute("SELECT key, value FROM settings"))
+        self.loaded.set()
+
+        migrate(conn)
+
+        # id сообщений выдаём сами, чтобы пузырь можно было нарисовать
+        # до записи на диск. AUTOINCREMENT не выдаёт id повторно —
+        # учитываем и sqlite_sequence
+        last_id = conn.execute("SELECT MAX(id) FROM messages").fetchone()[0] or 0
+        row = conn.execute(
+            "SELECT seq FROM sqlite_sequence WHERE name='messages'"
+        ).fetchone()
+        self.next_id = max(last_id, row[0] if row else 0) + 1
+
+        self.conn = conn
+        self.ready.set()
+
+    def wait_ready(self):
+        # до конца миграций читать и писать нельзя: схема может быть старой
+        self.ready.wait()
+        if self.error:
+            raise self.error
+
+    # ---------- чтение ----------
+
+    def cursor(self):
+        # своё соединение у каждого потока: UI и фоновые потоки не мешают друг другу
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            self.wait_ready()
+            conn = self.local.conn = sqlite3.connect(self.path)
+        return conn.cursor()
+
+    def query(self, sql, params=(), name="other"):
+        # name — метка запроса в метриках
+        with QUERY.time(name):
+            return self.cursor().execute(sql, params).fetchall()
+
+    def query_one(self, sql, params=(), name="other"):
+        with QUERY.time(name):
+            return self.cursor().execute(sql, params).fetchone()
+
+    # ---------- запись ----------
+
+    def write(self, sql, params=(), many=False, wait=True):
+        # ждёт, пока запрос (и всё, что стояло перед ним) окажется в базе;
+        # возвращает lastrowid, для many — rowcount.
+        # wait=False — только поставить в очередь, запишется с ближайшей пачкой
+        if wait:
+            self.wait_ready()
+        future = Future() if wait else None
+        self.queue.put((WRITE, (sql, params, many), future))
+        return future.result() if wait else None
+
+    def add_message(self, chat_id, sender, text, time, relay_id=None, uid=None):
+        # не ждёт записи: сообщение ляжет на диск с ближайшей пачкой.
+        # Строка с уже известным uid не добавится (INSERT OR IGNORE)
+        self.wait_ready()
+        with self.id_lock:
+            msg_id = self.next_id
+            self.next_id += 1
+            if uid is not None:
+                self.queued_uids[uid] = msg_id
+            self.queue.put((MESSAGE, (msg_id, chat_id, sender, text, time, relay_id, uid), None))
+
+        return msg_id
+
+    def ack_message(self, uid, relay_id):
+        # релей вернул наше сообщение: строка уже есть, запоминаем только
+        # общий id — по нему сходятся отметки о прочтении
+        self.write(
+            "UPDATE messages SET relay_id=? WHERE uid=? AND relay_id IS NULL",
+            (relay_id, uid),
+            wait=False
+        )
+
+    def flush(self):
+        # после flush читатели видят все поставленные ранее записи
+        if self.thread.is_alive():
+            self.write("SELECT 1")
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put((CLOSE, None, None))
+            self.thread.join()
+
+    def run(self):
+        try:
+            self.open()
+        except Exception as e:
+            # ошибку увидит первый, кто пойдёт в базу
+            self.error = e
+            self.loaded.set()
+            self.ready.set()
+            return
+
+        while True:
+            tasks = [self.queue.get()]
+
+            # сообщения и записи без ожидания копятся до delay секунд;
+            # если кто-то ждёт результат, пачку закрываем сразу
+            deadline = time.monotonic() + (0 if self.urgent(tasks[0]) else self.delay)
+            while not self.urgent(tasks[-1]) and len(tasks) < self.batch_size:
+                try:
+                    # уже стоящее в очереди забираем без ожидания
+                    tasks.append(self.queue.get_nowait())
+                    continue
+                except queue.Empty:
+                    pass
+
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                try:
+                    tasks.append(self.queue.get(timeout=left))
+                except queue.Empty:
+                    break
+
+            try:
+                BATCH_TASKS.observe(len(tasks))
+                with BATCH.time():
+                    alive = self.apply(tasks)
+            except sqlite3.Error as e:
+                # пачка не легла — откатываем и отдаём ошибку всем, кто ждёт
+                self.conn.rollback()
+                for kind, payload, future in tasks:
+                    if future is not None and not future.done():
+                        future.set_exception(e)
+                alive = all(kind != CLOSE for kind, payload, future in tasks)
+
+            # пачка закоммичена (или потеряна) — дальше uid ищем в базе
+            for kind, payload, future in tasks:
+                if kind == MESSAGE and payload[6] is not None:
+                    self.queued_uids.pop(payload[6], None)
+
+            if not alive:
+                self.conn.close()
+                return
+
+    def urgent(self, task):
+        kind, payload, future = task
+        return kind == CLOSE or future is not None
+
+    def apply(self, tasks):
+        # одна транзакция (и один fsync) на всю пачку, порядок задач сохраняется
+        rows = []
+        done = []
+        settings = {}
+
+        for kind, payload, future in tasks:
+            if kind == MESSAGE:
+                rows.append(payload)
+                continue
+
+            if kind == SETTING:
+                key, value = payload
+                settings[key] = value
+                continue
+
+            self.insert_messages(rows)
+            rows = []
+
+            if kind == CLOSE:
+                self.write_settings(settings)
+                self.conn.commit()
+                self.resolve(done)
+                return False
+
+            sql, params, many = payload
+            try:
+                if many:
+                    result = self.conn.executemany(sql, params).rowcount
+                else:
+                    result = self.conn.execute(sql, params).lastrowid
+                done.append((future, result, None))
+            except Exception as e:
+                if future is None:
+                    print("Ошибка записи:", e)
+                done.append((future, None, e))
+
+        self.insert_messages(rows)
+        # настройки — в той же транзакции, что и сообщения пачки:
+        # sync_id не окажется на диске раньше самих сообщений
+        self.write_settings(settings)
+        self.conn.commit()
+        self.resolve(done)
+        return True
+
+    def write_settings(self, settings):
+        if settings:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                settings.items()
+            )
+
+    def insert_messages(self, rows):
+        if rows:
+            self.conn.executemany("""
+                                  INSERT OR IGNORE INTO messages (id, chat_id, sender, text, time, relay_id, uid, is_read)
+                                  VALUES (?, ?, ?, ?, ?, ?, ?, 0)
+                                  """, rows)
+
+    def resolve(self, done):
+        # результаты отдаём только после commit: вызывающий сразу читает свежие данные
+        for future, result, error in done:
+            if future is None:
+                continue
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    # ---------- запросы приложения ----------
+
+    def get_setting(self, key, default=None):
+        # из кеша, без запроса; значения с диска — строки
+        self.loaded.wait()
+        return self.settings.get(key, default)
+
+    def set_setting(self, key, value):
+        # не ждёт диска: запишется с ближайшей пачкой писателя
+        self.loaded.wait()
+        self.settings[key] = value
+        self.queue.put((SETTING, (key, value), None))
+
+    def user_name(self, username):
+        # None — такого пользователя нет
+        row = self.query_one("SELECT name FROM users WHERE username=?", (username,), "user_name")
+        return row[0] if row else None
+
+    def user_profile(self, username):
+        return self.query_one(
+            "SELECT username, bio, avatar FROM users WHERE username=?",
+            (username,),
+            "user_profile"
+        )
+
+    def create_user(self, username, name):
+        self.write("""
+                   INSERT INTO users (username, name, avatar, bio, online)
+                   VALUES (?, ?, '', '', 0)
+                   """, (username, name))
+
+    def set_avatar(self, username, avatar):
+        self.write("UPDATE users SET avatar=? WHERE username=?", (avatar, username))
+
+    def chat_members(self, chat_id):
+        return [
+            row[0] for row in
+            self.query("SELECT username FROM members WHERE chat_id=?", (chat_id,), "chat_members")
+        ]
+
+    def group_info(self, chat_id):
+        # -> (название, число участников); сами участники группы UI не нужны
+        return self.query_one("""
+                              SELECT name, (SELECT COUNT(*) FROM members WHERE chat_id = chats.id)
+                              FROM chats WHERE id=?
+                              """, (chat_id,), "group_info")
+
+    def chat_exists(self, chat_id):
+        return self.query_one("SELECT 1 FROM chats WHERE id=?", (chat_id,), "chat_exists") is not None
+
+    def create_chat(self, chat_id, name, members):
+        self.write("INSERT OR IGNORE INTO chats (id, name) VALUES (?,?)", (chat_id, name))
+        # OR IGNORE: в чате с самим собой участник один
+        self.write(
+            "INSERT OR IGNORE INTO members (chat_id, username) VALUES (?,?)",
+            [(chat_id, username) for username in members],
+            many=True
+        )
+
+    def history(self, chat_id, limit, before=None, after=None):
+        # keyset-пагинация по (chat_id, id): без OFFSET и без полного прохода
+        if after is not None:
+            return self.query("""
+                              SELECT id, sender, text, time, is_read FROM messages
+                              WHERE chat_id=? AND id>? ORDER BY id LIMIT ?
+                              """, (chat_id, after, limit), "history")
+
+        if before is not None:
+            rows = self.query("""
+                              SELECT id, sender, text, time, is_read FROM messages
+                              WHERE chat_id=? AND id<? ORDER BY id DESC LIMIT ?
+                              """, (chat_id, before, limit), "history")
+        else:
+            rows = self.query("""
+                              SELECT id, sender, text, time, is_read FROM messages
+                              WHERE chat_id=? ORDER BY id DESC LIMIT ?
+                              """, (chat_id, limit), "history")
+        return rows[::-1]
+
+    def mark_read(self, chat_id, username, up_to, sender=None):
+        # username прочитал чат до локального id up_to: одно UPDATE по диапазону
+        # (read_id, up_to] индекса (chat_id, id), а не проход по всему чату.
+        # Счётчики непрочитанного уменьшает триггер messages_summary_read.
+        # sender — отметка собеседника: прочитанными становятся только
+        # сообщения sender (своего аккаунта), а не чужие в той же группе
+        self.write("""
+                   UPDATE messages SET is_read=1
+                   WHERE chat_id = :chat
+                     AND id > (SELECT read_id FROM members WHERE chat_id = :chat AND username = :user)
+                     AND id <= :up_to
+                     AND sender != :user
+                     AND (:sender IS NULL OR sender = :sender)
+                     AND is_read = 0
+                   """, {"chat": chat_id, "user": username, "up_to": up_to, "sender": sender}, wait=False)
+        self.write("""
+                   UPDATE members SET read_id = MAX(read_id, :up_to)
+                   WHERE chat_id = :chat AND username = :user
+                   """, {"chat": chat_id, "user": username, "up_to": up_to}, wait=False)
+
+    def relay_id_at(self, chat_id, up_to):
+        # общий id последнего сообщения не новее локального up_to — его и шлём собеседнику
+        row = self.query_one("""
+                             SELECT relay_id FROM messages
+                             WHERE chat_id=? AND id<=? AND relay_id IS NOT NULL
+                             ORDER BY id DESC LIMIT 1
+                             """, (chat_id, up_to), "relay_id_at")
+        return row[0] if row else None
+
+    def local_id_at(self, chat_id, relay_id):
+        # обратное: водяной знак собеседника в наших локальных id
+        row = self.query_one("""
+                             SELECT id FROM messages
+                             WHERE chat_id=? AND relay_id<=?
+                             ORDER BY relay_id DESC LIMIT 1
+                             """, (chat_id, relay_id), "local_id_at")
+        return row[0] if row else None
+
+    def add_attachment(self, digest, size, width, height):
+        # повторная отправка или пересылка того же файла ничего не добавит
+        self.write(
+            "INSERT OR IGNORE INTO attachments (hash, size, width, height) VALUES (?, ?, ?, ?)",
+            (digest, size, width, height),
+            wait=False
+        )
+
+    def message_id(self, uid):
+        # локальный id сообщения с таким uid, None — его у нас нет
+        msg_id = self.queued_uids.get(uid)
+        if msg_id is not None:
+            return msg_id
+        row = self.query_one("SELECT id FROM messages WHERE uid=?", (uid,), "message_id")
+        return row[0] if row else None
+
+    def delete_message(self, msg_id):
+        self.write("DELETE FROM messages WHERE id=?", (msg_id,))
+
+    def chat_list(self, username):
+        cur = self.cursor()
+        with QUERY.time("chat_list"):
+            return chat_list(cur, username)
+
+    def search_users(self, text, offset=0):
+        cur = self.cursor()
+        with QUERY.time("search_users"):
+            return search_users(cur, text, offset)
+
+    def search_messages(self, username, text, before=None):
+        cur = self.cursor()
+        with QUERY.time("search_messages"):
+            return search_messages(cur, username, text, before)
@@ -0,0 +1,77 @@
+import struct
+
+
+# ================= FRAMING =================
+# Общий слой кадрирования для релея и клиента.
+# LINE   — JSON-кадры через "\n" (протокол по умолчанию)
+# LENGTH — 4 байта длины (big-endian) + тело кадра
+
+LINE = "line"
+LENGTH = "length"
+
+MAX_FRAME = 1024 * 1024
+
+HEADER = struct.Struct(">I")
+
+
+def encode_frame(payload, mode=LINE):
+    if mode == LENGTH:
+        return HEADER.pack(len(payload)) + payload
+    return payload + b"\n"
+
+
+class FrameReader:
+
+    def __init__(self, mode=LINE, max_frame=MAX_FRAME):
+        self.mode = mode
+        self.max_frame = max_frame
+        self.buffer = bytearray()
+        self.start = 0  # начало ещё не отданных данных
+        self.scan = 0   # до какого места уже искали "\n"
+
+    def feed(self, data):
+        self.buffer += data
+
+    def frames(self):
+        # режим читается на каждом кадре, поэтому его можно
+        # переключить прямо посреди разбора (после hello)
+        while True:
+            frame = self.next_length() if self.mode == LENGTH else self.next_line()
+            if frame is None:
+                break
+            yield frame
+
+        # сдвигаем хвост один раз за пачку, а не после каждого кадра
+        if self.start:
+            del self.buffer[:self.start]
+            self.scan -= self.start
+            self.start = 0
+
+        if len(self.buffer) > self.max_frame + HEADER.size:
+            raise ValueError("Слишком большой кадр")
+
+    def next_line(self):
+        end = self.buffer.find(b"\n", max(self.scan, self.start))
+        if end == -1:
+            self.scan = len(self.buffer)
+            return None
+
+        frame = bytes(memoryview(self.buffer)[self.start:end])
+        self.start = self.scan = end + 1
+        return frame
+
+    def next_length(self):
+        available = len(self.buffer) - self.start
+        if available < HEADER.size:
+            return None
+
+        (size,) = HEADER.unpack_from(self.buffer, self.start)
+        if size > self.max_frame:
+            raise ValueError("Слишком большой кадр")
+        if available < HEADER.size + size:
+            return None
+
+        begin = self.start + HEADER.size
+        frame = bytes(memoryview(self.buffer)[begin:begin + size])
+        self.start = self.scan = begin + size
+        return frame
@@ -1,255 +1,641 @@
+from time import perf_counter
+
+# отсчёт фаз старта для FLETGRAM_UI_TRACE — раньше импорта Flet, он самый тяжёлый
+STARTED = perf_counter()
+
 import flet as ft
-import sqlite3
+import asyncio
 from datetime import datetime
-import socket
-import threading
-import json
 import os
-import shutil
 import math
-
-
-# ================= DATABASE =================
-
-conn = sqlite3.connect("fletgram.db", check_same_thread=False)
-cur = conn.cursor()
-
-cur.execute("""
-CREATE TABLE IF NOT EXISTS users (
-    username TEXT PRIMARY KEY,
-    name TEXT,
-    avatar TEXT DEFAULT '',
-    bio TEXT DEFAULT '',
-    online INTEGER DEFAULT 0
+import atexit
+import uuid
+
+from framing import LINE
+from client import RelayClient
+from codec import BINARY, LARGE_CHAT
+from avatars import (
+    save_avatar, avatar_src, thumbnail_src, remember, forget,
+    SMALL, LARGE
 )
-""")
-
-cur.execute("""
-CREATE TABLE IF NOT EXISTS chats (
-    id TEXT PRIMARY KEY,
-    name TEXT
+from attachments import (
+    save_attachment, receive_chunk, parse_ref, make_ref, preview_src, blob_path
 )
-""")
+from db import Database, SEARCH_PAGE, MATCH_START, MATCH_END, GROUP_PREFIX, is_group, private_members
+from settings import Settings
+from snapshot import save_snapshot, load_snapshot, drop_snapshot
+import metrics
 
-cur.execute("""
-CREATE TABLE IF NOT EXISTS members (
-    chat_id TEXT,
-    username TEXT
-)
-""")
-
-cur.execute("""
-CREATE TABLE IF NOT EXISTS messages (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    chat_id TEXT,
-    sender TEXT,
-    text TEXT,
-    time TEXT,
-    is_read INTEGER DEFAULT 0,
-    type TEXT DEFAULT 'text'
-)
-""")
 
-cur.execute("""
-CREATE TABLE IF NOT EXISTS settings (
-    key TEXT PRIMARY KEY,
-    value TEXT
-)
-""")
+# ================= DATABASE =================
 
-conn.commit()
+# запись — через один поток-писатель, чтение — своим соединением в каждом потоке;
+# сообщения пишутся пачками, на выходе дописываем хвост. Открытие и миграции
+# идут в потоке писателя, пока поднимается Flet; папки картинок создаются
+# при первой картинке
+db = Database("fletgram.db")
+atexit.register(db.close)
+settings = Settings(db)
 
-if not os.path.exists("avatars"):
-    os.makedirs("avatars")
+# встроенный релей поднимается при первом подключении, уже после первого кадра
+local_relay = {"ready": None}
 
 
 # ================= HELPERS =================
 
+# кадрирование протокола: LINE (JSON через \n) или LENGTH (префикс длины)
+FRAMING = LINE
+# кодек кадров: BINARY экономит мобильный трафик (сам переводит кадрирование
+# в LENGTH); релей без его поддержки не ответит на hello — останется JSON
+CODEC = BINARY
+
+PAGE_SIZE = 50    # сколько сообщений истории подгружаем за раз
+MAX_LOADED = 200  # больше пузырей в открытом чате не держим
+READ_DEBOUNCE = 0.5  # отметку о прочтении шлём, когда прокрутка утихла
+IMAGE_WIDTH = 200    # ширина картинки в пузыре
+LAZY_MARGIN = 3      # картинки качаем на столько пузырей за краем экрана
+TAIL_GUESS = 8       # примерно столько пузырей видно внизу открытого чата
+RECENT_CHATS = 5     # у стольких верхних чатов снимок хранит последнюю страницу
+
+# FLETGRAM_UI_TRACE=1 — печатать время каждого обновления экрана и
+# сколько контролов ушло на клиент целиком (новых, ещё без uid)
+UI_TRACE = bool(os.environ.get("FLETGRAM_UI_TRACE"))
+startup_phases = set()
+
+# FLETGRAM_METRICS=9100 — те же времена обновлений гистограммой на /metrics
+UI_UPDATE = metrics.histogram("fletgram_ui_update_seconds", "Обновление экрана вместе с отправкой на клиент", "screen")
+
+def startup(phase):
+    # фазы старта: сколько прошло от запуска процесса, каждая — один раз
+    if UI_TRACE and phase not in startup_phases:
+        startup_phases.add(phase)
+        print(f"START {phase}: {(perf_counter() - STARTED) * 1000:.0f} мс")
+
+def ensure_relay():
+    # -> Event "релей слушает"; модуль релея импортируем только здесь
+    if local_relay["ready"] is None:
+        from relay import start_server
+        local_relay["ready"] = start_server()
+    return local_relay["ready"]
+
 def now():
     return datetime.now().strftime("%H:%M")
 
-def get_setting(key, default=None):
-    cur.execute("SELECT value FROM settings WHERE key=?", (key,))
-    row = cur.fetchone()
-    return row[0] if row else default
-
-def set_setting(key, value):
-    cur.execute("INSERT OR REPLACE INTO settings VALUES (?,?)", (key, value))
-    conn.commit()
-
-# ================= BUILT-IN SERVER =================
-
-clients = {}  # username -> socket
-
-
-def start_server():
-    def handle_client(conn, addr):
-        try:
-            username = conn.recv(1024).decode()
-            clients[username] = conn
-            print(f"{username} подключился")
-
-            while True:
-                data = conn.recv(4096).decode()
-                if not data:
-                    break
-
-                msg = json.loads(data)
-
-                # рассылаем всем подключённым
-                for user, client_conn in list(clients.items()):
-                    try:
-                        client_conn.send((json.dumps(msg) + "\n").encode())
-
-                    except:
-                        pass
-
-        except Exception as e:
-            print("Ошибка клиента:", e)
-
-        finally:
-            for user, client_conn in list(clients.items()):
-                if client_conn == conn:
-                    del clients[user]
-            conn.close()
-
-    def server_loop():
-        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server.bind(("127.0.0.1", 5000))
-        server.listen()
-        print("Сервер запущен")
-
-        while True:
-            conn, addr = server.accept()
-            threading.Thread(
-                target=handle_client,
-                args=(conn, addr),
-                daemon=True
-            ).start()
-
-    threading.Thread(target=server_loop, daemon=True).start()
+def new_controls(control):
+    # контрол без uid ещё не был на клиенте и уйдёт туда целиком;
+    # у уже отправленных Flet передаёт только изменённые свойства
+    if control is None:
+        return 0
+    own = 1 if control.uid is None else 0
+    return own + sum(new_controls(c) for c in control._get_children())
 
 
 # ================= APP =================
 
 async def main(page: ft.Page):
+    startup("Flet готов")
 
     page.title = "LoliGram"
     page.padding = 0
-    saved_theme = get_setting("theme", "dark")
     file_picker = ft.FilePicker()
-    page.overlay.append(file_picker)
+    attach_picker = ft.FilePicker()
+    page.overlay.extend([file_picker, attach_picker])
 
     page.theme_mode = (
         ft.ThemeMode.DARK
-        if saved_theme == "dark"
+        if settings.theme == "dark"
         else ft.ThemeMode.LIGHT
     )
 
     current_user = {"username": None, "name": None}
-    current_chat = {"id": None}
-    client_socket = None
+    current_chat = {"id": None, "peer": None, "loaded": None, "members": 0}
+    history = {"has_older": False, "has_newer": False}
+    relay = {"client": None}
+    online_users = set()             # собеседники в сети, по дельтам от релея
+    sent_uids = {}                   # uid отправленного -> локальный id, пока релей не вернул эхо
+    known_chats = set()              # чаты, чьи строки в chats/members уже точно есть
+
+    screens = {}                     # имя -> {"appbar", "body"}, строятся один раз
+    current_screen = {"name": None}
+    chat_tiles = {}                  # chat_id -> контролы плитки в списке чатов
+    resume = {"history": {}}         # chat_id -> последняя страница из снимка, до первого открытия
+
+    def on_lifecycle(e):
+        # в фоне Android может убить процесс без atexit — дописываем очередь сразу
+        if e.state in (
+            ft.AppLifecycleState.PAUSE,
+            ft.AppLifecycleState.HIDE,
+            ft.AppLifecycleState.DETACH
+        ):
+            db.flush()
+            save_resume()
+
+    def on_disconnect(e):
+        db.flush()
+        save_resume()
+
+    page.on_app_lifecycle_state_change = on_lifecycle
+    page.on_disconnect = on_disconnect
+
+    def save_resume():
+        # снимок для мгновенного старта: список чатов и последние страницы
+        # недавних чатов; одним запросом на чат, пока приложение уходит в фон
+        username = current_user["username"]
+        if not username or not db.ready.is_set():
+            return
+
+        rows = db.chat_list(username)
+        try:
+            save_snapshot(
+                username,
+                rows,
+                {row[0]: db.history(row[0], PAGE_SIZE) for row in rows[:RECENT_CHATS]},
+                {
+                    tile["avatar_key"]: tile["avatar"].src
+                    for tile in chat_tiles.values() if tile["avatar_key"] is not None
+                }
+            )
+        except OSError as e:
+            print("Снимок не записан:", e)
 
     def toggle_theme(e):
+        # только кеш настроек; на диск уйдёт с ближайшей пачкой писателя
         if page.theme_mode == ft.ThemeMode.DARK:
             page.theme_mode = ft.ThemeMode.LIGHT
-            set_setting("theme", "light")
+            settings.theme = "light"
         else:
             page.theme_mode = ft.ThemeMode.DARK
-            set_setting("theme", "dark")
+            settings.theme = "dark"
 
         page.update()
 
-    def listen_server():
-        nonlocal client_socket
-
-        buffer = ""
-
-        while True:
-            try:
-                data = client_socket.recv(4096).decode()
-                if not data:
-                    break
-
-                buffer += data
+    def send_frame(obj):
+        # кадр только встаёт в очередь, пишет фоновый поток клиента;
+        # False — очередь переполнена (долго нет связи)
+        return relay["client"] is not None and relay["client"].send(obj)
 
-                while "\n" in buffer:
-                    line, buffer = buffer.split("\n", 1)
-
-                    if not line.strip():
-                        continue
+    def on_frame(msg):
+        # вызывается из потока чтения клиента
+        if msg.get("type") == "read":
+            page.run_task(apply_receipt, msg)
+            return
 
-                    msg = json.loads(line)
+        if msg.get("type") == "chat":
+            # новая группа (или нас в неё добавили) — приходит через журнал
+            # релея, как сообщение, в том числе при синхронизации
+            db.create_chat(msg["chat_id"], msg["name"], msg["members"])
+            page.run_task(chat_added)
+            return
 
-                    cur.execute("""
-                                INSERT INTO messages (chat_id, sender, text, time, is_read)
-                                VALUES (?, ?, ?, ?, 0)
-                                """, (
-                                    msg["chat_id"],
-                                    msg["sender"],
-                                    msg["text"],
-                                    msg["time"]
-                                ))
-                    conn.commit()
+        uid = msg.get("uid")
+        if uid:
+            # своё сообщение вернулось от релея — это подтверждение доставки,
+            # а не новая строка. Уже известный uid (отправлено до перезапуска,
+            # повтор, который релей записал в журнал дважды) — тоже не строка
+            # и не пузырь: INSERT OR IGNORE его бы выбросил, а пузырь остался бы
+            local_id = sent_uids.pop(uid, None) or db.message_id(uid)
+            if local_id is not None:
+                db.ack_message(uid, msg.get("id"))
+                return
 
-                    # 🔥 UI обновляем через event loop
-                    page.run_task(update_ui, msg)
+        ensure_chat(msg["chat_id"])
+        msg_id = db.add_message(
+            msg["chat_id"],
+            msg["sender"],
+            msg["text"],
+            msg["time"],
+            msg.get("id"),
+            uid
+        )
 
-            except Exception as e:
-                print("Ошибка listen:", e)
-                break
+        # 🔥 UI обновляем через event loop
+        page.run_task(update_ui, msg, msg_id)
 
-    async def update_ui(msg):
+    async def update_ui(msg, msg_id):
+        chat_open = (
+            current_screen["name"] == "chat"
+            and current_chat["id"] == msg["chat_id"]
+        )
+        changed = []
 
-        if current_chat["id"] == msg["chat_id"]:
-            messages_view.controls.append(
+        # пузырь дописываем в загруженный чат, даже если он сейчас скрыт;
+        # если пользователь листает старую историю — новое подгрузится при прокрутке вниз
+        if current_chat["loaded"] == msg["chat_id"] and not history["has_newer"]:
+            append_bubble(
                 bubble(
-                    cur.lastrowid,
+                    msg_id,
                     msg["text"],
                     msg["sender"] == current_user["username"],
                     msg["time"],
-                    0
+                    0,
+                    msg["sender"]
                 )
             )
+            changed.append(messages_view)
+
+            if chat_open:
+                fetch_tail()
+            if chat_open and msg["sender"] != current_user["username"]:
+                mark_seen(msg["chat_id"], msg_id)
+
+        if touch_chat_tile(msg, chat_open):
+            changed.append(chats_view)
+        elif current_screen["name"] == "chats":
+            # первое сообщение в новом чате — плитки ещё нет
+            show_chats()
+            return
+
+        if changed:
+            refresh("incoming", *changed)
 
-            messages_view.update()
+    def ensure_chat(chat_id):
+        # личный чат, которого на этом устройстве ещё нет (первое сообщение
+        # от нового собеседника или история, пришедшая через sync): без строк
+        # в chats и members он не попал бы в список чатов
+        if chat_id in known_chats:
+            return
+        known_chats.add(chat_id)
+        members = private_members(chat_id)
+        if members and not db.chat_exists(chat_id):
+            me = current_user["username"]
+            db.create_chat(chat_id, next((m for m in members if m != me), me), members)
+
+    async def chat_added():
+        # у новой группы ещё нет плитки — список строим заново
+        if current_screen["name"] == "chats":
+            show_chats()
 
     def connect_to_server():
-        nonlocal client_socket
-        try:
-            client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            client_socket.connect(("127.0.0.1", 5000))
+        # переподключается сам, с растущей задержкой; очередь переживает обрывы
+        if relay["client"] is None:
+            username = current_user["username"]
+
+            def on_sync(last_id):
+                startup("первая синхронизация")
+                # запишется в одной транзакции с самими сообщениями
+                settings.set_sync_id(username, last_id)
+
+            relay["client"] = RelayClient(
+                username,
+                on_frame,
+                framing=FRAMING,
+                codec=CODEC,
+                last_id=settings.sync_id(username),
+                on_sync=on_sync,
+                on_presence=lambda *delta: page.run_task(update_presence, *delta),
+                on_blob=on_blob
+            )
+            relay["client"].start(after=ensure_relay())
+
+    def disconnect_from_server():
+        if relay["client"] is not None:
+            relay["client"].close()
+            relay["client"] = None
+        online_users.clear()
+
+    async def update_presence(online, offline, snapshot):
+        # после переподключения релей присылает полный список заново
+        if snapshot:
+            online_users.clear()
+        online_users.update(online)
+        online_users.difference_update(offline)
+
+        if current_screen["name"] == "chat":
+            show_status()
+            refresh("presence", chat_status)
+
+    # ================= HISTORY =================
+
+    def fetch_page(chat_id, before=None, after=None):
+        return db.history(chat_id, PAGE_SIZE, before=before, after=after)
+
+    def message_bubbles(rows):
+        return [
+            bubble(
+                msg_id,
+                text,
+                sender == current_user["username"],
+                time if time else "",
+                is_read,
+                sender
+            )
+            for msg_id, sender, text, time, is_read in rows
+        ]
+
+    def append_bubble(control):
+        messages_view.controls.append(control)
+
+        # выкидываем самые старые пузыри, они подгрузятся снова при прокрутке вверх
+        extra = len(messages_view.controls) - MAX_LOADED
+        if extra > 0:
+            del messages_view.controls[:extra]
+            history["has_older"] = True
+
+    def load_latest(rows=None):
+        # rows — уже готовая последняя страница (из снимка)
+        if rows is None:
+            rows = fetch_page(current_chat["id"])
+        # пузыри строятся заново, заглушки старых больше не нужны
+        missing.clear()
+        messages_view.controls[:] = message_bubbles(rows)
+        history["has_older"] = len(rows) == PAGE_SIZE
+        history["has_newer"] = False
+
+    def load_older():
+        if not history["has_older"] or not messages_view.controls:
+            return
+
+        rows = fetch_page(current_chat["id"], before=messages_view.controls[0].data)
+        history["has_older"] = len(rows) == PAGE_SIZE
+        if not rows:
+            return
+
+        messages_view.controls[0:0] = message_bubbles(rows)
+
+        # держим окно ограниченным: уехавшие далеко вниз пузыри убираем
+        extra = len(messages_view.controls) - MAX_LOADED
+        if extra > 0:
+            del messages_view.controls[-extra:]
+            history["has_newer"] = True
+
+        messages_view.update()
+
+    def load_newer():
+        if not history["has_newer"] or not messages_view.controls:
+            return
+
+        rows = fetch_page(current_chat["id"], after=messages_view.controls[-1].data)
+        history["has_newer"] = len(rows) == PAGE_SIZE
+
+        for control in message_bubbles(rows):
+            append_bubble(control)
+
+        messages_view.update()
+
+    def on_history_scroll(e):
+        # видимые пузыри — по доле прокрутки; высоты у них разные,
+        # поэтому берём с запасом LAZY_MARGIN в обе стороны
+        total = e.max_scroll_extent + e.viewport_dimension
+        count = len(messages_view.controls)
+        if total > 0 and count:
+            first = int(count * e.pixels / total)
+            last = int(count * (e.pixels + e.viewport_dimension) / total) + 1
+            fetch_visible(first - LAZY_MARGIN, last + LAZY_MARGIN)
+
+        if e.pixels <= e.min_scroll_extent + 50:
+            load_older()
+        elif e.pixels >= e.max_scroll_extent - 50:
+            load_newer()
+            seen_to_end()
+
+    messages_view = ft.ListView(
+        expand=True,
+        spacing=10,
+        padding=10,
+        on_scroll=on_history_scroll,
+        on_scroll_interval=100
+    )
+
+    # ================= READ RECEIPTS =================
+    # Прочтение — водяной знак "до id X в чате Y", а не отметка на каждое
+    # сообщение. Пока пользователь листает, знак только растёт в памяти;
+    # записываем и отправляем его, когда прокрутка утихла на READ_DEBOUNCE.
+
+    read_mark = {"chat_id": None, "up_to": 0, "version": 0, "members": 0}
+    sent_marks = {}  # chat_id -> последний отправленный relay id
+
+    def mark_seen(chat_id, up_to):
+        if read_mark["chat_id"] != chat_id:
+            flush_read()
+            read_mark["chat_id"] = chat_id
+            # отмечают только открытый чат: участников уже посчитал show_chat
+            read_mark["members"] = current_chat["members"]
+
+        read_mark["up_to"] = max(read_mark["up_to"], up_to)
+        read_mark["version"] += 1
+        page.run_task(flush_read_later, read_mark["version"])
+
+    def seen_to_end():
+        # внизу последней страницы — прочитано всё загруженное
+        if current_chat["loaded"] and messages_view.controls and not history["has_newer"]:
+            mark_seen(current_chat["loaded"], messages_view.controls[-1].data)
+
+    async def flush_read_later(version):
+        await asyncio.sleep(READ_DEBOUNCE)
+        if version == read_mark["version"]:
+            flush_read()
+
+    def flush_read():
+        chat_id, up_to = read_mark["chat_id"], read_mark["up_to"]
+        read_mark["chat_id"] = None
+        read_mark["up_to"] = 0
+        if chat_id is None or not up_to:
+            return
+
+        # запись только встаёт в очередь; ждать базу будет send_read в потоке
+        reader = current_user["username"]
+        db.mark_read(chat_id, reader, up_to)
+        page.run_task(send_read, chat_id, reader, up_to, read_mark["members"])
+
+    def read_relay_id(chat_id, up_to):
+        # в потоке: собеседнику — общий id релея; свежие входящие могут
+        # ещё стоять в очереди записи
+        db.flush()
+        return db.relay_id_at(chat_id, up_to)
+
+    async def send_read(chat_id, reader, up_to, members):
+        # в большой группе отметка остаётся своей: разослать её всем — это
+        # O(участников²) кадров и строк журнала релея
+        if is_group(chat_id) and members > LARGE_CHAT:
+            return
+
+        relay_id = await asyncio.to_thread(read_relay_id, chat_id, up_to)
+        if relay_id and relay_id > sent_marks.get(chat_id, 0):
+            sent_marks[chat_id] = relay_id
+            send_frame({
+                "type": "read",
+                "chat_id": chat_id,
+                "reader": reader,
+                "up_to": relay_id
+            })
+
+    def bubble_status(row):
+        # Row -> Container -> Column -> [(автор), текст, Row(время, статус)]
+        return row.controls[0].content.controls[-1].controls[1]
+
+    def store_receipt(msg, me):
+        # в потоке: водяной знак в локальных id и тот же диапазонный UPDATE,
+        # что и для своих отметок; отметка собеседника касается только наших сообщений
+        db.flush()
+        up_to = db.local_id_at(msg["chat_id"], msg["up_to"])
+        if up_to is not None:
+            db.mark_read(msg["chat_id"], msg["reader"], up_to, None if msg["reader"] == me else me)
+        return up_to
+
+    async def apply_receipt(msg):
+        me = current_user["username"]
+        up_to = await asyncio.to_thread(store_receipt, msg, me)
+        if up_to is None:
+            return
+
+        # пока ждали базу, могли уйти из чата — пузыри трогаем только на цикле
+        if msg["reader"] == me or current_chat["loaded"] != msg["chat_id"]:
+            return
 
-            client_socket.send(current_user["username"].encode())
+        changed = False
+        for row in messages_view.controls:
+            if row.data <= up_to and row.alignment == ft.MainAxisAlignment.END:
+                status = bubble_status(row)
+                if status.value != "✓✓":
+                    status.value = "✓✓"
+                    changed = True
+
+        if changed:
+            refresh("receipt", messages_view)
+
+    # ================= SCREENS =================
+    # Каждый экран строится один раз за сессию и дальше только
+    # показывается/скрывается, а данные в нём меняются на месте —
+    # на клиент уходят только изменённые свойства, а не всё дерево.
+
+    def navigate(name, build):
+        if name not in screens:
+            appbar, body = build()
+            screens[name] = {"appbar": appbar, "body": body}
+            page.controls.append(body)
+
+        for screen_name, screen in screens.items():
+            screen["body"].visible = screen_name == name
+
+        page.appbar = screens[name]["appbar"]
+        current_screen["name"] = name
+
+    def refresh(name, *controls):
+        started = perf_counter()
+        sent = sum(new_controls(c) for c in (controls or [page])) if UI_TRACE else 0
+
+        if controls:
+            for control in controls:
+                control.update()
+        else:
+            page.update()
 
-            threading.Thread(target=listen_server, daemon=True).start()
+        UI_UPDATE.observe(perf_counter() - started, name)
+        if UI_TRACE:
+            print(f"UI {name}: {(perf_counter() - started) * 1000:.1f} мс, новых контролов: {sent}")
 
-            print("Подключено к серверу")
+    def reset_session():
+        # при смене пользователя закешированные экраны больше не годятся
+        chat_tiles.clear()
+        chats_view.controls.clear()
+        messages_view.controls.clear()
+        users_results.controls.clear()
+        messages_results.controls.clear()
+        search_field.value = ""
+        current_chat["id"] = current_chat["loaded"] = current_chat["peer"] = None
+        sent_marks.clear()
+        sent_uids.clear()
+        known_chats.clear()
+        missing.clear()
+        resume["history"].clear()
+
+    # ================= IMAGES =================
+    # Картинка в пузыре — превью из общего хранилища по хешу. Если файла
+    # ещё нет, пузырь получает заглушку нужного размера, а сам файл
+    # запрашивается у релея, только когда пузырь доезжает до экрана.
+
+    missing = {}  # msg_id -> hash картинки, которой пока нет
+
+    def image_content(msg_id, text):
+        ref = parse_ref(text)
+        if ref is None:
+            # старые сообщения: "img:<путь к файлу>"
+            return ft.Image(text[4:], width=IMAGE_WIDTH)
+
+        digest, width, height = ref
+        height = min(IMAGE_WIDTH * height // width, 2 * IMAGE_WIDTH) if width else IMAGE_WIDTH
+        src = preview_src(digest)
+        if src:
+            return ft.Image(src, width=IMAGE_WIDTH, height=height, fit=ft.ImageFit.COVER)
+
+        missing[msg_id] = digest
+        return ft.Container(
+            width=IMAGE_WIDTH,
+            height=height,
+            bgcolor=ft.colors.BLACK26,
+            alignment=ft.alignment.center,
+            content=ft.Icon(ft.icons.IMAGE)
+        )
 
-        except Exception as e:
-            print("Ошибка подключения:", e)
-            client_socket = None
+    def fetch_visible(first, last):
+        if relay["client"] is None:
+            return
+        for row in messages_view.controls[max(first, 0):max(last, 0)]:
+            digest = missing.get(row.data)
+            if digest:
+                relay["client"].fetch(digest)
+
+    def fetch_tail():
+        count = len(messages_view.controls)
+        fetch_visible(count - TAIL_GUESS, count)
+
+    def on_blob(msg):
+        # поток чтения клиента: кусок ложится в хранилище
+        size = receive_chunk(msg["hash"], msg["offset"], msg["total"], msg["data"])
+        if size is not None:
+            db.add_attachment(msg["hash"], msg["total"], *size)
+            page.run_task(image_ready, msg["hash"])
+        return size
+
+    async def image_ready(digest):
+        changed = False
+        for row in messages_view.controls:
+            if missing.get(row.data) != digest:
+                continue
+            del missing[row.data]
+
+            # Row -> Container -> Column -> [заглушка, ...]
+            column = row.controls[0].content
+            placeholder = column.controls[0]
+            column.controls[0] = ft.Image(
+                preview_src(digest),
+                width=placeholder.width,
+                height=placeholder.height,
+                fit=ft.ImageFit.COVER
+            )
+            changed = True
 
-    messages_view = ft.ListView(expand=True, spacing=10, padding=10)
+        if changed:
+            refresh("image", messages_view)
 
     # ================= MESSAGE BUBBLE =================
 
     def delete_message(msg_id):
-        cur.execute("DELETE FROM messages WHERE id=?", (msg_id,))
-        conn.commit()
-        show_chat()
+        # сообщение могло ещё не доехать до диска
+        db.flush()
+        db.delete_message(msg_id)
+
+        # убираем только этот пузырь, остальной чат не трогаем
+        messages_view.controls[:] = [c for c in messages_view.controls if c.data != msg_id]
+        refresh("delete", messages_view)
 
-    def bubble(msg_id, text, me, time, is_read):
+    def bubble(msg_id, text, me, time, is_read, sender=None):
 
         status = "✓✓" if me and is_read else "✓" if me else ""
 
         content = (
-            ft.Image(text[4:], width=200)
+            image_content(msg_id, text)
             if text.startswith("img:")
             else ft.Text(text, color="white")
         )
 
+        # в группе над чужим сообщением — кто его написал
+        author = []
+        if not me and sender and current_chat["peer"] is None:
+            author = [ft.Text(sender, size=11, weight="bold", color="white70")]
+
         return ft.Row(
+            data=msg_id,
             alignment=ft.MainAxisAlignment.END if me else ft.MainAxisAlignment.START,
             controls=[
                 ft.Container(
@@ -259,7 +645,7 @@ async def main(page: ft.Page):
                     on_long_press=lambda e: delete_message(msg_id),
                     content=ft.Column(
                         spacing=4,
-                        controls=[
+                        controls=author + [
                             content,
                             ft.Row(
                                 alignment=ft.MainAxisAlignment.END,
@@ -277,540 +663,825 @@ async def main(page: ft.Page):
 
     # ================= LOGIN =================
 
-    def show_login():
-        page.clean()
-
-        username = ft.TextField(label="Username (@username)", width=300)
-
-        def login(e):
-            cur.execute("SELECT name FROM users WHERE username=?", (username.value,))
-            row = cur.fetchone()
-            if not row:
-                username.error_text = "Пользователь не найден"
-                page.update()
-                return
+    login_field = ft.TextField(label="Username (@username)", width=300)
 
-            current_user["username"] = username.value
-            current_user["name"] = row[0]
-            set_setting("last_user", username.value)
+    def login(e):
+        name = db.user_name(login_field.value)
+        if name is None:
+            login_field.error_text = "Пользователь не найден"
+            refresh("login", login_field)
+            return
 
-            cur.execute("UPDATE users SET online=1 WHERE username=?", (username.value,))
-            conn.commit()
+        current_user["username"] = login_field.value
+        current_user["name"] = name
+        settings.remember_user(login_field.value, name)
 
-            show_chats()
-            connect_to_server()
+        show_chats()
+        connect_to_server()
 
-        page.add(
-            ft.Column(
-                alignment=ft.MainAxisAlignment.CENTER,
-                horizontal_alignment=ft.CrossAxisAlignment.CENTER,
-                expand=True,
-                controls=[
-                    ft.Text("FletGram", size=34, weight="bold"),
-                    username,
-                    ft.ElevatedButton("Войти", on_click=login, width=300),
-                    ft.TextButton("Регистрация", on_click=lambda e: show_register())
-                ]
-            )
+    def build_login():
+        return None, ft.Column(
+            alignment=ft.MainAxisAlignment.CENTER,
+            horizontal_alignment=ft.CrossAxisAlignment.CENTER,
+            expand=True,
+            controls=[
+                ft.Text("FletGram", size=34, weight="bold"),
+                login_field,
+                ft.ElevatedButton("Войти", on_click=login, width=300),
+                ft.TextButton("Регистрация", on_click=lambda e: show_register())
+            ]
         )
 
-    # ================= REGISTER =================
+    def show_login():
+        login_field.value = ""
+        login_field.error_text = None
+        navigate("login", build_login)
+        refresh("login")
 
-    def show_register():
-        page.clean()
+    # ================= REGISTER =================
 
-        name = ft.TextField(label="Имя", width=300)
-        username = ft.TextField(label="Username (@username)", width=300)
+    register_name = ft.TextField(label="Имя", width=300)
+    register_username = ft.TextField(label="Username (@username)", width=300)
 
-        def register(e):
-            if not username.value.startswith("@"):
-                username.error_text = "Username должен начинаться с @"
-                page.update()
-                return
+    def register(e):
+        if not register_username.value.startswith("@"):
+            register_username.error_text = "Username должен начинаться с @"
+            refresh("register", register_username)
+            return
 
-            cur.execute("SELECT username FROM users WHERE username=?", (username.value,))
-            if cur.fetchone():
-                username.error_text = "Username занят"
-                page.update()
-                return
+        if db.user_name(register_username.value) is not None:
+            register_username.error_text = "Username занят"
+            refresh("register", register_username)
+            return
 
-            cur.execute("""
-            INSERT INTO users (username,name,avatar,bio,online)
-            VALUES (?,?,?,?,?)
-            """, (username.value, name.value, "", "", 0))
-            conn.commit()
+        db.create_user(register_username.value, register_name.value)
 
-            current_user["username"] = username.value
-            current_user["name"] = name.value
-            set_setting("last_user", username.value)
+        current_user["username"] = register_username.value
+        current_user["name"] = register_name.value
+        settings.remember_user(register_username.value, register_name.value)
 
-            show_chats()
+        show_chats()
+        connect_to_server()
 
-        page.add(
-            ft.Column(
-                alignment=ft.MainAxisAlignment.CENTER,
-                horizontal_alignment=ft.CrossAxisAlignment.CENTER,
-                expand=True,
-                controls=[
-                    ft.Text("Регистрация", size=30, weight="bold"),
-                    name,
-                    username,
-                    ft.ElevatedButton("Создать", on_click=register, width=300)
+    def build_register():
+        return None, ft.Column(
+            alignment=ft.MainAxisAlignment.CENTER,
+            horizontal_alignment=ft.CrossAxisAlignment.CENTER,
+            expand=True,
+            controls=[
+                ft.Text("Регистрация", size=30, weight="bold"),
+                register_name,
+                register_username,
+                ft.ElevatedButton("Создать", on_click=register, width=300)
 
-                ]
-            )
+            ]
         )
 
+    def show_register():
+        register_name.value = register_username.value = ""
+        register_username.error_text = None
+        navigate("register", build_register)
+        refresh("register")
+
     # ================= CHATS =================
 
-    def show_chats():
-        page.clean()
+    chats_view = ft.ListView(
+        expand=True,
+        spacing=4,
+        padding=ft.padding.only(top=8)
+    )
 
-        def open_chat(cid):
-            current_chat["id"] = cid
-            show_chat()
+    def preview(text):
+        if text and text.startswith("img:"):
+            return "Фото"
+        return text or ""
 
-        cur.execute("""
-                    SELECT c.id
-                    FROM chats c
-                             JOIN members m ON c.id = m.chat_id
-                    WHERE m.username = ?
-                    """, (current_user["username"],))
+    def open_chat(cid):
+        current_chat["id"] = cid
+        show_chat()
 
-        chat_tiles = []
+    def chat_tile(cid):
+        # плитка создаётся один раз, дальше у неё меняются только значения
+        tile = chat_tiles.get(cid)
+        if tile:
+            return tile
+
+        tile = {
+            "avatar": ft.Image(fit=ft.ImageFit.COVER, visible=False),
+            "avatar_key": None,  # users.avatar, для которого уже найдено превью
+            "title": ft.Text(weight="bold"),
+            "subtitle": ft.Text(max_lines=1, overflow=ft.TextOverflow.ELLIPSIS),
+            "time": ft.Text(size=11),
+            "badge_text": ft.Text(size=11, color="white"),
+        }
+        tile["badge"] = ft.Container(
+            content=tile["badge_text"],
+            bgcolor=ft.colors.BLUE,
+            border_radius=10,
+            padding=ft.padding.symmetric(horizontal=6, vertical=1),
+            visible=False
+        )
+        tile["control"] = ft.Container(
+            content=ft.ListTile(
+                leading=ft.CircleAvatar(radius=20, content=tile["avatar"]),
+                title=tile["title"],
+                subtitle=tile["subtitle"],
+                trailing=ft.Column(
+                    spacing=4,
+                    alignment=ft.MainAxisAlignment.CENTER,
+                    horizontal_alignment=ft.CrossAxisAlignment.END,
+                    controls=[tile["time"], tile["badge"]]
+                ),
+                on_click=lambda e: open_chat(cid)
+            ),
+            margin=ft.margin.symmetric(vertical=4, horizontal=8),  # маленький зазор
+            border_radius=10,
+        )
 
-        for (cid,) in cur.fetchall():
+        chat_tiles[cid] = tile
+        return tile
+
+    def set_unread(tile, unread):
+        tile["badge_text"].value = str(unread)
+        tile["badge"].visible = unread > 0
+
+    def build_chats():
+        appbar = ft.AppBar(
+            title=ft.Text("Чаты"),
+            actions=[
+                ft.IconButton(ft.icons.GROUP_ADD, on_click=lambda e: show_new_group()),
+                ft.IconButton(ft.icons.SEARCH, on_click=lambda e: show_search()),
+                ft.IconButton(ft.icons.SETTINGS, on_click=lambda e: show_settings()),
+                ft.IconButton(ft.icons.DARK_MODE, on_click=toggle_theme),
+            ]
+        )
+        return appbar, ft.Column(expand=True, controls=[chats_view])
 
-            # получаем второго участника
-            cur.execute(
-                "SELECT username FROM members WHERE chat_id=?",
-                (cid,)
-            )
-            members = [row[0] for row in cur.fetchall()]
+    def show_chats():
+        # свежие сообщения должны попасть в превью
+        db.flush()
+
+        # уходя из чата, отметку о прочтении не откладываем
+        flush_read()
+
+        navigate("chats", build_chats)
+        render_chats(db.chat_list(current_user["username"]))
+        refresh("chats")
+
+    def render_chats(rows, avatars=None):
+        # строки chat_list (из базы или из снимка) -> плитки по порядку;
+        # avatars — уже найденные файлы превью, их по диску не ищем
+        controls = []
+        pending_avatars = []
+
+        for cid, other_user, avatar_filename, last_text, last_time, unread in rows:
+            # аватар уже пришёл в общем запросе — запоминаем для шапки чата;
+            # у группы вместо собеседника название
+            if not is_group(cid):
+                remember(other_user, avatar_filename)
+
+            tile = chat_tile(cid)
+            if tile["avatar_key"] != avatar_filename:
+                if avatars and avatar_filename in avatars:
+                    tile["avatar_key"] = avatar_filename
+                    tile["avatar"].src = avatars[avatar_filename]
+                    tile["avatar"].visible = bool(tile["avatar"].src)
+                else:
+                    pending_avatars.append((tile, avatar_filename))
+            tile["title"].value = other_user
+            tile["subtitle"].value = preview(last_text)
+            tile["time"].value = last_time or ""
+            set_unread(tile, unread)
+
+            controls.append(tile["control"])
+
+        # те же объекты в новом порядке: Flet отправит только перестановки
+        chats_view.controls[:] = controls
+
+        if pending_avatars:
+            page.run_task(load_avatars, pending_avatars)
+
+    async def load_avatars(pending):
+        # поиск файлов превью — по диску, поэтому уже после того, как список показан
+        found = await asyncio.to_thread(
+            lambda: [thumbnail_src(avatar_filename, SMALL) for _, avatar_filename in pending]
+        )
+        for (tile, avatar_filename), avatar in zip(pending, found):
+            tile["avatar_key"] = avatar_filename
+            tile["avatar"].src = avatar
+            tile["avatar"].visible = bool(avatar)
+        refresh("avatars", chats_view)
 
-            other_user = None
-            for m in members:
-                if m != current_user["username"]:
-                    other_user = m
-                    break
-
-            if not other_user:
-                other_user = current_user["username"]
-
-            # получаем аватар
-            cur.execute(
-                "SELECT avatar FROM users WHERE username=?",
-                (other_user,)
-            )
-            row = cur.fetchone()
-            avatar_filename = row[0] if row and row[0] else None
-
-            tile = ft.Container(
-                content=ft.ListTile(
-                    leading=ft.CircleAvatar(
-                        radius=20,
-                        content=ft.Image(
-                            src=f"avatars/{avatar_filename}",
-                            fit=ft.ImageFit.COVER
-                        ) if avatar_filename else None
-                    ),
-                    title=ft.Text(other_user, weight="bold"),
-                    on_click=lambda e, c=cid: open_chat(c)
-                ),
-                margin=ft.margin.symmetric(vertical=4, horizontal=8),  # маленький зазор
-                border_radius=10,
-            )
+    def touch_chat_tile(msg, chat_open):
+        # входящее сообщение меняет одну плитку и поднимает её наверх
+        tile = chat_tiles.get(msg["chat_id"])
+        if not tile:
+            return False
 
-            chat_tiles.append(tile)
+        tile["subtitle"].value = preview(msg["text"])
+        tile["time"].value = msg["time"]
+        if msg["sender"] != current_user["username"] and not chat_open:
+            set_unread(tile, int(tile["badge_text"].value or 0) + 1)
 
-        page.add(
-            ft.AppBar(
-                title=ft.Text("Чаты"),
-                actions=[
-                    ft.IconButton(ft.icons.SEARCH, on_click=lambda e: show_search()),
-                    ft.IconButton(ft.icons.SETTINGS, on_click=lambda e: show_settings()),
-                    ft.IconButton(ft.icons.DARK_MODE, on_click=toggle_theme),
-                ]
-            ),
-            ft.ListView(
-                expand=True,
-                spacing=4,
-                padding=ft.padding.only(top=8),
-                controls=chat_tiles
-            )
-        )
+        if chats_view.controls and chats_view.controls[0] is not tile["control"]:
+            chats_view.controls.remove(tile["control"])
+            chats_view.controls.insert(0, tile["control"])
 
-        page.update()
+        return True
 
     # ================= CHAT =================
 
-    def show_chat():
-        page.clean()
+    chat_avatar = ft.Image(fit=ft.ImageFit.COVER, visible=False)
+    chat_title = ft.Text(weight="bold")
+    chat_status = ft.Text(size=12)
 
-        chat_id = current_chat["id"]
+    def show_status():
+        if current_chat["peer"] is None:
+            # группа: присутствие в больших чатах релей не рассылает
+            chat_status.value = f"участников: {current_chat['members']}"
+            chat_status.color = None
+            return
+        online = current_chat["peer"] in online_users
+        chat_status.value = "в сети" if online else "не в сети"
+        chat_status.color = ft.colors.GREEN if online else None
+    message_input = ft.TextField(
+        hint_text="Сообщение...",
+        expand=True,
+        on_submit=lambda e: send_message()
+    )
 
-        # ---------- участники ----------
-        cur.execute(
-            "SELECT username FROM members WHERE chat_id=?",
-            (chat_id,)
-        )
-        members = [row[0] for row in cur.fetchall()]
+    def send_message():
+        text = message_input.value.strip()
+        if not text:
+            return
 
-        other_user = next(
-            (m for m in members if m != current_user["username"]),
-            current_user["username"]
-        )
+        if post_message(text):
+            message_input.value = ""
+        refresh("send", messages_view, message_input)
+        messages_view.scroll_to(offset=-1)
 
-        # ---------- аватар ----------
-        cur.execute(
-            "SELECT avatar FROM users WHERE username=?",
-            (other_user,)
-        )
-        row = cur.fetchone()
-        avatar_filename = row[0] if row and row[0] else None
-
-        chat_avatar = ft.Container(
-            content=ft.CircleAvatar(
-                radius=18,
-                content=ft.Image(
-                    src=f"avatars/{avatar_filename}",
-                    fit=ft.ImageFit.COVER
-                ) if avatar_filename else None,
-            ),
-            on_click=lambda e: show_user_profile(other_user)
-        )
+    def on_photo_selected(e):
+        if not e.files:
+            return
 
-        messages_view.controls.clear()
+        # одна копия на хеш: повторное или пересланное фото файл не дублирует
+        digest, size, width, height = save_attachment(e.files[0].path)
+        db.add_attachment(digest, size, width, height)
 
-        # ---------- загрузка сообщений ----------
-        cur.execute(
-            "SELECT id, sender, text, time, is_read FROM messages WHERE chat_id=? ORDER BY id",
-            (chat_id,)
-        )
+        # сначала короткое сообщение-ссылка, сам файл — следом, кусками в фоне
+        if post_message(make_ref(digest, width, height)):
+            relay["client"].upload(digest, blob_path(digest), size)
+        refresh("send", messages_view, message_input)
+        messages_view.scroll_to(offset=-1)
 
-        for msg_id, sender, text, time, is_read in cur.fetchall():
-            messages_view.controls.append(
-                bubble(
-                    msg_id,
-                    text,
-                    sender == current_user["username"],
-                    time if time else "",
-                    is_read
-                )
-            )
+    attach_picker.on_result = on_photo_selected
 
-        # ---------- отправка ----------
-        message_input = ft.TextField(
-            hint_text="Сообщение...",
-            expand=True,
-            on_submit=lambda e: send_message()
+    def post_message(text):
+        chat_id = current_chat["id"]
+        msg_time = now()
+
+        # uid выдаём сами: эхо релея и повтор после обрыва узнаются по нему.
+        # Строку ставим в очередь до отправки — эхо может прийти раньше,
+        # чем send_frame вернётся
+        uid = uuid.uuid4().hex
+        msg_id = sent_uids[uid] = db.add_message(
+            chat_id,
+            current_user["username"],
+            text,
+            msg_time,
+            uid=uid
         )
 
-        def send_message():
-            text = message_input.value.strip()
-            if not text:
-                return
+        # отправка в сервер: кадр встаёт в очередь и уйдёт, когда будет связь
+        if not send_frame({
+            "chat_id": chat_id,
+            "sender": current_user["username"],
+            "text": text,
+            "time": msg_time,
+            "uid": uid
+        }):
+            # очередь переполнена — текст остаётся в поле, можно повторить
+            del sent_uids[uid]
+            db.delete_message(msg_id)
+            message_input.error_text = "Нет связи, попробуйте позже"
+            return False
+
+        message_input.error_text = None
+
+        if history["has_newer"]:
+            # пользователь был в старой истории — возвращаемся к последним сообщениям
+            db.flush()
+            load_latest()
+        else:
+            append_bubble(bubble(msg_id, text, True, msg_time, 0))
 
-            msg_time = now()
-
-            cur.execute("""
-                        INSERT INTO messages (chat_id, sender, text, time, is_read)
-                        VALUES (?, ?, ?, ?, 0)
-                        """, (
-                            chat_id,
-                            current_user["username"],
-                            text,
-                            msg_time
-                        ))
-            conn.commit()
-
-            msg_id = cur.lastrowid
-
-            # отправка в сервер
-            if client_socket:
-                client_socket.send(
-                    (json.dumps({
-                        "chat_id": chat_id,
-                        "sender": current_user["username"],
-                        "text": text,
-                        "time": msg_time
-                    }) + "\n").encode()
-                )
+        touch_chat_tile(
+            {"chat_id": chat_id, "sender": current_user["username"], "text": text, "time": msg_time},
+            True
+        )
+        return True
 
-            messages_view.controls.append(
-                bubble(msg_id, text, True, msg_time, 0)
+    def build_chat():
+        appbar = ft.AppBar(
+            leading=ft.IconButton(
+                ft.icons.ARROW_BACK,
+                on_click=lambda e: show_chats()
+            ),
+            title=ft.Row(
+                spacing=10,
+                vertical_alignment=ft.CrossAxisAlignment.CENTER,
+                controls=[
+                    ft.Container(
+                        content=ft.CircleAvatar(radius=18, content=chat_avatar),
+                        on_click=lambda e: current_chat["peer"] and show_user_profile(current_chat["peer"])
+                    ),
+                    ft.Column(spacing=0, controls=[chat_title, chat_status])
+                ]
             )
+        )
 
-            message_input.value = ""
-            page.update()
-
-        # ---------- UI ----------
-        page.add(
-            ft.AppBar(
-                leading=ft.IconButton(
-                    ft.icons.ARROW_BACK,
-                    on_click=lambda e: show_chats()
-                ),
-                title=ft.Row(
-                    spacing=10,
-                    vertical_alignment=ft.CrossAxisAlignment.CENTER,
+        body = ft.Column(
+            expand=True,
+            controls=[
+                messages_view,
+                ft.Row(
                     controls=[
-                        chat_avatar,
-                        ft.Text(other_user, weight="bold")
+                        ft.IconButton(
+                            ft.icons.ATTACH_FILE,
+                            on_click=lambda e: attach_picker.pick_files(
+                                allow_multiple=False,
+                                file_type=ft.FilePickerFileType.IMAGE
+                            )
+                        ),
+                        message_input,
+                        ft.IconButton(
+                            ft.icons.SEND,
+                            on_click=lambda e: send_message()
+                        )
                     ]
                 )
-            ),
-            messages_view,
-            ft.Row(
-                controls=[
-                    message_input,
-                    ft.IconButton(
-                        ft.icons.SEND,
-                        on_click=lambda e: send_message()
-                    )
-                ]
-            )
+            ]
         )
+        return appbar, body
 
-        page.update()
+    def show_chat():
+        chat_id = current_chat["id"]
+        tile = chat_tiles.get(chat_id)
 
-    # ================= SEARCH =================
+        # первое открытие недавнего чата после старта из снимка — тоже из снимка:
+        # собеседник и аватар уже есть в плитке, база сверится в фоне
+        cached = None
+        if current_chat["loaded"] != chat_id and tile:
+            cached = resume["history"].pop(chat_id, None)
 
-    def show_search():
-        page.clean()
+        if is_group(chat_id):
+            # без списка участников: в группе их может быть тысячи
+            name, current_chat["members"] = db.group_info(chat_id) or (chat_id, 0)
+            other_user = None
+            chat_avatar.src = None
+        elif cached is not None:
+            other_user = tile["title"].value
+            chat_avatar.src = tile["avatar"].src
+        else:
+            # ---------- участники ----------
+            members = db.chat_members(chat_id)
 
-        search_field = ft.TextField(label="Поиск по @username")
-        results = ft.Column(scroll=ft.ScrollMode.AUTO, expand=True)
+            other_user = next(
+                (m for m in members if m != current_user["username"]),
+                current_user["username"]
+            )
 
-        def search(e):
-            results.controls.clear()
-            query = search_field.value.strip()
+            # ---------- аватар ----------
+            chat_avatar.src = avatar_src(db.cursor(), other_user, SMALL)
 
-            if not query.startswith("@"):
-                query = "@" + query
+        current_chat["peer"] = other_user
+        chat_avatar.visible = bool(chat_avatar.src)
+        chat_title.value = name if other_user is None else other_user
+        show_status()
 
-            cur.execute("""
-                        SELECT username, name
-                        FROM users
-                        WHERE LOWER(username) LIKE LOWER(?)
-                           OR LOWER(name) LIKE LOWER(?)
-                        """, (f"%{query}%", f"%{query}%"))
+        # ---------- загрузка сообщений ----------
+        if cached is not None:
+            rows = [tuple(row) for row in cached]
+            load_latest(rows)
+            current_chat["loaded"] = chat_id
+            page.run_task(reconcile_chat, chat_id, rows)
+        else:
+            # дописываем накопленное, чтобы оно попало в выборку
+            db.flush()
+
+            # в тот же чат возвращаемся к уже готовым пузырям: новые
+            # сообщения дописывались в него, пока он был скрыт
+            if current_chat["loaded"] != chat_id:
+                # только последняя страница; старые — при прокрутке вверх
+                load_latest()
+                current_chat["loaded"] = chat_id
+
+        # чат открыт на последних сообщениях — они прочитаны
+        seen_to_end()
+        if tile:
+            set_unread(tile, 0)
+
+        navigate("chat", build_chat)
+        refresh("chat")
+        messages_view.scroll_to(offset=-1)
+        # картинки внизу чата видны сразу, остальные — по мере прокрутки
+        fetch_tail()
+
+    async def reconcile_chat(chat_id, rows):
+        # чат показан из снимка; когда база готова — сверяем последнюю страницу
+        await asyncio.to_thread(db.wait_ready)
+        db.flush()
+        if current_chat["loaded"] != chat_id or history["has_newer"]:
+            return
 
-            for username, name in cur.fetchall():
-                results.controls.append(
-                    ft.ListTile(
-                        title=ft.Text(username),
-                        subtitle=ft.Text(name),
-                        trailing=ft.Text(
-                            "Это вы" if username == current_user["username"] else "",
-                            color="green"
+        fresh = fetch_page(chat_id)
+        if fresh != rows:
+            load_latest(fresh)
+            refresh("reconcile", messages_view)
 
+    # ================= SEARCH =================
 
-                        ),
-                        on_click=lambda e, u=username: show_user_profile(u)
-                    )
+    def highlighted(text, **kwargs):
+        # "\x02совпадение\x03" из highlight()/snippet() -> жирные куски текста
+        first, *parts = text.split(MATCH_START)
+        spans = [ft.TextSpan(first)] if first else []
+
+        for part in parts:
+            match, _, rest = part.partition(MATCH_END)
+            spans.append(
+                ft.TextSpan(match, ft.TextStyle(weight=ft.FontWeight.BOLD, color=ft.colors.BLUE))
+            )
+            if rest:
+                spans.append(ft.TextSpan(rest))
+
+        return ft.Text(spans=spans, **kwargs)
+
+    search_field = ft.TextField(label="Поиск по людям и сообщениям", on_submit=lambda e: search(e))
+    users_results = ft.Column()
+    messages_results = ft.Column()
+    more_users = ft.TextButton("Ещё люди", visible=False, on_click=lambda e: load_users())
+    more_messages = ft.TextButton("Ещё сообщения", visible=False, on_click=lambda e: load_messages())
+    search_state = {"query": "", "users_offset": 0, "before": None}
+
+    def load_users():
+        rows = db.search_users(search_state["query"], search_state["users_offset"])
+        search_state["users_offset"] += len(rows)
+
+        for username, name in rows:
+            plain = username.replace(MATCH_START, "").replace(MATCH_END, "")
+            users_results.controls.append(
+                ft.ListTile(
+                    title=highlighted(username),
+                    subtitle=highlighted(name or ""),
+                    trailing=ft.Text(
+                        "Это вы" if plain == current_user["username"] else "",
+                        color="green"
+                    ),
+                    on_click=lambda e, u=plain: show_user_profile(u)
                 )
+            )
 
-            page.update()
+        more_users.visible = len(rows) == SEARCH_PAGE
+        refresh("search users", users_results, more_users)
 
-        page.add(
-            ft.AppBar(
-                leading=ft.IconButton(ft.icons.ARROW_BACK, on_click=lambda e: show_chats()),
-                title=ft.Text("Поиск")
-            ),
-            search_field,
-            ft.ElevatedButton("Найти", on_click=search),
-            results
+    def load_messages():
+        rows = db.search_messages(
+            current_user["username"],
+            search_state["query"],
+            search_state["before"]
         )
+        if rows:
+            search_state["before"] = rows[-1][0]
+
+        for msg_id, cid, sender, snippet, time in rows:
+            messages_results.controls.append(
+                ft.ListTile(
+                    title=highlighted(snippet, max_lines=2),
+                    subtitle=ft.Text(f"{sender} · {time or ''}", size=12),
+                    on_click=lambda e, c=cid: open_chat(c)
+                )
+            )
 
-    # ================= PROFILE =================
+        more_messages.visible = len(rows) == SEARCH_PAGE
+        refresh("search messages", messages_results, more_messages)
 
-    def show_user_profile(username):
-        page.clean()
+    def search(e):
+        # свежие сообщения тоже должны находиться
+        db.flush()
 
-        # Получаем данные пользователя
-        cur.execute(
-            "SELECT username, bio, avatar FROM users WHERE username=?",
-            (username,)
+        users_results.controls.clear()
+        messages_results.controls.clear()
+        search_state["query"] = search_field.value.strip()
+        search_state["users_offset"] = 0
+        search_state["before"] = None
+
+        load_users()
+        load_messages()
+
+    def build_search():
+        appbar = ft.AppBar(
+            leading=ft.IconButton(ft.icons.ARROW_BACK, on_click=lambda e: show_chats()),
+            title=ft.Text("Поиск")
         )
-        user = cur.fetchone()
+        body = ft.Column(
+            expand=True,
+            controls=[
+                search_field,
+                ft.ElevatedButton("Найти", on_click=search),
+                ft.Column(
+                    scroll=ft.ScrollMode.AUTO,
+                    expand=True,
+                    controls=[
+                        ft.Text("Люди", weight="bold"),
+                        users_results,
+                        more_users,
+                        ft.Text("Сообщения", weight="bold"),
+                        messages_results,
+                        more_messages
+                    ]
+                )
+            ]
+        )
+        return appbar, body
 
-        if not user:
-            return
+    def show_search():
+        navigate("search", build_search)
+        refresh("search")
 
-        username, bio, avatar_filename = user
+    # ================= PROFILE =================
 
-        # ---------- АВАТАР ----------
-        avatar_image = ft.CircleAvatar(
-            radius=60,
-            content=ft.Image(
-                src=f"avatars/{avatar_filename}",
-                fit=ft.ImageFit.COVER
-            ) if avatar_filename else None
+    profile = {"username": None}
+    profile_avatar = ft.Image(fit=ft.ImageFit.COVER, visible=False)
+    profile_name = ft.Text(size=22, weight="bold")
+    profile_bio = ft.Text(italic=True)
+    change_photo_button = ft.ElevatedButton(
+        "Сменить фото",
+        on_click=lambda e: file_picker.pick_files(
+            allow_multiple=False,
+            file_type=ft.FilePickerFileType.IMAGE
         )
+    )
+    its_you = ft.Text("Это вы")
 
-        # ---------- СМЕНА ФОТО ----------
-        def change_photo(e):
-            file_picker.pick_files(allow_multiple=False)
+    def on_file_selected(e):
+        if not e.files:
+            return
 
-        def on_file_selected(e):
-            if not e.files:
-                return
+        # уменьшенные копии с именем-хешем вместо полноразмерного файла
+        new_filename = save_avatar(e.files[0].path)
 
-            file = e.files[0]
-            ext = os.path.splitext(file.name)[1]
-            new_filename = f"{current_user['username'].replace('@', '')}{ext}"
-            new_path = os.path.join("avatars", new_filename)
+        db.set_avatar(current_user["username"], new_filename)
+        forget(current_user["username"])
 
-            shutil.copy(file.path, new_path)
+        # Перезагружаем профиль
+        show_user_profile(current_user["username"])
 
-            cur.execute(
-                "UPDATE users SET avatar=? WHERE username=?",
-                (new_filename, current_user["username"])
-            )
-            conn.commit()
+    file_picker.on_result = on_file_selected
 
-            # Перезагружаем профиль
-            show_user_profile(current_user["username"])
+    def open_chat_with(target_username):
+        user1 = current_user["username"]
+        user2 = target_username
 
-        file_picker.on_result = on_file_selected
+        # сортировка работает даже если user1 == user2
+        u1, u2 = sorted([user1, user2])
+        cid = f"private_{u1}_{u2}"
 
-        # ---------- КНОПКА НАПИСАТЬ ----------
-        def open_chat(e):
-            open_chat_with(username)
+        if not db.chat_exists(cid):
+            db.create_chat(cid, target_username, [u1, u2])
 
-        def open_chat_with(target_username):
-            user1 = current_user["username"]
-            user2 = target_username
+            # сообщаем релею состав чата, чтобы он слал только участникам
+            send_frame({
+                "type": "chat",
+                "chat_id": cid,
+                "members": [u1, u2]
+            })
 
-            # сортировка работает даже если user1 == user2
-            u1, u2 = sorted([user1, user2])
-            cid = f"private_{u1}_{u2}"
+        open_chat(cid)
 
-            cur.execute("SELECT id FROM chats WHERE id=?", (cid,))
-            if not cur.fetchone():
-                cur.execute(
-                    "INSERT INTO chats VALUES (?,?)",
-                    (cid, target_username)
-                )
+    def build_profile():
+        appbar = ft.AppBar(
+            leading=ft.IconButton(
+                ft.icons.ARROW_BACK,
+                on_click=lambda e: show_chats()
+            ),
+            title=ft.Text("Профиль"),
+        )
+        body = ft.Column(
+            alignment=ft.MainAxisAlignment.CENTER,
+            horizontal_alignment=ft.CrossAxisAlignment.CENTER,
+            expand=True,
+            spacing=15,
+            controls=[
+                ft.CircleAvatar(radius=60, content=profile_avatar),
+                profile_name,
+                profile_bio,
+
+                # Если это чужой профиль
+                ft.ElevatedButton(
+                    "Написать",
+                    on_click=lambda e: open_chat_with(profile["username"]),
+                ),
 
-                cur.execute("INSERT INTO members VALUES (?,?)", (cid, u1))
-                cur.execute("INSERT INTO members VALUES (?,?)", (cid, u2))
-                conn.commit()
+                # Если это свой профиль
+                change_photo_button,
+                its_you,
+            ]
+        )
+        return appbar, body
 
-            current_chat["id"] = cid
-            show_chat()
+    def show_user_profile(username):
+        # Получаем данные пользователя
+        user = db.user_profile(username)
 
-        # ---------- UI ----------
-        page.add(
-            ft.AppBar(
-                leading=ft.IconButton(
-                    ft.icons.ARROW_BACK,
-                    on_click=lambda e: show_chats()
-                ),
-                title=ft.Text("Профиль"),
-            ),
-            ft.Column(
-                alignment=ft.MainAxisAlignment.CENTER,
-                horizontal_alignment=ft.CrossAxisAlignment.CENTER,
-                expand=True,
-                spacing=15,
-                controls=[
-                    avatar_image,
-                    ft.Text(username, size=22, weight="bold"),
-                    ft.Text(bio if bio else "Без описания", italic=True),
-
-                    # Если это чужой профиль
-                    ft.ElevatedButton(
-                        "Написать",
-                        on_click=open_chat,
-                    ),
+        if not user:
+            return
 
-                    # Если это свой профиль
-                    ft.ElevatedButton(
-                        "Сменить фото",
-                        on_click=change_photo,
-                        visible=username == current_user["username"]
-                    ),
+        username, bio, avatar_filename = user
+        avatar = thumbnail_src(avatar_filename, LARGE)
+
+        profile["username"] = username
+        profile_avatar.src = avatar
+        profile_avatar.visible = bool(avatar)
+        profile_name.value = username
+        profile_bio.value = bio if bio else "Без описания"
+        change_photo_button.visible = its_you.visible = username == current_user["username"]
+
+        navigate("profile", build_profile)
+        refresh("profile")
+
+    # ================= GROUPS =================
+    # Группа — тот же чат с таблицей members, только id group_<uuid> и
+    # своё название. Релей кодирует сообщение группы один раз на всех, кто
+    # в сети; остальные получат его из журнала при синхронизации.
+
+    group_name = ft.TextField(label="Название", width=300)
+    group_members = ft.TextField(
+        label="Участники (@username через запятую)",
+        width=300,
+        multiline=True,
+        max_lines=4
+    )
 
-                    ft.Text(
-                        "Это вы",
-                        visible=username == current_user["username"]
-                    ),
-                ]
-            )
+    def create_group(e):
+        name = group_name.value.strip()
+        members = {m.strip() for m in group_members.value.replace("\n", ",").split(",") if m.strip()}
+        if not name:
+            group_name.error_text = "Введите название"
+            refresh("group", group_name)
+            return
+        if any(not m.startswith("@") for m in members):
+            group_members.error_text = "Username должен начинаться с @"
+            refresh("group", group_members)
+            return
+
+        members.add(current_user["username"])
+        members = sorted(members)
+        cid = f"{GROUP_PREFIX}{uuid.uuid4().hex}"
+        db.create_chat(cid, name, members)
+
+        # релей запомнит состав и разошлёт его участникам через журнал
+        send_frame({
+            "type": "chat",
+            "chat_id": cid,
+            "name": name,
+            "members": members
+        })
+
+        open_chat(cid)
+
+    def build_new_group():
+        appbar = ft.AppBar(
+            leading=ft.IconButton(
+                ft.icons.ARROW_BACK,
+                on_click=lambda e: show_chats()
+            ),
+            title=ft.Text("Новая группа"),
         )
+        body = ft.Column(
+            alignment=ft.MainAxisAlignment.CENTER,
+            horizontal_alignment=ft.CrossAxisAlignment.CENTER,
+            expand=True,
+            spacing=15,
+            controls=[
+                group_name,
+                group_members,
+                ft.ElevatedButton("Создать", on_click=create_group, width=300)
+            ]
+        )
+        return appbar, body
 
-        page.update()
+    def show_new_group():
+        group_name.value = group_members.value = ""
+        group_name.error_text = group_members.error_text = None
+        navigate("group", build_new_group)
+        refresh("group")
 
     # ================= SETTINGS =================
 
-    def show_settings():
-        page.clean()
-
-        def logout(e):
-            cur.execute(
-                "UPDATE users SET online=0 WHERE username=?",
-                (current_user["username"],)
-            )
-            conn.commit()
-            set_setting("last_user", "")
-            show_login()
-
-        page.add(
-            ft.AppBar(
-                leading=ft.IconButton(
-                    ft.icons.ARROW_BACK,
-                    on_click=lambda e: show_chats()
-                ),
-                title=ft.Text("Настройки"),
-                actions=[
-                    ft.IconButton(
-                        ft.icons.DARK_MODE,
-                        on_click=toggle_theme
-                    )
-                ]
+    def logout(e):
+        flush_read()
+        drop_snapshot()
+        settings.forget_user()
+        disconnect_from_server()
+        reset_session()
+        show_login()
+
+    def build_settings():
+        appbar = ft.AppBar(
+            leading=ft.IconButton(
+                ft.icons.ARROW_BACK,
+                on_click=lambda e: show_chats()
             ),
-            ft.Column(
-                alignment=ft.MainAxisAlignment.CENTER,
-                horizontal_alignment=ft.CrossAxisAlignment.CENTER,
-                expand=True,
-                spacing=20,
-                controls=[
-                    ft.ElevatedButton(
-                        "Открыть профиль",
-                        on_click=lambda e: show_user_profile(current_user["username"]),
-                        width=250
-                    ),
-                    ft.ElevatedButton(
-                        "Выйти",
-                        on_click=logout,
-                        width=250
-                    )
-                ]
-            )
+            title=ft.Text("Настройки"),
+            actions=[
+                ft.IconButton(
+                    ft.icons.DARK_MODE,
+                    on_click=toggle_theme
+                )
+            ]
         )
+        body = ft.Column(
+            alignment=ft.MainAxisAlignment.CENTER,
+            horizontal_alignment=ft.CrossAxisAlignment.CENTER,
+            expand=True,
+            spacing=20,
+            controls=[
+                ft.ElevatedButton(
+                    "Открыть профиль",
+                    on_click=lambda e: show_user_profile(current_user["username"]),
+                    width=250
+                ),
+                ft.ElevatedButton(
+                    "Выйти",
+                    on_click=logout,
+                    width=250
+                )
+            ]
+        )
+        return appbar, body
 
-        page.update()
+    def show_settings():
+        navigate("settings", build_settings)
+        refresh("settings")
 
     # ================= START =================
+    # Первый кадр — как можно раньше: тема и автовход из настроек, которые
+    # читаются до миграций; список чатов — из снимка, а без него — когда
+    # база готова; релей и подключение — после первого кадра.
+
+    def build_splash():
+        return None, ft.Column(
+            alignment=ft.MainAxisAlignment.CENTER,
+            horizontal_alignment=ft.CrossAxisAlignment.CENTER,
+            expand=True,
+            controls=[ft.ProgressRing(), ft.Text("Обновляем базу…")]
+        )
 
-    last_user = get_setting("last_user")
+    # автовход целиком из кеша настроек; в users идём, только если
+    # имя не запомнено (вход до появления last_user_name)
+    last_user = settings.last_user
 
     if last_user:
-        cur.execute("SELECT name FROM users WHERE username=?", (last_user,))
-        row = cur.fetchone()
-        if row:
+        name = settings.last_user_name
+        if name is None:
+            name = db.user_name(last_user)
+        if name is not None:
             current_user["username"] = last_user
-            current_user["name"] = row[0]
-            show_chats()
+            current_user["name"] = name
+
+            snapshot = load_snapshot(last_user)
+            if snapshot:
+                # список чатов таким, каким он был при уходе в фон
+                resume["history"] = snapshot["history"]
+                navigate("chats", build_chats)
+                render_chats(snapshot["chats"], snapshot["avatars"])
+                refresh("chats")
+            elif not db.ready.is_set():
+                # после обновления база ещё мигрирует — не пустой экран, а заставка
+                navigate("splash", build_splash)
+                refresh("splash")
+            else:
+                show_chats()
+            startup("первый кадр")
+
+            if current_screen["name"] != "chats" or snapshot:
+                await asyncio.to_thread(db.wait_ready)
+                # сверка с базой: те же плитки, на клиент уйдут только изменения;
+                # если пользователь уже в чате — список обновится при возврате
+                if current_screen["name"] in ("chats", "splash"):
+                    show_chats()
+                startup("сверка с базой")
+
             connect_to_server()
             return
         # если автологина нет — показываем логин
     show_login()
+    startup("первый кадр")
+
 
+startup("импорт")
 
 if __name__ == "__main__":
-    start_server()
+    metrics.serve()
     ft.app(target=main)
 
@@ -0,0 +1,187 @@
+import bisect
+import os
+import threading
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+
+
+# ================= METRICS =================
+# Счётчики и гистограммы горячих путей в текстовом формате Prometheus.
+# Включаются переменной окружения с портом:
+#
+#   FLETGRAM_METRICS=9100 python main.py   (или relay.py)
+#   curl 127.0.0.1:9100/metrics
+#
+# Выключенные (по умолчанию) метрики — один общий объект, у которого
+# все методы пустые: в горячем пути остаётся вызов пустого метода, без
+# словарей, замков и perf_counter. Запись без замка: += под GIL может
+# изредка потерять единицу при гонке двух потоков, для метрик это не важно.
+
+PORT = os.environ.get("FLETGRAM_METRICS")
+ENABLED = bool(PORT)
+HOST = "127.0.0.1"  # только локально: метрики не для чужих глаз
+
+# секунды: от сотни микросекунд (запрос к кешу SQLite) до секунд (зависший fsync)
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+registry = []
+server = {"http": None}
+
+
+class Noop:
+    # то, что возвращается при выключенных метриках
+
+    def inc(self, amount=1, label=None):
+        pass
+
+    def dec(self, amount=1, label=None):
+        pass
+
+    def set(self, value, label=None):
+        pass
+
+    def observe(self, value, label=None):
+        pass
+
+    def time(self, label=None):
+        return NULL_TIMER
+
+
+NOOP = Noop()
+NULL_TIMER = nullcontext()
+
+
+class Metric:
+
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label  # имя единственной метки (query, type...) или None
+        self.values = {}    # значение метки -> число (у гистограмм — ячейки)
+        registry.append(self)
+
+    def series(self, value, extra=""):
+        # имя{метка="значение"} для строки вывода
+        labels = []
+        if self.label and value is not None:
+            labels.append(f'{self.label}="{value}"')
+        if extra:
+            labels.append(extra)
+        return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, label=None):
+        self.values[label] = self.values.get(label, 0) + amount
+
+    def render(self):
+        return [f"{self.name}{self.series(label)} {value}" for label, value in list(self.values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount=1, label=None):
+        self.inc(-amount, label)
+
+    def set(self, value, label=None):
+        self.values[label] = value
+
+
+class Timer:
+
+    def __init__(self, histogram, label):
+        self.histogram = histogram
+        self.label = label
+
+    def __enter__(self):
+        self.started = perf_counter()
+
+    def __exit__(self, *exc):
+        self.histogram.observe(perf_counter() - self.started, self.label)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, label=None, buckets=BUCKETS):
+        super().__init__(name, help, label)
+        self.buckets = buckets
+
+    def observe(self, value, label=None):
+        # ячейки: [счётчики по корзинам + переполнение, сумма, количество]
+        cells = self.values.get(label)
+        if cells is None:
+            cells = self.values[label] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        cells[0][bisect.bisect_left(self.buckets, value)] += 1
+        cells[1] += value
+        cells[2] += 1
+
+    def time(self, label=None):
+        return Timer(self, label)
+
+    def render(self):
+        lines = []
+        for label, (counts, total, count) in list(self.values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                bucket = self.series(label, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+            bucket = self.series(label, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket} {count}")
+            lines.append(f"{self.name}_sum{self.series(label)} {total}")
+            lines.append(f"{self.name}_count{self.series(label)} {count}")
+        return lines
+
+
+def counter(name, help, label=None):
+    return Counter(name, help, label) if ENABLED else NOOP
+
+
+def gauge(name, help, label=None):
+    return Gauge(name, help, label) if ENABLED else NOOP
+
+
+def histogram(name, help, label=None, buckets=BUCKETS):
+    return Histogram(name, help, label, buckets) if ENABLED else NOOP
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Prometheus опрашивает часто — не засоряем вывод
+        pass
+
+
+def serve(port=None):
+    # поднимает /metrics в фоновом потоке; без FLETGRAM_METRICS ничего не делает.
+    # Повторный вызов (приложение со встроенным релеем) — тот же сервер
+    if not ENABLED or server["http"]:
+        return
+    server["http"] = ThreadingHTTPServer((HOST, int(port or PORT)), Handler)
+    threading.Thread(target=server["http"].serve_forever, daemon=True).start()
+    print(f"Метрики: http://{HOST}:{server['http'].server_port}/metrics")
@@ -0,0 +1,1071 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import argparse
+import multiprocessing
+import socket
+import sys
+import tempfile
+from collections import deque, OrderedDict
+from time import perf_counter
+
+from framing import FrameReader, encode_frame, LINE, LENGTH
+from codec import Encoder, Decoder, JSON, BINARY, KIND_JSON, KIND_MESSAGE, KIND_MESSAGE_UID, MESSAGE_FIELDS, LARGE_CHAT, dumps, loads, is_uid
+import metrics
+
+
+# ================= RELAY =================
+
+HOST = "127.0.0.1"
+PORT = 5000
+DB_PATH = "fletgram.db"
+
+MAX_CLIENT_BUFFER = 1024 * 1024  # выше этого отправитель ждёт, пока получатель дочитает
+DRAIN_TIMEOUT = 10               # сколько ждём зависшего получателя перед отключением
+READ_SIZE = 64 * 1024
+
+PING_INTERVAL = 25     # клиент шлёт ping, если ему долго нечего отправить
+PRESENCE_TIMEOUT = 60  # столько тишины — и клиент считается отвалившимся
+
+SYNC_BATCH = 2000         # сообщений в одном ответе на sync
+SYNC_BYTES = 512 * 1024   # и не больше стольких байт, чтобы кадр влез в MAX_FRAME
+
+BLOB_CHUNK = 48 * 1024          # байт вложения в одном кадре
+BLOB_LOW_WATER = 64 * 1024      # следующий кусок — только когда буфер почти пуст
+MAX_BLOB = 64 * 1024 * 1024
+BLOB_HASH = re.compile(r"[0-9a-f]{64}$")
+
+SHARED_FRAME = 8           # от стольких получателей двоичным — общий кадр, без таблицы строк
+RECENT_UIDS = 100_000      # столько последних uid сообщений помним, чтобы отбросить повтор
+
+# без FLETGRAM_METRICS это пустые объекты, см. metrics.py; на пути
+# каждого кадра проверяем metrics.ENABLED, чтобы не платить и за пустой вызов
+FRAME_TYPES = {"hello", "ping", "presence", "chat", "blob", "fetch", "sync"}
+FRAMES_IN = metrics.counter("fletgram_relay_frames_in_total", "Кадры от клиентов", "type")
+FRAMES_OUT = metrics.counter("fletgram_relay_frames_out_total", "Кадры клиентам")
+BYTES_OUT = metrics.counter("fletgram_relay_bytes_out_total", "Байты клиентам")
+FANOUT = metrics.histogram("fletgram_relay_fanout_seconds", "Рассылка сообщения участникам чата")
+CLIENTS = metrics.gauge("fletgram_relay_clients", "Подключённые клиенты")
+CONGESTED = metrics.counter("fletgram_relay_congested_total", "Ожидания получателя с полным буфером")
+DISCONNECTS = metrics.counter("fletgram_relay_disconnects_total", "Отключённые релеем клиенты", "reason")
+ERRORS = metrics.counter("fletgram_relay_errors_total", "Ошибки обработки клиента")
+
+clients = {}       # username -> Connection
+connected = {}     # id пользователя -> Connection, для пересечения с участниками
+chat_members = {}  # chat_id -> set(id пользователя)
+user_chats = {}    # id пользователя -> set(chat_id), для рассылки присутствия
+user_ids = {}      # username -> id: в множествах участников числа, а не строки
+usernames = []     # id -> username
+db = None
+log = {"next_id": 1}  # следующий id в relay_log
+recent_uids = OrderedDict()  # uid сообщения -> None, в порядке прихода
+blobs = {"dir": None}  # вложения: файл на хеш в этой папке
+blob_waiters = {}      # hash -> соединения, которые ждут ещё не загруженное
+blob_uploads = {}      # hash -> [sha256 уже принятого, следующий offset]
+
+# режим воркеров (start_server(workers=N)): у воркера — соединение с хабом
+# и кто в сети на всех воркерах; у хаба — где (на каких воркерах) кто сидит.
+# id пользователей свои в каждом процессе, по шине ходят username
+bus = {"writer": None}
+EMPTY = frozenset()
+online_ids = set()
+hub = {"workers": set(), "where": {}, "ready": 0}
+
+
+def split_handshake(data):
+    # клиент шлёт голый username без разделителя;
+    # если к нему прилип первый JSON-кадр — отрезаем его по "{"
+    idx = data.find(b"{")
+    if idx == -1:
+        return data.decode().strip(), b""
+    return data[:idx].decode().strip(), data[idx:]
+
+
+class Connection:
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.framing = LINE
+        # JSON или BINARY (только с LENGTH); таблицы строк — свои у соединения
+        self.codec = JSON
+        self.encoder = None
+        self.decoder = None
+        # время последнего кадра; проверяем только у тех, кто шлёт ping
+        self.last_seen = 0
+        self.heartbeat = False
+        # присутствие шлём только тем, кто его запросил
+        self.presence = False
+        # пока клиент догоняет историю, живые сообщения ему не шлём:
+        # они лежат в relay_log и придут следующей пачкой, по порядку id
+        self.syncing = False
+        # вложения, которые клиент попросил, и задача, что их отдаёт
+        self.blob_queue = deque()
+        self.pump = None
+
+    def use(self, framing, codec):
+        # hello: новое кадрирование со следующего кадра; двоичный кодек
+        # подтверждаем ответным hello — клиент перейдёт на него, получив ответ
+        self.framing = framing
+        if codec == BINARY and framing == LENGTH:
+            send_to(self, encode_frame(b'{"type":"hello","codec":"binary"}', framing))
+            self.codec = BINARY
+            self.encoder = Encoder()
+            self.decoder = Decoder()
+
+    def decode(self, frame):
+        # -> (dict, JSON-байты); сообщения от двоичных клиентов
+        # переводим в JSON один раз — в таком виде их хранит журнал
+        if self.codec == JSON or frame[:1] == b"{":
+            return loads(frame), frame
+        msg = self.decoder.decode(frame)
+        if frame[0] in (KIND_MESSAGE, KIND_MESSAGE_UID):
+            return msg, json.dumps(msg).encode()
+        return msg, frame[1:] if frame[0] == KIND_JSON else None
+
+    def frame(self, payload):
+        # готовый JSON -> байты для сокета; одинаковы для всех с тем же
+        # (framing, codec), поэтому их можно кодировать один раз на рассылку
+        if self.codec == BINARY:
+            payload = self.encoder.encode_json(payload)
+        return encode_frame(payload, self.framing)
+
+    def message(self, payload, msg):
+        # сообщение чата: двоичным клиентам — со своей таблицей строк
+        if self.codec == BINARY:
+            return encode_frame(self.encoder.encode(msg), self.framing)
+        return encode_frame(payload, self.framing)
+
+    def blob(self, msg):
+        # кусок вложения: двоичным — сырые байты, JSON — base64
+        if self.codec == BINARY:
+            return encode_frame(self.encoder.encode(msg), self.framing)
+        return encode_frame(dumps(msg), self.framing)
+
+
+def send_to(connection, data):
+    # не ждём drain: один медленный клиент не должен тормозить рассылку остальным.
+    # True — буфер получателя переполнен
+    writer = connection.writer
+    if writer.is_closing():
+        return False
+    writer.write(data)
+    if metrics.ENABLED:
+        FRAMES_OUT.inc()
+        BYTES_OUT.inc(len(data))
+    return writer.transport.get_write_buffer_size() > MAX_CLIENT_BUFFER
+
+
+async def wait_readers(congested):
+    # притормаживаем чтение у отправителя, пока получатели не разгребут буфер;
+    # отключаем только тех, кто совсем перестал читать
+    loop = asyncio.get_running_loop()
+
+    for connection in congested:
+        CONGESTED.inc()
+        transport = connection.writer.transport
+        size = transport.get_write_buffer_size()
+        deadline = loop.time() + DRAIN_TIMEOUT
+
+        while size > MAX_CLIENT_BUFFER and not transport.is_closing():
+            await asyncio.sleep(0.01)
+
+            left = transport.get_write_buffer_size()
+            if left < size:
+                deadline = loop.time() + DRAIN_TIMEOUT
+            elif loop.time() > deadline:
+                print("Клиент не успевает читать, отключаем")
+                DISCONNECTS.inc(1, "slow")
+                connection.writer.close()
+                break
+            size = left
+
+
+# ================= MEMBERSHIP =================
+
+def load_members(path):
+    global db
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS members (
+        chat_id TEXT,
+        username TEXT
+    )
+    """)
+    # то же имя, что у индекса приложения: в общей БД второй не появится
+    db.execute("CREATE INDEX IF NOT EXISTS members_user_chat ON members (username, chat_id)")
+
+    # журнал всех сообщений, только дописывается; id общий и растущий
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS relay_log (
+        id INTEGER PRIMARY KEY,
+        chat_id TEXT,
+        frame BLOB
+    )
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS relay_log_chat ON relay_log (chat_id, id)")
+    db.commit()
+
+    log["next_id"] = (db.execute("SELECT MAX(id) FROM relay_log").fetchone()[0] or 0) + 1
+
+    chat_members.clear()
+    user_chats.clear()
+    for chat_id, username in db.execute("SELECT chat_id, username FROM members"):
+        uid = user_id(username)
+        chat_members.setdefault(chat_id, set()).add(uid)
+        user_chats.setdefault(uid, set()).add(chat_id)
+
+
+def user_id(username):
+    # id выдаются по порядку и живут, пока жив процесс
+    uid = user_ids.get(username)
+    if uid is None:
+        uid = user_ids[username] = len(usernames)
+        usernames.append(username)
+    return uid
+
+
+def private_members(chat_id):
+    # private_{u1}_{u2}, оба username начинаются с @
+    if not chat_id.startswith("private_@"):
+        return set()
+    u1, sep, u2 = chat_id[len("private_"):].partition("_@")
+    return {u1, "@" + u2} if sep else set()
+
+
+def remember_members(chat_id, names):
+    # -> (id всех участников, username новых); только память, без базы
+    known = chat_members.setdefault(chat_id, set())
+    new = []
+    for username in set(names):
+        uid = user_id(username)
+        if uid not in known:
+            known.add(uid)
+            user_chats.setdefault(uid, set()).add(chat_id)
+            new.append(username)
+    return known, new
+
+
+def add_members(chat_id, usernames):
+    known, new = remember_members(chat_id, usernames)
+    if not new:
+        return known
+
+    if bus["writer"]:
+        # в базу пишет только хаб, остальным воркерам он и расскажет
+        publish({"type": "members", "chat_id": chat_id, "members": sorted(new)})
+    elif db:
+        db.executemany("""
+                       INSERT INTO members (chat_id, username)
+                       SELECT ?, ? WHERE NOT EXISTS (
+                           SELECT 1 FROM members WHERE chat_id=? AND username=?
+                       )
+                       """, [(chat_id, username, chat_id, username) for username in new])
+        db.commit()
+    return known
+
+
+# ================= PRESENCE =================
+# Кто в сети — только в памяти: это просто ключи clients. Базу при
+# входе/выходе не трогаем, собеседникам уходит короткая дельта.
+
+def is_online(uid):
+    # у воркера в сети — на любом воркере, по рассылке хаба
+    return uid in (online_ids if bus["writer"] else connected)
+
+
+def announce(username, online):
+    # вход/выход: у воркера — через хаб, он разошлёт всем воркерам
+    # (и этому тоже), когда пользователь появится или пропадёт совсем
+    if bus["writer"]:
+        publish({"type": "online" if online else "offline", "users": [username]})
+    else:
+        send_presence(username, online)
+
+
+def contacts(uid):
+    # id всех, с кем у пользователя есть общий чат. Большие группы не в счёт:
+    # иначе каждый вход участника — рассылка на тысячи соединений
+    result = set()
+    for chat_id in user_chats.get(uid, ()):
+        members = chat_members.get(chat_id, EMPTY)
+        if len(members) <= LARGE_CHAT:
+            result |= members
+    result.discard(uid)
+    return result
+
+
+def send_presence(username, online):
+    # дельта собеседникам, которые сейчас в сети
+    payload = json.dumps({
+        "type": "presence",
+        "online": [username] if online else [],
+        "offline": [] if online else [username]
+    }).encode()
+
+    encoded = {}
+    for contact in contacts(user_id(username)):
+        connection = connected.get(contact)
+        if not connection or not connection.presence:
+            continue
+
+        key = (connection.framing, connection.codec)
+        data = encoded.get(key)
+        if data is None:
+            data = encoded[key] = connection.frame(payload)
+        send_to(connection, data)
+
+
+def presence_snapshot(username):
+    # кто из собеседников в сети — один раз при подключении
+    return json.dumps({
+        "type": "presence",
+        "online": sorted(usernames[c] for c in contacts(user_id(username)) if is_online(c)),
+        "offline": [],
+        "snapshot": True
+    }).encode()
+
+
+async def sweep_silent():
+    # раз в PING_INTERVAL закрываем тех, кто перестал слать ping;
+    # проход линейный, на каждый ping — только запись времени
+    loop = asyncio.get_running_loop()
+
+    while True:
+        await asyncio.sleep(PING_INTERVAL)
+        deadline = loop.time() - PRESENCE_TIMEOUT
+
+        for connection in list(clients.values()):
+            if connection.heartbeat and connection.last_seen < deadline:
+                print("Клиент молчит, отключаем")
+                DISCONNECTS.inc(1, "silent")
+                # handle_client увидит конец потока и разошлёт offline
+                connection.writer.close()
+
+
+# ================= LOG =================
+
+def repeated(uid):
+    # клиент шлёт заново всё, что не успел записать до обрыва, — то же
+    # сообщение с тем же uid. Повтор в журнал не пишем и не рассылаем:
+    # отправитель получит первый экземпляр при sync, как подтверждение
+    if uid is None:
+        return False
+    if uid in recent_uids:
+        return True
+    recent_uids[uid] = None
+    if len(recent_uids) > RECENT_UIDS:
+        recent_uids.popitem(last=False)
+    return False
+
+
+def loggable(kind, msg):
+    # в журнал — только то, что клиенты разберут: кадр с битым полем
+    # ломал бы их синхронизацию на каждом переподключении. id выдаёт
+    # релей: свой "id" клиента перебил бы вписанный (в JSON побеждает последний)
+    if "id" in msg or not isinstance(msg.get("chat_id"), str):
+        return False
+    if kind is None:
+        return (all(isinstance(msg.get(field), str) for field in MESSAGE_FIELDS)
+                and ("uid" not in msg or is_uid(msg["uid"])))
+    if kind == "read":
+        return isinstance(msg.get("reader"), str) and isinstance(msg.get("up_to"), int)
+    if kind == "chat":
+        return isinstance(msg.get("name"), str)
+    return False
+
+
+def append_log(chat_id, frame):
+    # id вписываем прямо в байты кадра, без json.loads/dumps:
+    # b'{"chat_id":...}' -> b'{"id":42,"chat_id":...}'
+    msg_id = log["next_id"]
+    log["next_id"] += 1
+
+    frame = b'{"id":%d,' % msg_id + frame.lstrip()[1:]
+    if db:
+        # commit — один на прочитанный кусок, в handle_client
+        db.execute("INSERT INTO relay_log (id, chat_id, frame) VALUES (?, ?, ?)", (msg_id, chat_id, frame))
+    return msg_id, frame
+
+
+def sync_batch(username, last_id):
+    # одна пачка пропущенного: сообщения из чатов пользователя после last_id.
+    # Кадры склеиваются как есть, без повторного кодирования
+    if not db:
+        return encode_batch([], last_id, False)
+
+    rows = db.execute("""
+                      SELECT l.id, l.frame
+                      FROM relay_log l
+                      WHERE l.id > ?
+                        AND l.chat_id IN (SELECT chat_id FROM members WHERE username = ?)
+                      ORDER BY l.id
+                      LIMIT ?
+                      """, (last_id, username, SYNC_BATCH)).fetchall()
+
+    frames = []
+    size = 0
+    for msg_id, frame in rows:
+        if frames and size + len(frame) > SYNC_BYTES:
+            break
+        frames.append(frame)
+        size += len(frame) + 1
+        last_id = msg_id
+
+    more = len(frames) < len(rows) or len(rows) == SYNC_BATCH
+    return encode_batch(frames, last_id, more)
+
+
+def encode_batch(frames, last_id, more):
+    return (
+        b'{"type":"batch","last_id":%d,"more":%s,"messages":[' % (last_id, b"true" if more else b"false")
+        + b",".join(frames)
+        + b"]}"
+    ), more
+
+
+# ================= BLOBS =================
+# Вложения по хешу содержимого: одно на всех, сколько бы раз его ни
+# пересылали. Клиент грузит кусками по порядку, хеш считаем по ходу,
+# без повторного чтения файла. Отдаёт вложения отдельная задача на соединение,
+# по куску и только при почти пустом буфере — текст за ними не стоит.
+
+def load_blobs(db_path):
+    blobs["dir"] = os.path.splitext(db_path)[0] + "_blobs"
+    os.makedirs(blobs["dir"], exist_ok=True)
+
+
+def blob_path(digest):
+    return os.path.join(blobs["dir"], digest)
+
+
+def blob_ack(connection, digest):
+    send_to(connection, connection.frame(json.dumps({"type": "blob_ack", "hash": digest}).encode()))
+
+
+def receive_blob(connection, msg):
+    digest = msg["hash"]
+    if not blobs["dir"] or not BLOB_HASH.match(digest) or msg["total"] > MAX_BLOB:
+        return
+
+    path = blob_path(digest)
+    if os.path.exists(path):
+        # уже есть (пересылка) — загрузчик выкинет остальные куски
+        if msg["offset"] == 0:
+            blob_ack(connection, digest)
+        return
+
+    # загрузка всегда идёт с нуля и по порядку (после обрыва — заново);
+    # кусок не на своём месте пропускаем до следующей попытки
+    upload = blob_uploads.get(digest)
+    if msg["offset"] == 0:
+        upload = blob_uploads[digest] = [hashlib.sha256(), 0]
+    if upload is None or msg["offset"] != upload[1]:
+        return
+
+    # свой .part у процесса: тот же файл могут грузить на двух воркерах
+    part = f"{path}.{os.getpid()}.part"
+    with open(part, "ab" if msg["offset"] else "wb") as f:
+        f.write(msg["data"])
+    upload[0].update(msg["data"])
+    upload[1] += len(msg["data"])
+
+    if upload[1] < msg["total"]:
+        return
+
+    del blob_uploads[digest]
+    if upload[0].hexdigest() != digest:
+        os.remove(part)
+        return
+    os.replace(part, path)
+
+    blob_ack(connection, digest)
+    blob_ready(digest)
+    if bus["writer"]:
+        publish({"type": "blob", "hash": digest})
+
+
+def blob_ready(digest):
+    # вложение собрано — отдаём тем, кто его ждал
+    for waiter in blob_waiters.pop(digest, ()):
+        queue_blob(waiter, digest)
+
+
+def queue_blob(connection, digest):
+    if not blobs["dir"] or not BLOB_HASH.match(digest) or connection.writer.is_closing():
+        return
+    if not os.path.exists(blob_path(digest)):
+        # ещё грузится — отдадим, как только загрузка закончится
+        blob_waiters.setdefault(digest, []).append(connection)
+        return
+
+    connection.blob_queue.append(digest)
+    if connection.pump is None:
+        connection.pump = asyncio.create_task(pump_blobs(connection))
+
+
+async def pump_blobs(connection):
+    transport = connection.writer.transport
+    try:
+        while connection.blob_queue:
+            digest = connection.blob_queue.popleft()
+            path = blob_path(digest)
+            total = os.path.getsize(path)
+
+            with open(path, "rb") as f:
+                offset = 0
+                while True:
+                    while transport.get_write_buffer_size() > BLOB_LOW_WATER:
+                        if transport.is_closing():
+                            return
+                        await asyncio.sleep(0.005)
+                    if transport.is_closing():
+                        return
+
+                    data = f.read(BLOB_CHUNK)
+                    send_to(connection, connection.blob({
+                        "type": "blob",
+                        "hash": digest,
+                        "offset": offset,
+                        "total": total,
+                        "data": data
+                    }))
+                    offset += len(data)
+                    if offset >= total:
+                        break
+    finally:
+        connection.pump = None
+
+
+# ================= ROUTING =================
+
+def members_of(chat_id):
+    members = chat_members.get(chat_id)
+    if members is None:
+        members = add_members(chat_id, private_members(chat_id))
+    return members
+
+
+def route(chat_id, payload, msg):
+    # шлём только участникам чата, а не всем подключённым
+    members = members_of(chat_id)
+
+    msg_id, payload = append_log(chat_id, payload)
+    msg["id"] = msg_id
+    return deliver(members, payload, msg)
+
+
+def send_all(outgoing):
+    # [(соединение, байты)] -> переполненные получатели
+    return [connection for connection, data in outgoing if send_to(connection, data)]
+
+
+def deliver(members, payload, msg=None):
+    # сообщение с id -> подключённые к этому процессу участники (id).
+    # Пересечение идёт по меньшему из множеств: группа на тысячи участников
+    # стоит O(подключённых), кто не в сети — получит из журнала при sync.
+    # msg (dict) нужен только двоичным клиентам; у воркера его нет —
+    # разбираем payload, только если такой клиент нашёлся.
+    # Не пишет в сокеты, а возвращает [(соединение, байты)]: отправляет
+    # вызывающий, когда журнал уже закоммичен
+    targets = connected.keys() & members
+    # в большой рассылке и двоичным — общий кадр (KIND_JSON): одно
+    # кодирование на режим вместо своей таблицы строк у каждого
+    shared = len(targets) >= SHARED_FRAME
+
+    encoded = {}
+    outgoing = []
+    for uid in targets:
+        connection = connected[uid]
+        if connection.syncing:
+            continue
+
+        if connection.codec == BINARY and not shared:
+            if msg is None:
+                msg = json.loads(payload)
+            data = connection.message(payload, msg)
+        else:
+            key = (connection.framing, connection.codec)
+            data = encoded.get(key)
+            if data is None:
+                data = encoded[key] = connection.frame(payload)
+        outgoing.append((connection, data))
+
+    return outgoing
+
+
+async def handle_client(reader, writer):
+    username = None
+    connection = Connection(writer)
+    try:
+        data = await reader.read(1024)
+        if not data:
+            return
+
+        username, pending = split_handshake(data)
+        loop = asyncio.get_running_loop()
+        connection.last_seen = loop.time()
+
+        # переподключение при живом старом соединении — не новый вход
+        came_online = username not in clients
+        clients[username] = connection
+        connected[user_id(username)] = connection
+        CLIENTS.set(len(clients))
+        print(f"{username} подключился")
+
+        if came_online:
+            announce(username, True)
+
+        frames = FrameReader()
+        frames.feed(pending)
+
+        while True:
+            congested = []
+            outgoing = []
+
+            for frame in frames.frames():
+                if not frame.strip():
+                    continue
+
+                msg, frame = connection.decode(frame)
+                kind = msg.get("type")
+                if metrics.ENABLED:
+                    FRAMES_IN.inc(1, kind if kind in FRAME_TYPES else "message")
+
+                if kind == "hello":
+                    # клиент просит другое кадрирование и кодек; действует со следующего кадра
+                    connection.use(msg.get("framing", LINE), msg.get("codec", JSON))
+                    frames.mode = connection.framing
+                    continue
+
+                if kind == "ping":
+                    connection.heartbeat = True
+                    send_to(connection, connection.frame(b'{"type":"pong"}'))
+                    continue
+
+                if kind == "presence":
+                    # клиент готов принимать присутствие — отдаём текущее состояние,
+                    # дальше только дельты
+                    connection.presence = True
+                    send_to(connection, connection.frame(presence_snapshot(username)))
+                    continue
+
+                if kind == "chat":
+                    add_members(msg["chat_id"], msg["members"])
+                    if "name" not in msg:
+                        continue
+                    # группа: состав и название идут участникам через журнал,
+                    # как сообщение — кто не в сети, узнает при синхронизации
+
+                if kind == "blob":
+                    receive_blob(connection, msg)
+                    continue
+
+                if kind == "fetch":
+                    queue_blob(connection, msg["hash"])
+                    continue
+
+                if kind == "sync":
+                    # клиент прислал последний известный id — отдаём пропущенное пачкой;
+                    # за следующей пачкой он придёт сам, когда разберёт эту
+                    if db and db.in_transaction:
+                        # в пачку не должно попасть то, чего ещё нет на диске
+                        db.commit()
+                    batch, more = sync_batch(username, msg.get("last_id", 0))
+                    connection.syncing = more
+                    if send_to(connection, connection.frame(batch)):
+                        congested.append(connection)
+                    continue
+
+                if not loggable(kind, msg):
+                    print(f"{username}: кадр отброшен")
+                    continue
+
+                if kind == "read" and len(members_of(msg["chat_id"])) > LARGE_CHAT:
+                    # отметка каждого участника каждому — O(участников²) кадров
+                    # и строк журнала; клиент их и не шлёт, это на случай старого
+                    continue
+
+                if bus["writer"]:
+                    # id и журнал — у хаба; получателям, и здесь тоже,
+                    # сообщение придёт от него
+                    forward(msg["chat_id"], frame, msg.get("uid"))
+                    continue
+
+                if repeated(msg.get("uid")):
+                    continue
+
+                # JSON-клиентам пересылаем исходные байты, без повторного json.dumps
+                # время — только при включённых метриках: это самый горячий путь
+                started = metrics.ENABLED and perf_counter()
+                outgoing += route(msg["chat_id"], frame, msg)
+                if started:
+                    FANOUT.observe(perf_counter() - started)
+
+            # сначала журнал на диск, потом получателям: id, который клиент уже
+            # видел, после падения релея не будет выдан заново другому сообщению
+            if db and db.in_transaction:
+                db.commit()
+            congested += send_all(outgoing)
+
+            if congested:
+                await wait_readers(congested)
+
+            if bus["writer"]:
+                # хаб не успевает — притормаживаем чтение у отправителя
+                await bus["writer"].drain()
+
+            data = await reader.read(READ_SIZE)
+            if not data:
+                break
+            connection.last_seen = loop.time()
+            frames.feed(data)
+
+    except Exception as e:
+        print("Ошибка клиента:", e)
+        ERRORS.inc()
+
+    finally:
+        if username and clients.get(username) is connection:
+            del clients[username]
+            del connected[user_id(username)]
+            CLIENTS.set(len(clients))
+            announce(username, False)
+        if connection.pump:
+            connection.pump.cancel()
+        writer.close()
+
+
+# ================= WORKERS =================
+# Один процесс упирается в одно ядро (GIL). В режиме воркеров N процессов
+# слушают один порт (SO_REUSEPORT, соединения раскидывает ядро ОС), а
+# родительский процесс — хаб — связан с каждым Unix-сокетом. Хаб выдаёт
+# id, пишет relay_log и участников (писатель базы один) и пересылает
+# сообщение тем воркерам, где сидят участники чата; кодирование под
+# каждого клиента и запись в сокеты остаются на воркерах. Журнал
+# коммитится до пересылки, поэтому воркер, отдающий sync из базы, не
+# потеряет сообщение, которое пропустил живьём. Протокол клиента тот же.
+#
+# Кадры шины — LENGTH:
+#   m<chat_id>\0<JSON сообщения> — сообщение от хаба, уже с id;
+#   m<chat_id>\0<uid>\0<JSON>     — сообщение хабу, uid может быть пустым;
+#   e<JSON>                       — событие: worker, ready, online,
+#                                   offline, members, blob.
+
+BUS_MESSAGE = b"m"
+BUS_EVENT = b"e"
+
+
+def bus_event(event):
+    return encode_frame(BUS_EVENT + json.dumps(event).encode(), LENGTH)
+
+
+def publish(event):
+    bus["writer"].write(bus_event(event))
+
+
+def forward(chat_id, frame, uid=None):
+    # uid отдельным полем: повторы хаб отбрасывает, не разбирая JSON
+    bus["writer"].write(encode_frame(
+        BUS_MESSAGE + chat_id.encode() + b"\0" + (uid or "").encode() + b"\0" + frame.strip(),
+        LENGTH
+    ))
+
+
+def worker_event(event):
+    kind = event["type"]
+
+    if kind in ("online", "offline"):
+        online = kind == "online"
+        for username in event["users"]:
+            if online:
+                online_ids.add(user_id(username))
+            else:
+                online_ids.discard(user_id(username))
+            send_presence(username, online)
+        return
+
+    if kind == "members":
+        remember_members(event["chat_id"], event["members"])
+        return
+
+    if kind == "blob":
+        blob_ready(event["hash"])
+
+
+async def read_bus(reader):
+    # сообщения и события от хаба, пока он жив
+    frames = FrameReader(LENGTH)
+    while True:
+        data = await reader.read(READ_SIZE)
+        if not data:
+            break
+        frames.feed(data)
+
+        congested = []
+        for frame in frames.frames():
+            body = frame[1:]
+            if frame[:1] == BUS_MESSAGE:
+                chat_id, _, payload = body.partition(b"\0")
+                congested += send_all(deliver(members_of(chat_id.decode()), payload))
+            else:
+                worker_event(json.loads(body))
+
+        # медленный получатель тормозит весь поток от хаба к этому воркеру,
+        # как в одном процессе он тормозил отправителя
+        if congested:
+            await wait_readers(congested)
+
+
+async def serve_worker(host, port, db_path, bus_path, index):
+    # база воркеру — только для чтения: участники при старте и sync
+    load_members(db_path)
+    load_blobs(db_path)
+
+    reader, writer = await asyncio.open_unix_connection(bus_path)
+    bus["writer"] = writer
+
+    server = await asyncio.start_server(
+        handle_client,
+        host,
+        port,
+        backlog=4096,
+        reuse_port=True
+    )
+    publish({"type": "ready", "index": index})
+    sweeper = asyncio.create_task(sweep_silent())
+
+    async with server:
+        await read_bus(reader)
+    print(f"Воркер {index}: хаб пропал, останавливаемся")
+
+
+def run_worker(host, port, db_path, bus_path, index):
+    raise_nofile_limit()
+    if metrics.ENABLED:
+        # у каждого воркера свои метрики, на следующих портах
+        metrics.serve(int(metrics.PORT) + 1 + index)
+    asyncio.run(serve_worker(host, port, db_path, bus_path, index))
+
+
+def hub_route(chat_id, frame, out):
+    msg_id, payload = append_log(chat_id, frame)
+    data = encode_frame(BUS_MESSAGE + chat_id.encode() + b"\0" + payload, LENGTH)
+
+    targets = set()
+    where = hub["where"]
+    for uid in where.keys() & members_of(chat_id):
+        targets |= where[uid]
+    for writer in targets:
+        out.setdefault(writer, []).append(data)
+
+
+def hub_broadcast(event, out, skip=None):
+    data = bus_event(event)
+    for writer in hub["workers"]:
+        if writer is not skip:
+            out.setdefault(writer, []).append(data)
+
+
+def hub_online(writer, uid, online, out):
+    where = hub["where"]
+    if online:
+        places = where.setdefault(uid, set())
+        if not places:
+            hub_broadcast({"type": "online", "users": [usernames[uid]]}, out)
+        places.add(writer)
+        return
+
+    places = where.get(uid)
+    if places is None or writer not in places:
+        return
+    places.discard(writer)
+    if not places:
+        del where[uid]
+        hub_broadcast({"type": "offline", "users": [usernames[uid]]}, out)
+
+
+def hub_event(writer, event, out):
+    kind = event["type"]
+
+    if kind == "ready":
+        hub["ready"] += 1
+        # кто уже в сети на других воркерах
+        if hub["where"]:
+            out.setdefault(writer, []).append(bus_event({"type": "online", "users": [usernames[uid] for uid in hub["where"]]}))
+        return
+
+    if kind in ("online", "offline"):
+        for username in event["users"]:
+            hub_online(writer, user_id(username), kind == "online", out)
+        return
+
+    if kind == "members":
+        known = chat_members.get(event["chat_id"], EMPTY)
+        new = [username for username in event["members"] if user_id(username) not in known]
+        if new:
+            add_members(event["chat_id"], new)
+            hub_broadcast({"type": "members", "chat_id": event["chat_id"], "members": sorted(new)}, out, writer)
+        return
+
+    if kind == "blob":
+        hub_broadcast(event, out, writer)
+
+
+def hub_flush(out):
+    # сначала журнал на диск, потом воркерам (см. начало раздела)
+    if db.in_transaction:
+        db.commit()
+    for target, chunks in out.items():
+        if not target.is_closing():
+            target.write(b"".join(chunks))
+
+
+async def handle_worker(reader, writer):
+    hub["workers"].add(writer)
+    frames = FrameReader(LENGTH)
+    try:
+        while True:
+            data = await reader.read(READ_SIZE)
+            if not data:
+                break
+            frames.feed(data)
+
+            out = {}
+            for frame in frames.frames():
+                body = frame[1:]
+                if frame[:1] == BUS_MESSAGE:
+                    chat_id, _, payload = body.partition(b"\0")
+                    uid, _, payload = payload.partition(b"\0")
+                    if not repeated(uid.decode() or None):
+                        hub_route(chat_id.decode(), payload, out)
+                else:
+                    hub_event(writer, json.loads(body), out)
+            hub_flush(out)
+
+    except Exception as e:
+        print("Ошибка воркера:", e)
+        ERRORS.inc()
+
+    finally:
+        # воркер упал — его клиенты для остальных вышли из сети
+        hub["workers"].discard(writer)
+        out = {}
+        for uid in [uid for uid, places in hub["where"].items() if writer in places]:
+            hub_online(writer, uid, False, out)
+        hub_flush(out)
+        writer.close()
+
+
+async def serve_hub(host, port, db_path, workers, ready=None):
+    load_members(db_path)
+
+    bus_path = os.path.join(tempfile.gettempdir(), f"fletgram-relay-{os.getpid()}.sock")
+    if os.path.exists(bus_path):
+        os.remove(bus_path)
+    server = await asyncio.start_unix_server(handle_worker, bus_path)
+
+    # spawn: воркер начинает с чистого интерпретатора, без копии
+    # event loop и потоков родителя
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=run_worker, args=(host, port, db_path, bus_path, index), daemon=True)
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    while hub["ready"] < workers:
+        if not all(process.is_alive() for process in processes):
+            raise RuntimeError("воркер релея не запустился")
+        await asyncio.sleep(0.05)
+    print(f"Сервер запущен, воркеров: {workers}")
+    if ready:
+        ready.set()
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        os.remove(bus_path)
+
+
+def multiprocess_supported():
+    # SO_REUSEPORT раскидывает входящие соединения по слушателям только
+    # в Linux; в macOS и BSD все достались бы одному воркеру
+    return sys.platform.startswith("linux") and hasattr(socket, "SO_REUSEPORT")
+
+
+def raise_nofile_limit():
+    # тысячи соединений упираются в лимит дескрипторов (по умолчанию 1024)
+    try:
+        import resource
+    except ImportError:
+        return
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+async def serve(host=HOST, port=PORT, db_path=DB_PATH, ready=None):
+    load_members(db_path)
+    load_blobs(db_path)
+
+    server = await asyncio.start_server(
+        handle_client,
+        host,
+        port,
+        backlog=4096
+    )
+    print("Сервер запущен")
+    if ready:
+        ready.set()
+
+    # ссылку держим, иначе задачу может собрать GC
+    sweeper = asyncio.create_task(sweep_silent())
+
+    async with server:
+        await server.serve_forever()
+
+
+def run(host=HOST, port=PORT, db_path=DB_PATH, workers=1, ready=None):
+    # workers > 1 — хаб в этом процессе и воркеры в дочерних (см. WORKERS);
+    # не в Linux остаётся один процесс
+    if workers > 1 and not multiprocess_supported():
+        print("Воркеры здесь не поддерживаются, релей в одном процессе")
+        workers = 1
+    if workers > 1:
+        asyncio.run(serve_hub(host, port, db_path, workers, ready))
+    else:
+        asyncio.run(serve(host, port, db_path, ready))
+
+
+def start_server(host=HOST, port=PORT, db_path=DB_PATH, workers=1):
+    # один поток с event loop вместо потока на каждого клиента;
+    # возвращает Event, который встанет, когда релей начнёт принимать соединения
+    ready = threading.Event()
+    threading.Thread(
+        target=run,
+        args=(host, port, db_path, workers, ready),
+        daemon=True
+    ).start()
+    return ready
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FletGram relay")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--workers", type=int, default=1, help="процессов, обычно по числу ядер")
+    args = parser.parse_args()
+
+    raise_nofile_limit()
+    metrics.serve()
+    run(args.host, args.port, args.db, args.workers)
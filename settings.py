@@ -0,0 +1,64 @@
+# ================= SETTINGS =================
+# Типизированный доступ к настройкам приложения. Читает кеш Database
+# (таблица settings загружается один раз при открытии базы), пишет без
+# ожидания диска. Новая настройка — ещё одно свойство здесь, а не
+# строковый ключ, разбросанный по main.py.
+
+THEMES = ("dark", "light")
+
+
+class Settings:
+
+    def __init__(self, db):
+        self.db = db
+
+    def text(self, key, default=""):
+        value = self.db.get_setting(key)
+        return default if value is None else str(value)
+
+    def number(self, key, default=0):
+        # на диске всё лежит строкой
+        try:
+            return int(self.db.get_setting(key, default))
+        except (TypeError, ValueError):
+            return default
+
+    # ---------- оформление ----------
+
+    @property
+    def theme(self):
+        value = self.text("theme", THEMES[0])
+        return value if value in THEMES else THEMES[0]
+
+    @theme.setter
+    def theme(self, value):
+        self.db.set_setting("theme", value)
+
+    # ---------- автовход ----------
+
+    @property
+    def last_user(self):
+        # None — автовхода нет
+        return self.text("last_user") or None
+
+    @property
+    def last_user_name(self):
+        # имя храним рядом, чтобы автовход не ходил в users
+        return self.db.get_setting("last_user_name")
+
+    def remember_user(self, username, name):
+        self.db.set_setting("last_user", username)
+        self.db.set_setting("last_user_name", name)
+
+    def forget_user(self):
+        self.db.set_setting("last_user", "")
+        self.db.set_setting("last_user_name", None)
+
+    # ---------- синхронизация ----------
+
+    def sync_id(self, username):
+        # последний id релея, до которого история уже есть локально
+        return self.number("sync_id:" + username)
+
+    def set_sync_id(self, username, last_id):
+        self.db.set_setting("sync_id:" + username, last_id)
@@ -0,0 +1,51 @@
+import json
+import os
+
+
+# ================= SNAPSHOT =================
+# Снимок того, что было на экране: строки списка чатов и последние
+# сообщения недавних чатов. Пишется, когда приложение уходит в фон,
+# читается при старте — первый кадр рисуется из него, не дожидаясь
+# базы, а сверка с базой идёт уже после.
+
+SNAPSHOT_PATH = "snapshot.json"
+VERSION = 1  # другой формат — снимок просто не используется
+
+
+def save_snapshot(username, chats, history, avatars, path=SNAPSHOT_PATH):
+    # chats — строки chat_list, history — chat_id -> строки db.history,
+    # avatars — users.avatar -> уже найденный файл превью
+    data = {
+        "version": VERSION,
+        "user": username,
+        "chats": chats,
+        "history": history,
+        "avatars": avatars
+    }
+
+    # через временный файл: процесс могут убить посреди записи
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def load_snapshot(username, path=SNAPSHOT_PATH):
+    # None — снимка нет, он чужой или битый
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if data.get("version") != VERSION or data.get("user") != username:
+        return None
+    return data
+
+
+def drop_snapshot(path=SNAPSHOT_PATH):
+    # при выходе из аккаунта: чужой список чатов не должен мелькнуть
+    try:
+        os.remove(path)
+    except OSError:
+        pass